@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Exports the history of the exchange rates and the transaction totals as OpenMetrics files for promtool """
+
+import datetime
+import logging
+import os
+import time
+from prometheus_client.utils import floatToGoString
+
+log = logging.getLogger('crypto-exporter')
+
+
+def parse_time(value: str) -> float:
+    """ Parses UNIX time or an ISO 8601 date or time (UTC, if no time zone is given) to UNIX time """
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+
+def _escape(value: str) -> str:
+    """ Escapes the label value for the exposition format """
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _transaction_labels(key: tuple, exchange: str) -> dict:
+    """ Returns the labels of the transaction totals, with the credential set of API_KEYS as `account` """
+    labels = {'currency': key[0], 'reference_currency': key[1], 'exchange': exchange, 'type': key[2]}
+    if len(key) == 4:
+        labels['account'] = key[3]
+    return labels
+
+
+class OpenMetricsWriter():  # pylint: disable=too-many-instance-attributes
+    """
+    Writes the samples to numbered OpenMetrics files, each ending with `# EOF`
+
+    A file is finished when it would grow beyond `chunk_size` bytes or when next_file() is called; the metric family
+    being written continues in the next file, with its header repeated.
+    """
+
+    def __init__(self, directory: str, prefix: str, chunk_size: int):
+        self.directory = directory
+        self.prefix = prefix
+        self.chunk_size = chunk_size
+        self.files = []
+        self.samples = 0
+        self.__file = None
+        self.__size = 0
+        self.__family = None
+        self.__header = ''
+        self.__pending_header = False
+
+    def __open(self):
+        """ Starts the next file """
+        path = os.path.join(self.directory, f'{self.prefix}-{len(self.files):05d}.om')
+        self.__file = open(path, 'w', encoding='utf-8')  # pylint: disable=consider-using-with
+        self.__size = 0
+        self.files.append(path)
+        self.__pending_header = True
+
+    def __write(self, text: str):
+        """ Writes to the current file """
+        self.__file.write(text)
+        self.__size += len(text)
+
+    def next_file(self):
+        """ Finishes the current file. The next sample starts a new one. """
+        if self.__file:
+            self.__write('# EOF\n')
+            self.__file.close()
+            log.info(f'Wrote {self.files[-1]} ({self.__size / 1048576:.1f} MiB)')
+            self.__file = None
+
+    def family(self, name: str, metric_type: str, documentation: str):
+        """ Starts a metric family """
+        self.__family = name
+        self.__header = f'# HELP {name} {documentation}\n# TYPE {name} {metric_type}\n'
+        self.__pending_header = True
+
+    def sample(self, labels: dict, value: float, timestamp: float):
+        """ Writes a sample of the current metric family """
+        label_text = ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+        line = f'{self.__family}{{{label_text}}} {floatToGoString(value)} {timestamp:.3f}\n'
+        header = self.__header if self.__pending_header else ''
+        if self.__file and self.__size + len(header) + len(line) + len('# EOF\n') > self.chunk_size:
+            self.next_file()
+        if not self.__file:
+            self.__open()
+        if self.__pending_header:
+            # the header is written before the first sample of the family in every file
+            self.__write(self.__header)
+            self.__pending_header = False
+        self.__write(line)
+        self.samples += 1
+
+    def close(self):
+        """ Finishes the last file """
+        self.next_file()
+
+
+class Backfill():  # pylint: disable=too-few-public-methods
+    """
+    Computes the `exchange_rate` and the `transactions_total` series of a ccxt connector at fixed steps
+
+    The range is processed in windows of `window` steps. Every window gets its own files, so a file covers a bounded
+    time range and the memory stays bounded: only the candles of one page and the ledger are held at a time.
+    """
+
+    def __init__(self, connector, start: float, *, end=None, timeframe='1h',  # pylint: disable=too-many-arguments
+                 directory='.', chunk_size=67108864, window=500):
+        self.connector = connector
+        self.timeframe = timeframe
+        self.step = connector.get_timeframe_seconds(timeframe)
+        # the candles start at multiples of the timeframe
+        self.start = start - start % self.step
+        self.end = end or time.time()
+        self.window = window
+        self.writer = OpenMetricsWriter(directory, connector.exchange, chunk_size)
+
+    def __write_rates(self, symbols: list, window_start: float, window_end: float):
+        """ Writes the exchange rates of the window """
+        self.writer.family('exchange_rate', 'gauge', 'Current exchange rates')
+        for symbol in symbols:
+            currency, reference_currency = symbol.split('/')[:2]
+            labels = {
+                'currency': currency,
+                'reference_currency': reference_currency,
+                'exchange': self.connector.exchange,
+            }
+            for timestamp, value in self.connector.fetch_rate_history(symbol, self.timeframe, window_start, window_end):
+                self.writer.sample(labels, value, timestamp)
+
+    def __write_transactions(self, transactions, pending, window_end: float):
+        """
+        Writes the transaction totals of the window
+
+        :param pending: The first (timestamp, totals) of `transactions` not written yet
+        :return: The first (timestamp, totals) after the window
+        """
+        self.writer.family('transactions_total', 'gauge', 'The transaction history for an account')
+        while pending and pending[0] < window_end:
+            timestamp, totals = pending
+            for key, value in totals.items():
+                self.writer.sample(_transaction_labels(key, self.connector.exchange), value, timestamp)
+            pending = next(transactions, None)
+        return pending
+
+    def run(self) -> list:
+        """ Writes the files and returns their paths """
+        started = time.time()
+        symbols = self.connector.get_history_symbols()
+        log.info((
+            f'Backfilling {len(symbols)} pairs of {self.connector.exchange} from {time.ctime(self.start)}'
+            f' to {time.ctime(self.end)} in steps of {self.timeframe}'
+        ))
+        transactions = self.connector.get_transaction_history(self.step, self.start, self.end)
+        pending = next(transactions, None)
+        window_start = self.start
+        while window_start < self.end:
+            window_end = min(self.end, window_start + self.step * self.window)
+            self.__write_rates(symbols, window_start, window_end)
+            pending = self.__write_transactions(transactions, pending, window_end)
+            self.writer.next_file()
+            window_start = window_end
+        self.writer.close()
+        log.info((
+            f'Backfilled {self.writer.samples} samples into {len(self.writer.files)} files'
+            f' in {time.time() - started:.1f}s'
+        ))
+        return self.writer.files
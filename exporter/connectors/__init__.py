@@ -1,2 +1,36 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+""" The connectors for the exchanges and the blockchains """
+
+
+def get_connector(exchange: str, settings=None):
+    """
+    Builds the connector for the exchange. The connector modules are only imported when needed.
+
+    :param exchange: The name of the exchange (`etherscan`, `ripple`, ... or a ccxt exchange id)
+    :param settings: If set, the settings are read from this dict instead of the environment
+    :return: The connector instance
+    """
+    # pylint: disable=import-outside-toplevel
+    if exchange == 'etherscan':
+        from .etherscan_connector import EtherscanConnector
+        connector = EtherscanConnector(settings=settings)
+    elif exchange == 'ethplorer':
+        from .ethplorer_connector import EthplorerConnector
+        connector = EthplorerConnector(settings=settings)
+    elif exchange == 'blockscout':
+        from .blockscout_connector import BlockscoutConnector
+        connector = BlockscoutConnector(settings=settings)
+    elif exchange == 'blockchain':
+        from .blockchain_connector import BlockchainConnector
+        connector = BlockchainConnector(settings=settings)
+    elif exchange == 'ripple':
+        from .ripple_connector import RippleConnector
+        connector = RippleConnector(settings=settings)
+    elif exchange == 'stellar':
+        from .stellar_connector import StellarConnector
+        connector = StellarConnector(settings=settings)
+    else:
+        from .ccxt_connector import CcxtConnector
+        connector = CcxtConnector(exchange=exchange, settings=settings)
+    return connector
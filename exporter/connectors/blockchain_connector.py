@@ -3,16 +3,21 @@
 """ Handles the blockchain.info data and communication """
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
 import requests
 from ..lib import utils
+from ..lib.log import trace
 from .connector import Connector
 
 log = logging.getLogger('crypto-exporter')
 
+XPUB_PREFIXES = ('xpub', 'ypub', 'zpub')
+
 
 class BlockchainConnector(Connector):
     """ The BlockchainConnector class """
     settings = {}
+    reconfigurable = ['addresses']
     params = {
         'addresses': {
             'key_type': 'list',
@@ -24,40 +29,164 @@ class BlockchainConnector(Connector):
             'default': 'https://blockchain.info',
             'mandatory': False,
         },
+        'chunk_size': {
+            'key_type': 'int',
+            'default': 50,
+            'mandatory': False,
+        },
+        'concurrency': {
+            'key_type': 'int',
+            'default': 4,
+            'mandatory': False,
+        },
+        'xpub_addresses': {
+            'key_type': 'bool',
+            'default': False,
+            'mandatory': False,
+        },
     }
 
-    def __init__(self):
+    def __init__(self, settings=None):
         self.exchange = 'blockchain'
         self.params.update(super().params)  # merge with the global params
-        self.settings = utils.gather_environ(self.params)
+        self.settings = utils.gather_environ(self.params, values=settings)
+        self.__executor = ThreadPoolExecutor(
+            max_workers=max(1, self.settings['concurrency']),
+            thread_name_prefix='blockchain',
+        )
+        self.__xpubs = {}  # the cached balances of the derived addresses per HD wallet
         super().__init__()
 
-    def retrieve_accounts(self):
-        """ Connects to the blockchain API and retrieves the account information """
-        if not self.settings['addresses']:
-            return
-        addresses = '|'.join(self.settings['addresses'])
-        url = f"{self.settings['url']}/balance"
-        request_data = {
-            'active': addresses,
-        }
-
+    def __get(self, path: str, request_data: dict):
+        """ Sends the request to the blockchain API and returns the decoded response or None, if it failed """
+        url = f"{self.settings['url']}/{path}"
         try:
-            r = requests.get(url, params=request_data, timeout=self.settings['timeout']).json()
+            r, _ = self._get_json(url, params=request_data)
         except (
                 requests.exceptions.ConnectionError,
-                requests.exceptions.ReadTimeout
+                requests.exceptions.ReadTimeout,
+                requests.exceptions.HTTPError,
+                ValueError,
         ) as e:
             log.warning(f"Can't connect to {self.settings['url']}. Exception caught: {utils.short_msg(e)}")
+            return None
+        return r
+
+    def __fetch_balances(self, chunk: list) -> dict:
+        """ Retrieves the balances for one chunk of addresses (and xpubs) """
+        log.debug(f'Fetching the balances for {len(chunk)} addresses')
+        return self.__get('balance', {'active': '|'.join(chunk)}) or {}
+
+    def __walk_xpub(self, xpub: str, wallet: dict, new_txs=None) -> bool:
+        """
+        Applies the transactions of an HD wallet to the balances of its derived addresses
+
+        The transactions are read newest first. Already applied transactions are skipped.
 
-        for address in self.settings['addresses']:
+        :param wallet: The balances in satoshi (`balances`) and the applied transactions (`txs`), updated in place
+        :param new_txs: Stop after this many transactions, None to walk the whole history
+        :return: False, if a page could not be read
+        """
+        offset = 0
+        page_size = 100
+        while True:
+            r = self.__get('multiaddr', {'active': xpub, 'n': page_size, 'offset': offset})
+            if r is None:
+                return False
+            txs = r.get('txs', [])
+            for tx in txs:
+                if tx.get('hash') in wallet['txs']:
+                    continue
+                wallet['txs'].add(tx.get('hash'))
+                balances = wallet['balances']
+                for output in tx.get('out', []):
+                    if output.get('xpub', {}).get('m') == xpub:
+                        balances[output['addr']] = balances.get(output['addr'], 0) + int(output['value'])
+                for tx_input in tx.get('inputs', []):
+                    prev_out = tx_input.get('prev_out', {})
+                    if prev_out.get('xpub', {}).get('m') == xpub:
+                        balances[prev_out['addr']] = balances.get(prev_out['addr'], 0) - int(prev_out['value'])
+            offset += len(txs)
+            if len(txs) < page_size or (new_txs is not None and offset >= new_txs):
+                return True
+
+    def __fetch_xpub_addresses(self, xpub: str, summary) -> dict:
+        """
+        Returns the balances of the derived addresses of an HD wallet in satoshi
+
+        The balances are cached with the transaction count of the wallet. Only when it grew, the new transactions
+        are read; the whole history only for a new wallet or if the sum doesn't match the wallet balance anymore.
+        If a page fails, the last balances are kept.
+
+        :param xpub: The xpub, ypub or zpub of the wallet
+        :param summary: The wallet from the `balance` response (`n_tx`, `final_balance`) or None, if it failed
+        """
+        cached = self.__xpubs.get(xpub)
+        if not summary:
+            return cached['balances'] if cached else {}
+        n_tx = int(summary.get('n_tx', 0))
+        if cached and cached['n_tx'] == n_tx:
+            return cached['balances']
+
+        wallet = None
+        if cached and n_tx > cached['n_tx']:
+            wallet = {'balances': dict(cached['balances']), 'txs': set(cached['txs'])}
+            if not self.__walk_xpub(xpub, wallet, new_txs=n_tx - cached['n_tx']):
+                log.warning(f'Could not read the new transactions of {xpub[:12]}... Keeping the last balances.')
+                return cached['balances']
+            if sum(wallet['balances'].values()) != int(summary.get('final_balance', 0)):
+                log.debug(f'The derived balances of {xpub[:12]}... are off. Reading the whole history.')
+                wallet = None
+        if wallet is None:
+            wallet = {'balances': {}, 'txs': set()}
+            if not self.__walk_xpub(xpub, wallet):
+                log.warning(f'Could not read the transactions of {xpub[:12]}... Keeping the last balances.')
+                return cached['balances'] if cached else {}
+
+        # the emptied addresses (mostly the spent change) aren't exported anymore
+        wallet['balances'] = {address: balance for address, balance in wallet['balances'].items() if balance}
+        wallet['n_tx'] = n_tx
+        self.__xpubs[xpub] = wallet
+        return wallet['balances']
+
+    def stop(self):
+        """ Stops the threads of the concurrent requests """
+        self.__executor.shutdown(wait=False)
+
+    def retrieve_accounts(self):
+        """ Connects to the blockchain API and retrieves the account information """
+        if not self.settings['addresses']:
+            return
+        addresses = self.settings['addresses']
+        chunk_size = max(1, self.settings['chunk_size'])
+        chunks = [addresses[i:i + chunk_size] for i in range(0, len(addresses), chunk_size)]
+
+        r = {}
+        for balances in self.__executor.map(self.__fetch_balances, chunks):
+            r.update(balances)
+
+        previous = self._accounts.get('BTC', {})
+        accounts = {}
+        for address in addresses:
             if r.get(address):
-                balance = float(int(r.get(address).get('final_balance')) / 100000000)
-                if not self._accounts.get('BTC'):
-                    self._accounts.update({'BTC': {}})
-                self._accounts['BTC'].update({
-                    address: balance,
-                })
+                accounts[address] = float(int(r.get(address).get('final_balance')) / 100000000)
             else:
-                log.warning('Could not retrieve balance. The result follows.')
-                log.warning(f"{r.get('result')}: {r.get('message')}")
+                log.warning(f'Could not retrieve the balance for {address}')
+                if address in previous:
+                    accounts[address] = previous[address]
+
+        if self.settings['xpub_addresses']:
+            xpubs = [address for address in addresses if address.startswith(XPUB_PREFIXES)]
+            summaries = [r.get(xpub) for xpub in xpubs]
+            for derived in self.__executor.map(self.__fetch_xpub_addresses, xpubs, summaries):
+                for address, balance in derived.items():
+                    accounts[address] = float(balance / 100000000)
+            # the wallets that were removed from the settings
+            for xpub in set(self.__xpubs) - set(xpubs):
+                del self.__xpubs[xpub]
+
+        # a new dict, so the removed addresses disappear and a concurrent scrape never sees a half update
+        self._accounts = {'BTC': accounts} if accounts else {}
+        if r:
+            self._set_timestamp('accounts')
+        trace(log, lambda: f"Found the following accounts: {self._accounts}")
@@ -5,15 +5,24 @@
 import logging
 import requests
 from ..lib import utils
+from ..lib.log import trace
 from .connector import Connector
 
 log = logging.getLogger('crypto-exporter')
 
+# the fields of tokenlist used by __parse_tokens()
+TOKENLIST_FIELDS = {
+    'error': True,
+    'message': True,
+    'result': [{'contractAddress': True, 'symbol': True, 'decimals': True, 'balance': True}],
+}
 
-class BlockscoutConnector(Connector):
+
+class BlockscoutConnector(Connector):  # pylint: disable=too-many-instance-attributes
     """ The BlockscoutConnector class """
 
     settings = {}
+    reconfigurable = ['addresses']
     params = {
         'addresses': {
             'key_type': 'list',
@@ -27,10 +36,16 @@ class BlockscoutConnector(Connector):
         },
     }
 
-    def __init__(self):
+    def __init__(self, settings=None):
         self.exchange = 'blockscout'
         self.params.update(super().params)  # merge with the global params
-        self.settings = utils.gather_environ(self.params)
+        self.params.update(super().token_params)
+        self.params.update(super().cache_params)
+        self.settings = utils.gather_environ(self.params, values=settings)
+        self.__tokens = {}
+        self.__loaded_at = []
+        self.__index = self._token_index()
+        self.cache = self._response_cache()
         super().__init__()
 
     def prepare_request(self, request_data: dict) -> dict:
@@ -41,88 +56,105 @@ class BlockscoutConnector(Connector):
             request_data.update({'module': 'account'})
         return request_data
 
-    def __load_retry(self, request_data: dict, retries=5):
-        """ Tries up to {retries} times to call the api and then gives up """
-        response = None
-        retry = True
+    def __on_http_error(self, e: requests.exceptions.HTTPError) -> bool:
+        """ Handles the HTTP error of a request. The request is always retried. """
+        error = self.redact(str(e))
+        if e.response.status_code == 429:
+            self.rate_limit_hits += 1
+            utils.ddos_protection_handler(error=error, sleep=1, shortify=False)
+        else:
+            utils.generic_error_handler(error)
+        return True
+
+    def __load_retry(self, request_data: dict, retries=5, fields=None):
+        """
+        Tries up to {retries} times to call the api and then gives up
+
+        :param fields: Only these fields of the response are decoded
+
+        :return: The tuple (result, changed)
+        """
         result = None
-        count = 0
         log.debug(f'Loading data for {request_data} with {retries} retries')
         request_data = self.prepare_request(request_data)
-        url = self.settings['url']
-        while retry:
-            try:
-                count += 1
-                if count > retries:
-                    log.warning('Maximum number of retries reached. Giving up.')
-                    log.debug(f'Reached max retries while loading {url}')
-                else:
-                    req = requests.get(url, params=request_data, timeout=self.settings['timeout'])
-                    req.raise_for_status()
-                    response = req.json()
-                retry = False
-            except requests.exceptions.Timeout as e:
-                error = self.redact(str(e))
-                utils.exchange_not_available_handler(error=error, shortify=False, sleep=2)
-            except requests.exceptions.HTTPError as e:
-                error = self.redact(str(e))
-                if e.response.status_code == 429:
-                    utils.ddos_protection_handler(error=error, sleep=1, shortify=False)
-                else:
-                    utils.generic_error_handler(self.redact(error))
-            except requests.exceptions.RequestException as e:
-                error = self.redact(str(e))
-                log.warning(f"Fatal error connecting to {self.settings['url']}. Exception caught: {error}")
-                retry = False
-
-            if response:
-                if response.get('error'):
-                    utils.generic_error_handler(self.redact(response.get('error')))
-                else:
-                    result = response
-
-        return result
+        response, changed = self._get_json_retry(
+            self.settings['url'], params=request_data, retries=retries, fields=fields,
+            on_http_error=self.__on_http_error,
+        )
+        if response:
+            if response.get('error'):
+                utils.generic_error_handler(self.redact(response.get('error')))
+            else:
+                result = response
+
+        return result, changed
+
+    def __load_cached(self, request_data: dict, retries=5, fields=None):
+        """ Loads the request through the cache """
+        key = repr(sorted(request_data.items()))
+        loaded = self.cache.get(
+            key,
+            lambda: self.__load_retry(dict(request_data), retries=retries, fields=fields),
+            valid=lambda loaded: loaded[0] is not None,
+        )
+        self.__loaded_at.append(self.cache.loaded_at(key))
+        return loaded
+
+    def __parse_tokens(self, tokens: dict) -> dict:
+        """ Returns the token balances of one account, with the token as key """
+        balances = {}
+        for token in tokens['result']:
+            # Ignores the low quality tokens
+            metadata = self.__index.lookup(token.get('contractAddress'), token)
+            if not metadata:
+                continue
+
+            balance = token.get('balance', 0)
+            if not balance:
+                balance = 0
+
+            balances[metadata['symbol']] = float(int(balance) / metadata['scale'])
+        return balances
+
+    def _reconfigured(self, previous: dict):
+        """ Also drops the parsed tokens of the removed addresses """
+        super()._reconfigured(previous)
+        self.__tokens = {
+            address: tokens for address, tokens in self.__tokens.items() if address in self.settings['addresses']
+        }
 
     def retrieve_accounts(self):
         """ Gets the current balance for an account """
         self._accounts = {'ETH': {}}
+        self.__loaded_at = []
         log.debug('Retrieving the account balances')
-        balances = self.__load_retry({
+        balances, _ = self.__load_cached({
             'action': 'balancemulti',
             'address': ','.join(self.settings['addresses'])
         })
-        if balances.get('message') == 'OK':
+        if balances and balances.get('message') == 'OK':
             for balance in balances['result']:
                 self._accounts['ETH'].update({
                     balance['account']: float(balance['balance'])/(1000000000000000000),
                 })
-        for account in self._accounts['ETH']:
-            tokens = self.__load_retry({
+        for account in list(self._accounts['ETH']):
+            tokens, changed = self.__load_cached({
                 'action': 'tokenlist',
                 'address': account,
-            })
-            if tokens.get('message') == 'OK':
-                for token in tokens['result']:
-                    token_name = token.get('symbol')
-                    if not token_name or len(token_name) > 15:
-                        break
+            }, fields=TOKENLIST_FIELDS)
+            if tokens and tokens.get('message') == 'OK':
+                # unchanged responses are neither decoded nor parsed again
+                if changed or account not in self.__tokens:
+                    self.__tokens[account] = self.__parse_tokens(tokens)
+                for token_name, balance in self.__tokens[account].items():
                     if not self._accounts.get(token_name):
                         self._accounts.update({token_name: {}})
-
-                    token_decimals = token.get('decimals', 0)
-                    if not token_decimals:
-                        token_decimals = 0
-
-                    balance = token.get('balance', 0)
-                    if not balance:
-                        balance = 0
-
-                    if int(token_decimals) > 0:
-                        balance = int(balance) / (10**int(token_decimals))
-
                     self._accounts[token_name].update({
-                        account: float(balance)
+                        account: balance
                     })
 
-        log.log(5, f'Accounts: {self._accounts}')
+        self.__index.save()
+        # the oldest cached response is the age of the balances. The failed loads have no age.
+        self._set_oldest_timestamp('accounts', self.__loaded_at)
+        trace(log, lambda: f'Accounts: {self._accounts}')
         return self._accounts
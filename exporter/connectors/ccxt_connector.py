@@ -2,19 +2,147 @@
 # -*- coding: utf-8 -*-
 """ Handles the exchange data and communication """
 
+import asyncio
+import hashlib
 import logging
-import ccxt
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from ..lib import constants
 from ..lib import utils
+from ..lib.lazy_ccxt import ccxt, get_exchange, get_pro_exchange
+from ..lib.log import trace
 from .connector import Connector
 
 log = logging.getLogger('crypto-exporter')
 
+# the candles requested per page of the rate history, which most exchanges serve in one request
+OHLCV_LIMIT = 500
 
-class CcxtConnector(Connector):
+
+class TickerStream():  # pylint: disable=too-many-instance-attributes
+    """
+    Watches the tickers over the WebSocket API of the exchange (ccxt.pro) in a background thread
+
+    Every update is passed to `on_tickers`, so the tickers are updated incrementally. When the connection fails, a
+    new connection is made and the tickers are subscribed again, with an exponential backoff. While the stream is
+    not `healthy()`, the connector polls the tickers over REST.
+    """
+
+    def __init__(self, exchange_class, options: dict, symbols, on_tickers, max_age=60):
+        """
+        :param symbols: Called with the markets, returns the symbols to watch (None for all)
+        :param max_age: The stream is unhealthy, if there was no update for this many seconds
+        """
+        self.exchange_class = exchange_class
+        self.options = options
+        self.symbols = symbols
+        self.on_tickers = on_tickers
+        self.max_age = max_age
+        self.last_update = 0
+        self.reconnects = 0
+        self.__stop = threading.Event()
+        self.__loop = None
+        self.__task = None
+
+    def healthy(self) -> bool:
+        """ Checks if the stream delivered an update within `max_age` seconds """
+        return time.time() - self.last_update < self.max_age
+
+    def start(self):
+        """ Starts the stream in a daemon thread """
+        threading.Thread(target=self.__run, name='ticker-stream', daemon=True).start()
+
+    def stop(self):
+        """ Stops the stream """
+        self.__stop.set()
+        if self.__loop and self.__task:
+            self.__loop.call_soon_threadsafe(self.__task.cancel)
+
+    def __run(self):
+        """ Runs the event loop of the stream """
+        self.__loop = asyncio.new_event_loop()
+        self.__task = self.__loop.create_task(self.__stream())
+        try:
+            self.__loop.run_until_complete(self.__task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.__loop.close()
+
+    @staticmethod
+    async def __watch_each(exchange, symbols: list, watching: dict) -> dict:
+        """ Watches every symbol on its own and returns the tickers, which were updated first """
+        for symbol in symbols:
+            if symbol not in watching:
+                watching[symbol] = asyncio.ensure_future(exchange.watch_ticker(symbol))
+        done, _ = await asyncio.wait(watching.values(), return_when=asyncio.FIRST_COMPLETED)
+        tickers = {}
+        for symbol, task in list(watching.items()):
+            if task in done:
+                del watching[symbol]
+                tickers[symbol] = task.result()
+        return tickers
+
+    async def __stream(self):
+        """ Connects, subscribes and passes the updates on until stopped """
+        backoff = 1
+        watching = {}
+        while not self.__stop.is_set():
+            exchange = self.exchange_class(dict(self.options))
+            try:
+                markets = await exchange.load_markets()
+                symbols = self.symbols(markets)
+                log.info(f"Streaming the tickers of {exchange.id} for {len(symbols) if symbols else 'all the'} symbols")
+                while not self.__stop.is_set():
+                    if exchange.has.get('watchTickers'):
+                        tickers = await exchange.watch_tickers(symbols)
+                    else:
+                        tickers = await self.__watch_each(exchange, symbols, watching)
+                    self.last_update = time.time()
+                    backoff = 1
+                    self.on_tickers(tickers)
+            except Exception as e:  # pylint: disable=broad-except
+                self.reconnects += 1
+                log.warning(f'The ticker stream failed. Reconnecting in {backoff}s. Exception: {utils.short_msg(e)}')
+            finally:
+                for task in watching.values():
+                    task.cancel()
+                watching.clear()
+                await exchange.close()
+            await asyncio.sleep(backoff)
+            backoff = min(60, backoff * 2)
+
+
+class SharedThrottle():  # pylint: disable=too-few-public-methods
+    """
+    Spaces the requests of several ccxt instances by the rate limit of the exchange
+
+    Every sync ccxt instance throttles only its own requests. The instances of the API_KEYS share the rate limit of
+    the exchange (mostly per IP), so they reserve the time slots for their requests here instead.
+    """
+
+    def __init__(self, rate_limit: float):
+        """ :param rate_limit: The milliseconds between two requests of cost 1 (`Exchange.rateLimit`) """
+        self.rate_limit = rate_limit
+        self.__next = 0.0  # monotonic
+        self.__lock = threading.Lock()
+
+    def throttle(self, cost=None):
+        """ Waits for the next free slot. Replaces `Exchange.throttle()`. """
+        with self.__lock:
+            now = time.monotonic()
+            start = max(now, self.__next)
+            self.__next = start + self.rate_limit * (1 if cost is None else cost) / 1000
+        if start > now:
+            time.sleep(start - now)
+
+
+class CcxtConnector(Connector):  # pylint: disable=too-many-instance-attributes
     """ The CCXT Connector class """
 
     settings = {}
+    reconfigurable = ['symbols', 'reference_currencies']
     params = {
         'api_key': {
             'key_type': 'string',
@@ -40,6 +168,17 @@ class CcxtConnector(Connector):
             'mandatory': False,
             'redact': True,
         },
+        'api_keys': {
+            'key_type': 'json',
+            'default': None,
+            'mandatory': False,
+            'redact': True,
+        },
+        'api_keys_concurrency': {
+            'key_type': 'int',
+            'default': 4,
+            'mandatory': False,
+        },
         'enable_tickers': {
             'key_type': 'bool',
             'default': True,
@@ -75,30 +214,114 @@ class CcxtConnector(Connector):
             'default': 'milliseconds',
             'mandatory': False,
         },
+        'stream_tickers': {
+            'key_type': 'bool',
+            'default': False,
+            'mandatory': False,
+        },
+        'stream_max_age': {
+            'key_type': 'int',
+            'default': 60,
+            'mandatory': False,
+        },
     }
 
-    def __init__(self, exchange):
+    def __init__(self, exchange, settings=None):
         self.exchange = exchange
         self.params.update(super().params)  # merge with the global params
-        self.settings = utils.gather_environ(self.params)
+        self.settings = utils.gather_environ(self.params, values=settings)
         self.settings['enable_authentication'] = None
-        __exchange = getattr(ccxt, self.exchange)
+        __exchange = get_exchange(self.exchange)
         exchange_options = {
             'enableRateLimit': True,
             'nonce': getattr(__exchange, self.settings['nonce']),
             'defaultType': self.settings['default_exchange_type'],
             'timeout': self.settings['timeout'] * 1000,  # ccxt expects the timeout in milliseconds
+            'session': utils.get_session(),
         }
+        self.__exchange_class = __exchange
+        self.__exchange_options = exchange_options
         self.__exchange = __exchange(exchange_options)
+        self.__key_sets = {}  # the ccxt instance of every credential set of API_KEYS
+        self.__key_set_times = {}  # the timestamp of the balance of every credential set
+        self.__executor = None
         self.__markets = None
+        self.__hashes = {}
+        self.__stream = None
+        self.__tickers_lock = threading.Lock()
         super().__init__()
+        if self.settings['stream_tickers'] and self.settings['enable_tickers']:
+            self.__start_stream()
+
+    def __start_stream(self):
+        """ Streams the tickers over the WebSocket API of the exchange, if ccxt.pro supports it """
+        exchange_class = get_pro_exchange(self.exchange)
+        if not exchange_class:
+            log.warning(f'ccxt.pro does not support {self.exchange}. Polling the tickers instead.')
+            return
+        has = exchange_class().has
+        if not has.get('watchTickers') and not (has.get('watchTicker') and self.settings['symbols']):
+            log.warning(f'{self.exchange} can not stream the tickers. Polling the tickers instead.')
+            return
+        self.__stream = TickerStream(
+            exchange_class,
+            options={'enableRateLimit': True, 'timeout': self.settings['timeout'] * 1000},
+            symbols=self.__selected_symbols,
+            on_tickers=self.__process_tickers,
+            max_age=self.settings['stream_max_age'],
+        )
+        self.__stream.start()
+
+    def stop(self):
+        """ Stops the ticker stream and the threads of the API_KEYS """
+        if self.__stream:
+            self.__stream.stop()
+        if self.__executor:
+            self.__executor.shutdown(wait=False)
+
+    def _reconfigured(self, previous: dict):
+        """ Restarts the ticker stream with the new selection of symbols and drops the tickers no longer streamed """
+        if not self.__stream:
+            return
+        self.__stream.stop()
+        self.__stream = None
+        symbols = self.settings['symbols']
+        reference_currencies = self.settings['reference_currencies']
+        with self.__tickers_lock:
+            for symbol, pair in list(self._tickers.items()):
+                if symbols and symbol not in symbols or (
+                        not symbols and reference_currencies and pair['reference_currency'] not in reference_currencies
+                ):
+                    del self._tickers[symbol]
+        self.__start_stream()
+
+    def __selected_symbols(self, markets: dict):
+        """ Returns the SYMBOLS or the symbols with one of the REFERENCE_CURRENCIES, None for all """
+        if self.settings['symbols']:
+            return self.settings['symbols']
+        if self.settings['reference_currencies']:
+            return [
+                symbol for symbol, market in markets.items()
+                if market.get('quote') in self.settings['reference_currencies']
+            ]
+        return None
 
     def get_enable_authentication(self):
         """ Returns the status of the authentication """
         return self.settings['enable_authentication']
 
+    def get_rate_limit_headroom(self):
+        """ Returns the remaining share of the rate limit from the headers of the last response """
+        headers = {k.lower(): v for k, v in (self.__exchange.last_response_headers or {}).items()}
+        try:
+            return float(headers['x-ratelimit-remaining']) / float(headers['x-ratelimit-limit'])
+        except (KeyError, TypeError, ValueError, ZeroDivisionError):
+            return None
+
     def _prepare_authentication(self):
-        """ Checks if API_KEY and API_SECRET are set """
+        """ Checks if API_KEYS or API_KEY and API_SECRET are set """
+        if self.settings['enable_authentication'] is None and self.settings.get('api_keys'):
+            self.__prepare_key_sets()
         if self.settings['enable_authentication'] is None:
             if self.settings.get('api_key') and self.settings.get('api_secret'):
                 self.__exchange.apiKey = self.settings['api_key']
@@ -110,8 +333,61 @@ class CcxtConnector(Connector):
                 self.settings['enable_authentication'] = True
                 log.debug('Authentication is configured')
 
-    def __load_retry(self, method, *args, retries=3, **kwargs):
-        """ Tries up to {retries} times to call the ccxt function and then gives up """
+    def __prepare_key_sets(self):
+        """
+        Creates a ccxt instance for every credential set of API_KEYS
+
+        The instances share the markets and the rate limit of the main instance, which fetches the public data once.
+        """
+        if self.settings.get('api_key'):
+            log.warning('API_KEYS is set, so API_KEY and API_SECRET are ignored')
+        throttle = SharedThrottle(self.__exchange.rateLimit)
+        self.__exchange.throttle = throttle.throttle
+        for name, credentials in self.settings['api_keys'].items():
+            if not isinstance(credentials, dict) or not credentials.get('api_key') or not credentials.get('api_secret'):
+                log.error(f'Ignoring the credential set {name} of API_KEYS without api_key and api_secret')
+                continue
+            exchange = self.__exchange_class(self.__exchange_options)
+            exchange.apiKey = credentials['api_key']
+            exchange.secret = credentials['api_secret']
+            if credentials.get('api_pass'):
+                exchange.password = credentials['api_pass']
+            if credentials.get('api_uid'):
+                exchange.uid = credentials['api_uid']
+            exchange.throttle = throttle.throttle
+            self.__key_sets[name] = exchange
+        if self.__key_sets:
+            self.__executor = ThreadPoolExecutor(
+                max_workers=max(1, self.settings['api_keys_concurrency']),
+                thread_name_prefix='ccxt-keys',
+            )
+            self.settings['enable_authentication'] = True
+            log.debug(f"Authentication is configured for: {', '.join(self.__key_sets)}")
+
+    def __share_markets(self):
+        """ Loads the markets once and passes them to the instances of the API_KEYS """
+        if not self.__exchange.markets:
+            self.__load_retry('load_markets')
+        for exchange in self.__key_sets.values():
+            if not exchange.markets and self.__exchange.markets:
+                exchange.set_markets(self.__exchange.markets, self.__exchange.currencies)
+
+    def __disable_key_set(self, exchange):
+        """ Stops using the credential set after an authentication error """
+        for name, key_set in list(self.__key_sets.items()):
+            if key_set is exchange:
+                log.error(f'Disabling the credential set {name} of API_KEYS')
+                del self.__key_sets[name]
+        if not self.__key_sets:
+            self.settings['enable_authentication'] = False
+
+    def __load_retry(self, method, *args, retries=3, exchange=None, **kwargs):
+        """
+        Tries up to {retries} times to call the ccxt function and then gives up
+
+        :param exchange: The ccxt instance of a credential set of API_KEYS, by default the main instance
+        """
+        exchange = exchange or self.__exchange
         data = None
         retry = True
         count = 0
@@ -123,7 +399,7 @@ class CcxtConnector(Connector):
                     log.warning('Maximum number of retries reached. Giving up.')
                     log.debug(f'Reached max retries while calling {method} with args "{args}" and kwargs {kwargs}.')
                 else:
-                    func = getattr(self.__exchange, method)
+                    func = getattr(exchange, method)
                     data = func(*args, **kwargs)
                 retry = False
             except KeyError as error:
@@ -131,38 +407,82 @@ class CcxtConnector(Connector):
                 self.__fetch_markets(force=True)
                 retry = False
             except ccxt.DDoSProtection as error:
+                self.rate_limit_hits += 1
                 utils.ddos_protection_handler(error=error)
             except ccxt.PermissionDenied as error:
-                self.settings['enable_authentication'] = False
+                if exchange is self.__exchange:
+                    self.settings['enable_authentication'] = False
+                else:
+                    self.__disable_key_set(exchange)
                 utils.permission_denied_handler(error=error)
                 retry = False
             except ccxt.AuthenticationError as error:
-                self.settings['enable_authentication'] = False
+                if exchange is self.__exchange:
+                    self.settings['enable_authentication'] = False
+                else:
+                    self.__disable_key_set(exchange)
                 utils.authentication_error_handler(error=error)
                 retry = False
             except (ccxt.ExchangeNotAvailable, ccxt.RequestTimeout, ccxt.ExchangeError) as error:
                 utils.exchange_not_available_handler(error=error)
         return data
 
+    def __unchanged(self, name: str) -> bool:
+        """ Checks if the last HTTP response for {name} is byte-identical to the previous one """
+        body = self.__exchange.last_http_response
+        if not body:
+            return False
+        digest = hashlib.blake2b(body.encode(), digest_size=16).digest()
+        unchanged = self.__hashes.get(name) == digest
+        self.__hashes[name] = digest
+        self._count_response(changed=not unchanged)
+        return unchanged
+
     def __process_tickers(self, tickers):
-        """ Formats the tickers """
-        # if tickers:
-        try:
-            for ticker in tickers:
-                currencies = ticker.split('/')
-                if len(currencies) == 2 and tickers[ticker].get('last'):
-                    pair = {
-                        'currency': currencies[0],
-                        'reference_currency': currencies[1],
-                        'value': float(tickers[ticker]['last']),
-                    }
-
-                    self._tickers.update({
-                        f'{ticker}': pair
-                    })
-        except TypeError:
-            log.debug('No tickers to process')
-        log.log(5, f"Found these tickers: {self._tickers}")
+        """ Formats the tickers and updates them in self._tickers """
+        # the stream updates single tickers from its own thread, while the REST refresh can update all of them
+        processed = 0
+        with self.__tickers_lock:
+            try:
+                for ticker in tickers:
+                    currencies = ticker.split('/')
+                    if len(currencies) == 2 and tickers[ticker].get('last'):
+                        pair = {
+                            'currency': currencies[0],
+                            'reference_currency': currencies[1],
+                            'value': float(tickers[ticker]['last']),
+                        }
+                        if tickers[ticker].get('quoteVolume'):
+                            pair['volume'] = float(tickers[ticker]['quoteVolume'])
+                        if tickers[ticker].get('timestamp'):
+                            pair['timestamp'] = tickers[ticker]['timestamp'] / 1000
+
+                        self._tickers[ticker] = pair
+                        processed += 1
+            except TypeError:
+                log.debug('No tickers to process')
+            # the time of the refresh, since the newest ticker would hide the stale illiquid pairs. With the stream,
+            # the exchange pushes every change, so the tickers are current as of the last update. A failed fetch
+            # keeps the time of the last tickers, so their age grows during an outage.
+            if processed:
+                self._set_timestamp('tickers')
+        trace(log, lambda: f"Found these tickers: {tickers}")
+
+    def get_tickers(self):
+        """ Returns a copy of the tickers, since the stream updates them in place """
+        with self.__tickers_lock:
+            return dict(self._tickers)
+
+    def get_snapshot(self) -> dict:
+        """ Returns all the stored data, with a copy of the tickers """
+        snapshot = super().get_snapshot()
+        snapshot['tickers'] = self.get_tickers()
+        return snapshot
+
+    def restore_snapshot(self, snapshot: dict):
+        """ Replaces the stored data with the data from the snapshot """
+        with self.__tickers_lock:
+            super().restore_snapshot(snapshot)
 
     def __process_ledger_entry_native_amount(self, transaction):
         """ Processes the transaction and calculates the totals based on currency and native_amount """
@@ -184,7 +504,7 @@ class CcxtConnector(Connector):
         return tickers
 
     def __fetch_each_ticker(self, symbols):
-        log.log(5, f'Fetching for these individual entries: {symbols}')
+        trace(log, lambda: f'Fetching for these individual entries: {symbols}')
         tickers = {}
         for symbol in symbols:
             retrieve_ticker = False
@@ -209,7 +529,11 @@ class CcxtConnector(Connector):
         data = self.__load_retry('fetch_ticker', symbol)
         ticker = {}
         if data:
-            ticker = {symbol: {'last': data['last']}}
+            ticker = {symbol: {
+                'last': data['last'],
+                'quoteVolume': data.get('quoteVolume'),
+                'timestamp': data.get('timestamp'),
+            }}
         return ticker
 
     def __fetch_markets(self, force=False):
@@ -217,11 +541,12 @@ class CcxtConnector(Connector):
         log.debug(f'Fetching markets with force={force}')
         if force or not self.__markets:
             self.__markets = self.__load_retry('fetch_markets', retries=5)
-            log.log(5, f'Found these markets: {self.__markets}')
+            trace(log, lambda: f'Found these markets: {self.__markets}')
         markets = self.__markets
         return markets
 
-    def __fetch_ledger(self, account, **kw):
+    def __fetch_ledger(self, account, exchange=None, **kw):
+        exchange = exchange or self.__exchange
         log.debug(f'Fetching ledger for {account} with kw={kw}')
         ledger = []
         params = {
@@ -235,34 +560,103 @@ class CcxtConnector(Connector):
         if kw.get('end'):
             params.update({'end': kw['end']})
 
-        fetched_ledger = self.__load_retry(method='fetch_ledger', params=params)
+        fetched_ledger = self.__load_retry(method='fetch_ledger', params=params, exchange=exchange)
         if fetched_ledger:
             ledger = fetched_ledger
 
         if (
-                hasattr(self.__exchange, 'last_json_response')
-                and self.__exchange.last_json_response.get('pagination')
-                and self.__exchange.last_json_response['pagination']['next_starting_after']
+                hasattr(exchange, 'last_json_response')
+                and exchange.last_json_response.get('pagination')
+                and exchange.last_json_response['pagination']['next_starting_after']
         ):
             ledger += self.__fetch_ledger(
                 account=account,
-                starting_after=self.__exchange.last_json_response['pagination']['next_starting_after'],
+                exchange=exchange,
+                starting_after=exchange.last_json_response['pagination']['next_starting_after'],
             )
         if (
-                hasattr(self.__exchange, 'last_json_response')
-                and self.__exchange.last_json_response.get('result')
-                and self.__exchange.last_json_response['result'].get('count')
-                and int(self.__exchange.last_json_response['result']['count']) > len(ledger)
+                hasattr(exchange, 'last_json_response')
+                and exchange.last_json_response.get('result')
+                and exchange.last_json_response['result'].get('count')
+                and int(exchange.last_json_response['result']['count']) > len(ledger)
         ):
-            ledger += self.__fetch_ledger(account=account, end=ledger[0]['id'])
+            ledger += self.__fetch_ledger(account=account, exchange=exchange, end=ledger[0]['id'])
             ledger = [i for n, i in enumerate(ledger) if i not in ledger[n + 1:]]
-        log.log(5, f'Found this ledger: {ledger} (entries: {len(ledger)})')
+        trace(log, lambda: f'Found this ledger: {ledger} (entries: {len(ledger)})')
+        return ledger
+
+    def __fetch_ledger_since(self, account, ledger: list, since: int, exchange=None) -> list:
+        """
+        Pages the ledger back from its oldest entry until `since`
+
+        The exchanges with `refid` (kraken) only return the latest page of the ledger. Every further page ends at the
+        oldest entry seen so far.
+
+        :param since: UNIX time in milliseconds
+        """
+        entries = {entry['id']: entry for entry in ledger}
+        while entries:
+            oldest = min(entry['timestamp'] for entry in entries.values())
+            if oldest <= since:
+                break
+            page = self.__load_retry(
+                'fetch_ledger',
+                since=since,
+                params={'account_id': account, 'end': oldest // 1000},
+                exchange=exchange or self.__exchange,
+            ) or []
+            new = [entry for entry in page if entry['id'] not in entries]
+            if not new:
+                break
+            entries.update((entry['id'], entry) for entry in new)
+            log.debug(f'Loaded {len(new)} older ledger entries for {account}')
+        return sorted(entries.values(), key=lambda entry: entry['timestamp'])
+
+    def __fetch_ledgers(self, since=None) -> dict:
+        """
+        Fetches the full ledger of the main instance or of every credential set of API_KEYS concurrently
+
+        :param since: UNIX time in milliseconds. If set, the ledgers are paged back until then.
+        :return: The ledgers by the name of the credential set, None for the main instance
+        """
+        if not self.__key_sets:
+            return {None: self.__fetch_full_ledger(since=since)}
+        names = list(self.__key_sets)
+        return dict(zip(names, self.__executor.map(lambda name: self.__fetch_full_ledger(name, since), names)))
+
+    def __fetch_full_ledger(self, name=None, since=None) -> list:
+        """
+        Fetches the ledger for every account
+
+        :param name: The credential set of API_KEYS, by default the main instance
+        :param since: UNIX time in milliseconds. If set, a `refid` ledger is paged back until then.
+        """
+        exchange = self.__key_sets.get(name) if name else None
+        ledger = []
+        if name and not exchange:
+            return ledger
+        accounts = self._accounts
+        if name:
+            # the balances of a credential set are stored with its name as the account
+            accounts = [currency for currency, values in self._accounts.items() if name in values]
+        for account in accounts:
+            account_ledger = self.__fetch_ledger(account, exchange=exchange)
+            if account_ledger and account_ledger[0]['info'].get('native_amount'):
+                ledger += account_ledger
+            elif account_ledger and account_ledger[0]['info'].get('refid'):
+                ledger = account_ledger
+                if since and all(entry.get('timestamp') and entry.get('id') for entry in ledger):
+                    ledger = self.__fetch_ledger_since(account, ledger, since, exchange=exchange)
+                break
         return ledger
 
     def retrieve_tickers(self):
         """ Connects to the exchange, downloads the price tickers and saves them in self._tickers """
         if not self.settings.get('enable_tickers'):
             return
+        if self.__stream and self.__stream.healthy():
+            log.debug('The tickers are updated by the stream')
+            return
 
         if not self.__markets:
             self.__fetch_markets()
@@ -271,13 +665,17 @@ class CcxtConnector(Connector):
         tickers = {}
         if self.__exchange.has['fetchTickers'] and (not self.settings.get('disable_fetch_tickers')):
             tickers = self.__fetch_tickers()
+            if tickers and self.__unchanged('tickers'):
+                log.debug('The tickers did not change')
+                self._set_timestamp('tickers')
+                return
         else:
             log.warning(constants.WARN_TICKER_SLOW_LOAD)
             tickers = self.__fetch_each_ticker(self.__fetch_markets())
 
         self.__process_tickers(tickers)
 
-        log.log(5, f"Found the following ticker rates: {self._tickers}")
+        trace(log, lambda: f"Found the following ticker rates: {self.get_tickers()}")
 
     def retrieve_accounts(self):
         """ Connects to the exchange, downloads the accounts data and saves it in self._accounts """
@@ -289,6 +687,9 @@ class CcxtConnector(Connector):
             self.__fetch_markets()
 
         log.debug('Retrieving accounts')
+        if self.__key_sets:
+            self.__retrieve_key_set_accounts()
+            return
         accounts = self.__load_retry('fetch_balance')
         try:
             if accounts.get('total'):
@@ -299,12 +700,45 @@ class CcxtConnector(Connector):
                     self._accounts[currency].update({
                         'total': accounts['total'][currency],
                     })
+                self._set_timestamp('accounts', (accounts.get('timestamp') or 0) / 1000)
         except AttributeError:
             log.debug('No accounts found to process')
 
-        log.log(5, f"Found the following accounts: {self._accounts}")
-
-    def __process_ledger_native_amount(self, ledger=None):
+        trace(log, lambda: f"Found the following accounts: {self._accounts}")
+
+    def __fetch_key_set_balance(self, name: str):
+        """ Fetches the balance of the credential set, unless it has been disabled """
+        exchange = self.__key_sets.get(name)
+        return self.__load_retry('fetch_balance', exchange=exchange) if exchange else None
+
+    def __retrieve_key_set_accounts(self):
+        """ Fetches the balances of all the credential sets of API_KEYS concurrently, with their name as account """
+        self.__share_markets()
+        names = list(self.__key_sets)
+        balances = self.__executor.map(self.__fetch_key_set_balance, names)
+        processed = {}
+        for name, balance in zip(names, balances):
+            if not balance or not balance.get('total'):
+                # keeps the last balances of the credential set until it answers again
+                log.debug(f'No accounts found to process for {name}. Keeping its last balances.')
+                for currency, values in self._accounts.items():
+                    if name in values:
+                        processed.setdefault(currency, {})[name] = values[name]
+                continue
+            for currency, total in balance['total'].items():
+                processed.setdefault(currency, {})[name] = total
+            self.__key_set_times[name] = (balance.get('timestamp') or 0) / 1000 or time.time()
+        if processed:
+            self._accounts = processed
+            timestamps = [self.__key_set_times[name] for name in names if name in self.__key_set_times]
+            self._set_timestamp('accounts', min(timestamps, default=None))
+
+    @staticmethod
+    def __transaction_key(currency, reference_currency, transaction_type, name=None) -> tuple:
+        """ The key of the totals. The totals of a credential set of API_KEYS have its name as fourth element. """
+        return (currency, reference_currency, transaction_type) + ((name,) if name else ())
+
+    def __process_ledger_native_amount(self, ledger=None, name=None):
         if not ledger:
             ledger = []
         # for now only trades are supported
@@ -313,13 +747,14 @@ class CcxtConnector(Connector):
             if entry['info'].get('native_amount'):
                 currency, reference_currency, value = self.__process_ledger_entry_native_amount(entry['info'])
                 if currency:
-                    if not self._transactions.get((currency, reference_currency, transaction_type)):
+                    key = self.__transaction_key(currency, reference_currency, transaction_type, name)
+                    if not self._transactions.get(key):
                         self._transactions.update({
-                            (currency, reference_currency, transaction_type): float(0),
+                            key: float(0),
                         })
-                    self._transactions[(currency, reference_currency, transaction_type)] -= value
+                    self._transactions[key] -= value
 
-    def __process_ledger_refid(self, ledger=None):
+    def __process_ledger_refid(self, ledger=None, name=None):
         if not ledger:
             ledger = []
         for entry in ledger:
@@ -337,14 +772,15 @@ class CcxtConnector(Connector):
                         reference_currency = entry['currency']
                         transaction_type = entry['type']
                         value = float(entry['amount'])
-                        if not self._transactions.get((currency, reference_currency, transaction_type)):
+                        key = self.__transaction_key(currency, reference_currency, transaction_type, name)
+                        if not self._transactions.get(key):
                             self._transactions.update({
-                                (currency, reference_currency, transaction_type): float(0),
+                                key: float(0),
                             })
                         if entry['direction'] == 'in':
-                            self._transactions[(currency, reference_currency, transaction_type)] += value
+                            self._transactions[key] += value
                         if entry['direction'] == 'out':
-                            self._transactions[(currency, reference_currency, transaction_type)] -= value
+                            self._transactions[key] -= value
 
     def retrieve_transactions(self):
         """
@@ -366,19 +802,114 @@ class CcxtConnector(Connector):
         log.debug('Retrieving transactions')
 
         if self.__exchange.has['fetchLedger']:
-            # Fetches the ledger for every account
-            ledger = []
-            for account in self._accounts:
-                account_ledger = self.__fetch_ledger(account)
-                if account_ledger and account_ledger[0]['info'].get('native_amount'):
-                    ledger += account_ledger
-                elif account_ledger and account_ledger[0]['info'].get('refid'):
-                    ledger = account_ledger
-                    break
-
-            if (len(ledger) > 0 and ledger[0].get('info')):
-                self._transactions = {}
+            ledgers = {
+                name: ledger for name, ledger in self.__fetch_ledgers().items()
+                if len(ledger) > 0 and ledger[0].get('info')
+            }
+            if not ledgers:
+                return
+            previous, self._transactions = self._transactions, {}
+            # an idle account has no recent ledger entries, but its totals are still current
+            self._set_timestamp('transactions')
+            for name, ledger in ledgers.items():
                 if ledger[0]['info'].get('native_amount'):
-                    self.__process_ledger_native_amount(ledger)
+                    self.__process_ledger_native_amount(ledger, name)
                 if ledger[0]['info'].get('refid'):
-                    self.__process_ledger_refid(ledger)
+                    self.__process_ledger_refid(ledger, name)
+            if self.__key_sets:
+                # keeps the last totals of the credential sets without a ledger this time
+                for key, value in previous.items():
+                    if len(key) == 4 and key[3] not in ledgers:
+                        self._transactions[key] = value
+
+    def get_history_symbols(self) -> list:
+        """ Returns the symbols for the history of the exchange rates """
+        markets = {market['symbol']: market for market in self.__fetch_markets() or []}
+        symbols = self.__selected_symbols(markets)
+        if symbols is None:
+            raise ValueError('Set SYMBOLS or REFERENCE_CURRENCIES to select the pairs for the history')
+        return [symbol for symbol in symbols if symbol in markets]
+
+    def fetch_rate_history(self, symbol: str, timeframe: str, since: float, until: float):
+        """
+        Yields the (timestamp, close) of the OHLCV candles of the symbol from since until before until
+
+        :param timeframe: The ccxt timeframe of the candles (for example `1h`)
+        :param since: UNIX time in seconds
+        :param until: UNIX time in seconds
+        """
+        if not self.__exchange.has.get('fetchOHLCV'):
+            raise ValueError(f'{self.exchange} does not support fetch_ohlcv')
+        duration = self.__exchange.parse_timeframe(timeframe) * 1000
+        cursor = int(since * 1000)
+        end = int(until * 1000)
+        while cursor < end:
+            candles = [
+                candle for candle in self.__load_retry('fetch_ohlcv', symbol, timeframe, cursor, OHLCV_LIMIT) or []
+                if cursor <= candle[0] < end
+            ]
+            if not candles:
+                # no trades (or no listing yet) in this page, but maybe in the following ones
+                cursor += OHLCV_LIMIT * duration
+                continue
+            for candle in candles:
+                if candle[4] is not None:
+                    yield candle[0] / 1000, float(candle[4])
+            cursor = candles[-1][0] + duration
+
+    def get_transaction_history(self, step: float, since: float, until: float):
+        """
+        Yields the (timestamp, transactions) every `step` seconds from since until before until
+
+        The transactions are the totals of all the ledger entries up to the timestamp, like retrieve_transactions()
+        calculates them at the time of the refresh.
+        """
+        if not self.settings.get('enable_transactions'):
+            return
+        self._prepare_authentication()
+        if not self.settings['enable_authentication'] or not self.__exchange.has['fetchLedger']:
+            return
+        if not self.__markets:
+            self.__fetch_markets()
+        if not self._accounts:
+            self.retrieve_accounts()
+        ledger = [
+            (name, entry) for name, entries in self.__fetch_ledgers(since=int(since * 1000)).items()
+            for entry in entries if entry.get('timestamp')
+        ]
+        if not ledger or not ledger[0][1].get('info'):
+            return
+
+        refid = bool(ledger[0][1]['info'].get('refid'))
+        # the entries of a trade are booked together, at the time of the last one
+        trades = {}
+        for index, (name, entry) in enumerate(ledger):
+            trades.setdefault((name, (refid and entry.get('referenceId')) or f'#{index}'), []).append(entry)
+        bookings = sorted(trades.items(), key=lambda trade: max(entry['timestamp'] for entry in trade[1]))
+
+        current = self._transactions
+        self._transactions = {}
+        try:
+            position = 0
+            timestamp = since
+            while timestamp < until:
+                while (
+                        position < len(bookings)
+                        and max(entry['timestamp'] for entry in bookings[position][1]) <= timestamp * 1000
+                ):
+                    (name, _), entries = bookings[position]
+                    if refid:
+                        self.__process_ledger_refid(entries, name)
+                    else:
+                        self.__process_ledger_native_amount(entries, name)
+                    position += 1
+                yield timestamp, dict(self._transactions)
+                timestamp += step
+        finally:
+            self._transactions = current
+
+    def get_timeframe_seconds(self, timeframe: str) -> int:
+        """ Returns the duration of the ccxt timeframe in seconds """
+        if self.__exchange.timeframes and timeframe not in self.__exchange.timeframes:
+            raise ValueError(f"{self.exchange} supports the timeframes: {', '.join(self.__exchange.timeframes)}")
+        return self.__exchange.parse_timeframe(timeframe)
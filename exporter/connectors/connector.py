@@ -2,6 +2,30 @@
 # -*- coding: utf-8 -*-
 """ The Connector Class """
 
+import hashlib
+import logging
+import threading
+import time
+import requests
+from ..lib import decoder
+from ..lib import utils
+from ..lib.cache import ResponseCache
+from ..lib.quota import QuotaPlanner
+from ..lib.tokens import TokenIndex
+
+log = logging.getLogger('crypto-exporter')
+
+
+def _strings(value) -> list:
+    """ Returns all the strings of a setting, including the ones nested in a JSON setting """
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, list):
+        return [string for item in value for string in _strings(item)]
+    return []
+
 
 class Connector():
     """ The Class Definition """
@@ -16,8 +40,185 @@ class Connector():
             'mandatory': False,
         },
     }
+    cache_params = {  # merged into the params of the connectors with a response cache
+        'cache_ttl': {
+            'key_type': 'int',
+            'default': 0,
+            'mandatory': False,
+        },
+        'cache_max_stale': {
+            'key_type': 'int',
+            'default': 3600,
+            'mandatory': False,
+        },
+        'cache_size': {
+            'key_type': 'int',
+            'default': 1024,
+            'mandatory': False,
+        },
+    }
+    quota_params = {  # merged into the params of the connectors with a metered API key
+        'quota_daily': {
+            'key_type': 'int',
+            'default': None,
+            'mandatory': False,
+        },
+        'quota_per_second': {
+            'key_type': 'float',
+            'default': None,
+            'mandatory': False,
+        },
+    }
+    token_params = {  # merged into the params of the connectors listing the tokens of an address
+        'token_index_file': {
+            'key_type': 'string',
+            'default': None,
+            'mandatory': False,
+        },
+        'token_allow': {
+            'key_type': 'list',
+            'default': None,
+            'mandatory': False,
+        },
+        'token_deny': {
+            'key_type': 'list',
+            'default': None,
+            'mandatory': False,
+        },
+    }
     settings = {}
     exchange = None
+    rate_limit_hits = 0  # incremented every time the exchange throttles
+    responses = {'changed': 0, 'unchanged': 0}
+    cache = None  # the ResponseCache of the connectors supporting it
+    quota = None  # the QuotaPlanner of the connectors with a metered API key
+    reconfigurable = []  # the settings reconfigure() applies to the running connector
+
+    def __init__(self):
+        # every instance gets its own data
+        self._tickers = {}
+        self._accounts = {}
+        self._transactions = {}
+        self._timestamps = {}
+        self.responses = {'changed': 0, 'unchanged': 0}
+        self.__responses = {}
+        self.__responses_lock = threading.Lock()
+
+    def _response_cache(self) -> ResponseCache:
+        """ Returns a response cache with the cache_params settings """
+        return ResponseCache(
+            ttl=self.settings['cache_ttl'],
+            max_stale=self.settings['cache_max_stale'],
+            max_size=self.settings['cache_size'],
+        )
+
+    def _quota_planner(self):
+        """ Returns a quota planner with the quota_params settings or None, if no quota is configured """
+        if not (self.settings['quota_daily'] or self.settings['quota_per_second']):
+            return None
+        return QuotaPlanner(daily=self.settings['quota_daily'], per_second=self.settings['quota_per_second'])
+
+    def _token_index(self) -> TokenIndex:
+        """ Returns a token index with the token_params settings """
+        return TokenIndex(
+            path=self.settings['token_index_file'],
+            allow=self.settings['token_allow'],
+            deny=self.settings['token_deny'],
+        )
+
+    def _count_response(self, changed: bool):
+        """ Counts the upstream responses for the change detection hit rate """
+        self.responses['changed' if changed else 'unchanged'] += 1
+
+    def _set_timestamp(self, name: str, timestamp=None):
+        """ Records when the data class was current upstream. Without a timestamp from the upstream, it's now. """
+        self._timestamps[name] = float(timestamp) if timestamp else time.time()
+
+    def _set_oldest_timestamp(self, name: str, timestamps: list):
+        """ Records the oldest of the load times of the data class. Unknown times (None) are skipped. """
+        timestamps = [timestamp for timestamp in timestamps if timestamp is not None]
+        if timestamps:
+            self._set_timestamp(name, min(timestamps))
+
+    def _get_json(self, url: str, params=None, timeout=None, fields=None) -> tuple:
+        """
+        Sends a GET request and decodes the JSON response, unless it didn't change since the last request
+
+        The request is conditional (ETag and Last-Modified). Otherwise a hash of the body is compared to the last one
+        with the same url and params.
+
+        :param fields: If set, only these fields of the response are decoded and kept. See decoder.prune().
+        :return: The tuple (data, changed). If the response didn't change, the data decoded the last time is returned.
+        :raises requests.exceptions.RequestException: raised by requests or by raise_for_status()
+        """
+        key = (url, repr(sorted((params or {}).items())))
+        with self.__responses_lock:
+            cached = self.__responses.get(key)
+        headers = {}
+        if cached and cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached and cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+
+        req = utils.get_session().get(
+            url,
+            params=params,
+            headers=headers,
+            timeout=timeout or self.settings.get('timeout'),
+        )
+        if cached and req.status_code == 304:
+            self._count_response(changed=False)
+            return cached['data'], False
+        req.raise_for_status()
+        digest = hashlib.blake2b(req.content, digest_size=16).digest()
+        if cached and cached['hash'] == digest:
+            self._count_response(changed=False)
+            return cached['data'], False
+
+        try:
+            data = decoder.decode(req.content, fields)
+        except ValueError as e:
+            # the same exception as req.json(), so the connectors handle it like before
+            raise requests.exceptions.JSONDecodeError(f'{e}', '', 0) from e
+        with self.__responses_lock:
+            self.__responses[key] = {
+                'etag': req.headers.get('ETag'),
+                'last_modified': req.headers.get('Last-Modified'),
+                'hash': digest,
+                'data': data,
+            }
+        self._count_response(changed=True)
+        return data, True
+
+    def _get_json_retry(self, url: str, params=None, retries=5, fields=None, on_http_error=None) -> tuple:
+        """
+        Tries up to {retries} times to call _get_json() and then gives up
+
+        A timeout is retried after 2 seconds. Every try counts against the daily quota, if there is one.
+
+        :param on_http_error: Called with the HTTPError, returns True if the request should be retried. Without it,
+                              an HTTP error gives up like all the other errors.
+        :return: The tuple (data, changed), with the data None if the request failed
+        """
+        for _ in range(retries):
+            if self.quota and not self.quota.acquire():
+                log.warning('The daily API quota is used up. Giving up.')
+                return None, True
+            try:
+                return self._get_json(url, params=params, fields=fields)
+            except requests.exceptions.Timeout as e:
+                utils.exchange_not_available_handler(error=self.redact(str(e)), shortify=False, sleep=2)
+            except requests.exceptions.RequestException as e:
+                if isinstance(e, requests.exceptions.HTTPError) and on_http_error:
+                    if on_http_error(e):
+                        continue
+                    return None, True
+                error = self.redact(str(e))
+                log.warning(f"Fatal error connecting to {self.settings['url']}. Exception caught: {error}")
+                return None, True
+        log.warning('Maximum number of retries reached. Giving up.')
+        log.debug(f'Reached max retries while loading {self.redact(url)}')
+        return None, True
 
     def get_tickers(self):
         """ Returns the stored ticker rates """
@@ -31,6 +232,47 @@ class Connector():
         """ Returns the transaction history """
         return self._transactions
 
+    def get_timestamps(self):
+        """
+        Returns when the stored data was current upstream (UNIX time in seconds)
+
+        {
+            'tickers': float(timestamp),
+            'accounts': float(timestamp),
+            'transactions': float(timestamp),
+        }
+
+        """
+        return self._timestamps
+
+    def get_snapshot(self) -> dict:
+        """ Returns all the stored data """
+        return {
+            'tickers': self._tickers,
+            'accounts': self._accounts,
+            'transactions': self._transactions,
+            'timestamps': self._timestamps,
+        }
+
+    def restore_snapshot(self, snapshot: dict):
+        """ Replaces the stored data with the data from the snapshot """
+        self._tickers = snapshot.get('tickers', {})
+        self._accounts = snapshot.get('accounts', {})
+        self._transactions = snapshot.get('transactions', {})
+        self._timestamps = snapshot.get('timestamps', {})
+
+    def get_cache_stats(self):
+        """ Returns the hit, miss and stale counters of the response cache or None """
+        return self.cache.stats if self.cache else None
+
+    def get_quota_stats(self):
+        """ Returns the daily quota, the calls left for today and the postponed refreshes or None """
+        return self.quota.stats() if self.quota else None
+
+    def get_rate_limit_headroom(self):
+        """ Returns the remaining share (0 to 1) of the rate limit, if the exchange reports it, otherwise None """
+        return None
+
     def retrieve_tickers(self):
         """ Triggers the run to retrieve the tickers """
 
@@ -49,11 +291,40 @@ class Connector():
     def retrieve_transactions(self):
         """ Triggers the run to retrieve the transactions """
 
+    def stop(self):
+        """ Stops the background work of the connector, if any """
+
+    def reconfigure(self, settings: dict) -> bool:
+        """
+        Applies changed settings to the running connector, which keeps its caches, connections and data
+
+        :param settings: The changed settings (in lower case), None for the removed ones
+        :return: False, if a setting isn't `reconfigurable`, so the connector has to be built again
+        """
+        if not set(settings).issubset(self.reconfigurable):
+            return False
+        previous = dict(self.settings)
+        values = utils.gather_environ({key: self.params[key] for key in settings}, values=settings)
+        for key in settings:
+            self.settings[key] = values.get(key, self.params[key]['default'])
+        self._reconfigured(previous)
+        return True
+
+    def _reconfigured(self, previous: dict):
+        """ Drops the accounts of the removed addresses. Called by reconfigure() with the previous settings. """
+        removed = set(previous.get('addresses') or []) - set(self.settings.get('addresses') or [])
+        if removed:
+            self._accounts = {
+                currency: {account: value for account, value in balances.items() if account not in removed}
+                for currency, balances in self._accounts.items()
+            }
+
     def redact(self, message: str) -> str:
         """
         Redacts all the sensitive information from the message
         """
         for param, values in self.params.items():
             if values.get('redact') and self.settings.get(param):
-                message = message.replace(self.settings.get(param), '***REDACTED***')
+                for secret in _strings(self.settings.get(param)):
+                    message = message.replace(secret, '***REDACTED***')
         return message
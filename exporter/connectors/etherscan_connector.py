@@ -3,8 +3,8 @@
 """ Handles the etherscan data and communication """
 
 import logging
-import requests
 from ..lib import utils
+from ..lib.log import trace
 from .connector import Connector
 
 log = logging.getLogger('crypto-exporter')
@@ -14,6 +14,7 @@ class EtherscanConnector(Connector):
     """ The EtherscanConnector class """
 
     settings = {}
+    reconfigurable = ['addresses']
     params = {
         'api_key': {
             'key_type': 'string',
@@ -38,59 +39,53 @@ class EtherscanConnector(Connector):
         },
     }
 
-    def __init__(self):
+    def __init__(self, settings=None):
         self.exchange = 'etherscan'
         self.params.update(super().params)  # merge with the global params
-        self.settings = utils.gather_environ(self.params)
+        self.params.update(super().cache_params)
+        self.params.update(super().quota_params)
+        self.settings = utils.gather_environ(self.params, values=settings)
         self.settings.update({'enable_authentication': True})
+        self.__loaded_at = []
+        self.cache = self._response_cache()
+        self.quota = self._quota_planner()
         super().__init__()
 
     def __load_retry(self, request_data: dict, retries=5):
-        """ Tries up to {retries} times to call the ccxt function and then gives up """
-        data = None
-        retry = True
+        """ Tries up to {retries} times to call the api and then gives up """
         result = None
-        count = 0
         log.debug(f'Loading {request_data} with {retries} retries')
-        while retry:
-            try:
-                count += 1
-                if count > retries:
-                    log.warning('Maximum number of retries reached. Giving up.')
-                    message = self.redact(f'{request_data}')
-                    log.debug(f'Reached max retries while loading {message}')
-                else:
-                    request_data.update({
-                        'apikey': self.settings['api_key'],
-                        'module': 'account',
-                        'tag': 'latest',
-                    })
-                    req = requests.get(self.settings['url'], params=request_data, timeout=self.settings['timeout'])
-                    req.raise_for_status()
-                    data = req.json()
-                retry = False
-            except requests.exceptions.Timeout as e:
-                error = self.redact(str(e))
-                utils.exchange_not_available_handler(error=error, shortify=False, sleep=2)
-            except requests.exceptions.RequestException as e:
-                error = self.redact(str(e))
-                log.warning(f"Fatal error connecting to {self.settings['url']}. Exception caught: {error}")
-                retry = False
-
-            if data:
-                if (data.get('message') == 'OK' or 'OK-' in data.get('message')) and data.get('result'):
-                    result = data.get('result')
+        request_data.update({
+            'apikey': self.settings['api_key'],
+            'module': 'account',
+            'tag': 'latest',
+        })
+        data, _ = self._get_json_retry(self.settings['url'], params=request_data, retries=retries)
+        if data:
+            if (data.get('message') == 'OK' or 'OK-' in data.get('message')) and data.get('result'):
+                result = data.get('result')
 
-                if 'NOTOK' in data.get('message'):
-                    retry = False
-                    if data.get('result') == 'Invalid API Key':
-                        utils.authentication_error_handler(self.redact(data.get('result')))
-                        self.settings['enable_authentication'] = False
-                    else:
-                        utils.generic_error_handler(self.redact(data.get('result')))
+            if 'NOTOK' in data.get('message'):
+                if data.get('result') == 'Invalid API Key':
+                    utils.authentication_error_handler(self.redact(data.get('result')))
+                    self.settings['enable_authentication'] = False
+                elif 'rate limit' in f"{data.get('result')}".lower():
+                    self.rate_limit_hits += 1
+                    if self.quota and 'daily' in f"{data.get('result')}".lower():
+                        self.quota.exhaust()
+                    utils.generic_error_handler(self.redact(data.get('result')))
+                else:
+                    utils.generic_error_handler(self.redact(data.get('result')))
 
         return result
 
+    def __load_cached(self, request_data: dict, retries=5):
+        """ Loads the request through the cache """
+        key = repr(sorted(request_data.items()))
+        data = self.cache.get(key, lambda: self.__load_retry(dict(request_data), retries=retries))
+        self.__loaded_at.append(self.cache.loaded_at(key))
+        return data
+
     def _get_token_balance_on_account(self, account: str, token: dict) -> float:
         """
         gets a specific token on a specific account
@@ -105,7 +100,7 @@ class EtherscanConnector(Connector):
         }
 
         balance = 0
-        data = self.__load_retry(request_data)
+        data = self.__load_cached(request_data)
         if data and int(data) > 0:
             decimals = 18
             if token.get('decimals', -1) >= 0:
@@ -124,27 +119,53 @@ class EtherscanConnector(Connector):
                     self._accounts.update({
                         token['short']: {}
                     })
+                key = f"{account}:{token['contract']}"
+                if self.quota and not self.quota.due(key):
+                    # the balance of the last refresh is kept
+                    self.__loaded_at.append(self.quota.refreshed_at(key))
+                    continue
+                balance = self._get_token_balance_on_account(account, token)
+                if self.quota:
+                    previous = self._accounts[token['short']].get(account)
+                    self.quota.update(key, value=balance, changed=previous != balance, group=token['short'])
                 self._accounts[token['short']].update({
-                    account: self._get_token_balance_on_account(account, token)
+                    account: balance
                 })
 
     def retrieve_accounts(self):
         """ Gets the current balance for an account """
+        self.__loaded_at = []
+        if self.quota:
+            self.quota.plan()
         if self.settings['enable_authentication']:
             log.debug('Retrieving the account balances')
             request_data = {
                 'action': 'balancemulti',
                 'address': self.settings['addresses'],
             }
-            data = self.__load_retry(request_data)
+            data = None
+            if self.quota and not self.quota.due('balancemulti'):
+                self.__loaded_at.append(self.quota.refreshed_at('balancemulti'))
+            else:
+                data = self.__load_cached(request_data)
             if data:
                 if not self._accounts.get('ETH'):
                     self._accounts.update({'ETH': {}})
+                previous = dict(self._accounts['ETH'])
                 for account in data:
                     self._accounts['ETH'].update({
                         account['account']: float(account['balance'])/(1000000000000000000)
                     })
+                if self.quota:
+                    self.quota.update(
+                        'balancemulti',
+                        value=sum(self._accounts['ETH'].values()),
+                        changed=previous != self._accounts['ETH'],
+                    )
             if self.settings['tokens']:
                 self.retrieve_tokens()
-        log.log(5, f'Accounts: {self._accounts}')
+            # the oldest cached response is the age of the balances. The failed loads and the items deferred by the used
+            # up quota before their first refresh have no age.
+            self._set_oldest_timestamp('accounts', self.__loaded_at)
+        trace(log, lambda: f'Accounts: {self._accounts}')
         return self._accounts
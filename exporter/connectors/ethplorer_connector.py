@@ -5,15 +5,24 @@
 import logging
 import requests
 from ..lib import utils
+from ..lib.log import trace
 from .connector import Connector
 
 log = logging.getLogger('crypto-exporter')
 
+# the fields of getAddressInfo used by __parse_balances(). The token info (prices, descriptions, ...) is mostly unused.
+FIELDS = {
+    'error': True,
+    'ETH': {'balance': True},
+    'tokens': [{'balance': True, 'tokenInfo': {'address': True, 'symbol': True, 'decimals': True}}],
+}
 
-class EthplorerConnector(Connector):
+
+class EthplorerConnector(Connector):  # pylint: disable=too-many-instance-attributes
     """ The EthplorerConnector class """
 
     settings = {}
+    reconfigurable = ['addresses']
     params = {
         'api_key': {
             'key_type': 'string',
@@ -33,11 +42,19 @@ class EthplorerConnector(Connector):
         },
     }
 
-    def __init__(self):
+    def __init__(self, settings=None):
         self.exchange = 'ethplorer'
         self.params.update(super().params)  # merge with the global params
-        self.settings = utils.gather_environ(self.params)
+        self.params.update(super().cache_params)
+        self.params.update(super().token_params)
+        self.params.update(super().quota_params)
+        self.settings = utils.gather_environ(self.params, values=settings)
         self.settings.update({'enable_authentication': True})
+        self.__balances = {}
+        self.__loaded_at = []
+        self.__index = self._token_index()
+        self.cache = self._response_cache()
+        self.quota = self._quota_planner()
         super().__init__()
 
     def prepare_request(self, request_data: dict) -> dict:
@@ -46,87 +63,112 @@ class EthplorerConnector(Connector):
             request_data.update({'apiKey': self.settings['api_key']})
         return request_data
 
-    def __load_retry(self, account, retries=5):
-        """ Tries up to {retries} times to call the api and then gives up """
-        response = None
+    def __on_http_error(self, e: requests.exceptions.HTTPError) -> bool:
+        """ Handles the HTTP error of a request and returns if the request should be retried """
+        error = self.redact(str(e))
         retry = True
+        if e.response.status_code == 403:
+            utils.authentication_error_handler(error)
+            self.settings['enable_authentication'] = False
+            retry = False
+        if e.response.status_code == 429:
+            self.rate_limit_hits += 1
+            if self.quota:
+                # the planner keeps within the per-second quota, so the upstream counts more calls for today
+                self.quota.exhaust()
+            utils.ddos_protection_handler(error=error, sleep=1, shortify=False)
+        else:
+            utils.generic_error_handler(self.redact(error))
+        return retry
+
+    def __load_retry(self, account, retries=5):
+        """
+        Tries up to {retries} times to call the api and then gives up
+
+        :return: The tuple (result, changed)
+        """
         result = None
-        count = 0
         log.debug(f'Loading account data for {account} with {retries} retries')
         request_data = self.prepare_request({})
         url = f"{self.settings['url']}/getAddressInfo/{account}"
-        while retry:
-            try:
-                count += 1
-                if count > retries:
-                    log.warning('Maximum number of retries reached. Giving up.')
-                    log.debug(f'Reached max retries while loading {url}')
-                else:
-                    req = requests.get(url, params=request_data, timeout=self.settings['timeout'])
-                    req.raise_for_status()
-                    response = req.json()
-                retry = False
-            except requests.exceptions.Timeout as e:
-                error = self.redact(str(e))
-                utils.exchange_not_available_handler(error=error, shortify=False, sleep=2)
-            except requests.exceptions.HTTPError as e:
-                error = self.redact(str(e))
-                if e.response.status_code == 403:
-                    utils.authentication_error_handler(error)
-                    self.settings['enable_authentication'] = False
-                    retry = False
-                if e.response.status_code == 429:
-                    utils.ddos_protection_handler(error=error, sleep=1, shortify=False)
-                else:
-                    utils.generic_error_handler(self.redact(error))
-            except requests.exceptions.RequestException as e:
-                error = self.redact(str(e))
-                log.warning(f"Fatal error connecting to {self.settings['url']}. Exception caught: {error}")
-                retry = False
-
-            if response:
-                if response.get('error'):
-                    utils.generic_error_handler(self.redact(response.get('error')))
-                else:
-                    result = response
-
-        return result
+        response, changed = self._get_json_retry(
+            url, params=request_data, retries=retries, fields=FIELDS, on_http_error=self.__on_http_error,
+        )
+        if response:
+            if response.get('error'):
+                if self.quota and 'limit exceeded' in f"{response.get('error')}".lower():
+                    self.rate_limit_hits += 1
+                    self.quota.exhaust()
+                utils.generic_error_handler(self.redact(f"{response.get('error')}"))
+            else:
+                result = response
+
+        return result, changed
+
+    def __load_cached(self, account, retries=5):
+        """ Loads the account data through the cache """
+        loaded = self.cache.get(
+            account,
+            lambda: self.__load_retry(account, retries=retries),
+            valid=lambda loaded: loaded[0] is not None,
+        )
+        self.__loaded_at.append(self.cache.loaded_at(account))
+        return loaded
+
+    def __parse_balances(self, data: dict) -> dict:
+        """ Returns the balances of one address, with the currency as key """
+        balances = {}
+        if data.get('ETH'):
+            balances['ETH'] = float(data['ETH']['balance'])
+        if data.get('tokens'):
+            for token in data['tokens']:
+                info = token.get('tokenInfo') or {}
+                # Ignores the low quality tokens
+                metadata = self.__index.lookup(info.get('address'), info)
+                if not metadata:
+                    continue
+                balances[metadata['symbol']] = float(int(token['balance']) / metadata['scale'])
+        return balances
+
+    def _reconfigured(self, previous: dict):
+        """ Also drops the parsed balances of the removed addresses """
+        super()._reconfigured(previous)
+        self.__balances = {
+            address: balances for address, balances in self.__balances.items() if address in self.settings['addresses']
+        }
 
     def retrieve_accounts(self):
         """ Gets the current balance for an account """
         self._accounts = {'ETH': {}}
+        self.__loaded_at = []
         log.debug('Retrieving the account balances')
+        if self.quota:
+            self.quota.plan()
         for address in self.settings['addresses']:
             if not self.settings['enable_authentication']:
                 return {}
-            data = self.__load_retry(address, retries=2)
-            if data:
-                if data.get('ETH'):
-                    self._accounts['ETH'].update({
-                        address: float(data['ETH']['balance'])
-                    })
-                if data.get('tokens'):
-                    for token in data['tokens']:
-                        token_name = token['tokenInfo'].get('symbol')
-                        # Ignores the low quality tokens
-                        if (
-                                len(token_name) > 15
-                                or not token_name
-                        ):
-                            break
-
-                        token_decimals = int(token['tokenInfo'].get('decimals', 0))
-                        if token_decimals > 0:
-                            balance = int(token['balance']) / (10**token_decimals)
-                        else:
-                            balance = int(token['balance'])
-
-                        if token_name not in self._accounts:
-                            self._accounts.update({token_name: {}})
-
-                        self._accounts[token_name].update({
-                            address: float(balance)
-                        })
-
-        log.log(5, f'Accounts: {self._accounts}')
+            if self.quota and address in self.__balances and not self.quota.due(address):
+                # the balances of the last refresh are kept
+                self.__loaded_at.append(self.quota.refreshed_at(address))
+            else:
+                data, changed = self.__load_cached(address, retries=2)
+                if not data:
+                    continue
+                # unchanged responses are neither decoded nor parsed again
+                if changed or address not in self.__balances:
+                    self.__balances[address] = self.__parse_balances(data)
+                if self.quota:
+                    self.quota.update(address, value=self.__balances[address].get('ETH'), changed=changed, group='ETH')
+            for currency, balance in self.__balances[address].items():
+                if currency not in self._accounts:
+                    self._accounts.update({currency: {}})
+                self._accounts[currency].update({
+                    address: balance
+                })
+
+        self.__index.save()
+        # the oldest cached response is the age of the balances. The failed loads and the items deferred by the used
+        # up quota before their first refresh have no age.
+        self._set_oldest_timestamp('accounts', self.__loaded_at)
+        trace(log, lambda: f'Accounts: {self._accounts}')
         return self._accounts
@@ -3,16 +3,138 @@
 
 import logging
 import time
+import json
+import itertools
+import threading
+from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import requests
+import websocket
 from ..lib import utils
+from ..lib.log import trace
 from .connector import Connector
 
 log = logging.getLogger('crypto-exporter')
 
+RIPPLE_EPOCH = 946684800  # the ledger times are in seconds since 2000-01-01
+
+
+class RippledClient():  # pylint: disable=too-many-instance-attributes
+    """
+    A minimal rippled client
+
+    For `ws://` and `wss://` URLs all the requests are multiplexed over one persistent WebSocket connection and
+    matched to their responses by `id`. For `http://` and `https://` URLs the JSON-RPC interface is used.
+    """
+
+    def __init__(self, url, timeout=10, on_transaction=None):
+        self.url = url
+        self.timeout = timeout
+        self.on_transaction = on_transaction
+        self.websocket = url.startswith('ws://') or url.startswith('wss://')
+        self.subscriptions = []
+        self.connections = 0
+        self.__ids = itertools.count(1)
+        self.__pending = {}
+        self.__lock = threading.Lock()
+        self.__ws = None
+
+    def connected(self):
+        """ Returns True if the WebSocket connection is up """
+        return self.__ws is not None and self.__ws.connected
+
+    def __connect(self):
+        """ Opens the WebSocket connection, starts the reader thread and restores the subscriptions """
+        log.debug(f'Connecting to {self.url}')
+        self.__ws = websocket.create_connection(self.url, timeout=self.timeout)
+        self.__ws.settimeout(None)  # the reader thread blocks until a message arrives
+        self.connections += 1
+        threading.Thread(target=self.__reader, args=(self.__ws,), name='rippled-reader', daemon=True).start()
+        if self.subscriptions:
+            self.__ws.send(json.dumps({'command': 'subscribe', 'accounts': self.subscriptions}))
+
+    def __reader(self, ws):
+        """ Reads the messages from the WebSocket and dispatches them """
+        while True:
+            try:
+                message = json.loads(ws.recv())
+            except (websocket.WebSocketException, OSError, ValueError) as e:
+                log.warning(f"Lost the connection to {self.url}: {utils.short_msg(e)}")
+                break
+            if message.get('id') is not None:
+                with self.__lock:
+                    future = self.__pending.pop(message['id'], None)
+                if future:
+                    future.set_result(message)
+            elif message.get('type') == 'transaction' and self.on_transaction:
+                self.on_transaction(message)
+
+        with self.__lock:
+            if self.__ws is ws:
+                self.__ws = None
+            pending, self.__pending = self.__pending, {}
+        for future in pending.values():
+            future.set_exception(ConnectionError(f'Connection to {self.url} closed'))
+
+    def __send(self, message: dict) -> Future:
+        """ Sends a message over the WebSocket and returns the Future for its response """
+        future = Future()
+        message['id'] = next(self.__ids)
+        with self.__lock:
+            if not self.connected():
+                self.__connect()
+            self.__pending[message['id']] = future
+            try:
+                self.__ws.send(json.dumps(message))
+            except (websocket.WebSocketException, OSError):
+                # the reader thread only fails the futures of the requests that were sent
+                self.__pending.pop(message['id'], None)
+                raise
+        return future
+
+    def request(self, command: str, **params) -> dict:
+        """ Sends the command to rippled and returns the `result` """
+        if self.websocket:
+            try:
+                response = self.__send({'command': command, **params}).result(timeout=self.timeout)
+            except FutureTimeoutError as e:
+                raise ConnectionError(f'Timeout while waiting for {command}') from e
+            except (websocket.WebSocketException, OSError) as e:
+                raise ConnectionError(e) from e
+        else:
+            try:
+                req = utils.get_session().post(
+                    self.url,
+                    json={'method': command, 'params': [params]},
+                    timeout=self.timeout,
+                )
+                req.raise_for_status()
+                response = req.json()
+            except requests.exceptions.RequestException as e:
+                raise ConnectionError(e) from e
+        result = response.get('result', {})
+        if response.get('status') == 'error' or result.get('status') == 'error':
+            raise ValueError(result.get('error') or response.get('error'))
+        return result
+
+    def close(self):
+        """ Closes the WebSocket connection. The reader thread fails the pending requests. """
+        with self.__lock:
+            ws, self.__ws = self.__ws, None
+        if ws:
+            ws.close()
+
+    def subscribe(self, accounts: list):
+        """ Subscribes to the transaction stream of the accounts (only over WebSocket) """
+        self.request('subscribe', accounts=list(accounts))
+        # only set after it succeeded, so a failed subscription is retried by the next refresh
+        self.subscriptions = list(accounts)
+
 
 class RippleConnector(Connector):
     """ The RippleConnector class """
     settings = {}
+    reconfigurable = ['addresses']
     params = {
         'addresses': {
             'key_type': 'list',
@@ -24,29 +146,178 @@ class RippleConnector(Connector):
             'default': 'https://data.ripple.com',
             'mandatory': False,
         },
+        'rippled_url': {
+            'key_type': 'string',
+            'default': None,
+            'mandatory': False,
+        },
+        'rippled_subscribe': {
+            'key_type': 'bool',
+            'default': False,
+            'mandatory': False,
+        },
+        'concurrency': {
+            'key_type': 'int',
+            'default': 10,
+            'mandatory': False,
+        },
     }
 
-    def __init__(self):
+    def __init__(self, settings=None):
         self.exchange = 'ripple'
         self.params.update(super().params)  # merge with the global params
-        self.settings = utils.gather_environ(self.params)
+        self.settings = utils.gather_environ(self.params, values=settings)
+        self.__rippled = None
+        self.__executor = None
+        self.__lock = threading.Lock()
+        self.__stale = set()
+        self.__connections = 0
+        if self.settings['rippled_url']:
+            self.__rippled = RippledClient(
+                url=self.settings['rippled_url'],
+                timeout=self.settings['timeout'],
+                on_transaction=self.__on_transaction,
+            )
+            self.__executor = ThreadPoolExecutor(
+                max_workers=max(1, self.settings['concurrency']),
+                thread_name_prefix='rippled',
+            )
         super().__init__()
 
+    def __on_transaction(self, message: dict):
+        """ Re-reads the accounts affected by a validated transaction from the subscription stream """
+        if not message.get('validated', True):
+            return
+        affected = set()
+        transaction = message.get('transaction', {})
+        for field in ['Account', 'Destination']:
+            affected.add(transaction.get(field))
+        for node in message.get('meta', {}).get('AffectedNodes', []):
+            for change in node.values():
+                fields = change.get('FinalFields') or change.get('NewFields') or {}
+                affected.add(fields.get('Account'))
+                for limit in ['HighLimit', 'LowLimit']:
+                    affected.add(fields.get(limit, {}).get('issuer'))
+        for account in affected.intersection(self.settings['addresses']):
+            log.debug(f'Ledger closed with a transaction for {account}. Refreshing the balances.')
+            try:
+                self.__executor.submit(self.__update_account, account)
+            except RuntimeError:
+                # stop() shut the executor down while the reader thread was still dispatching
+                return
+
+    def __read_account(self, account: str) -> dict:
+        """ Reads the XRP balance and the trust lines of an account from rippled """
+        balances = {}
+        info = self.__rippled.request('account_info', account=account, ledger_index='validated')
+        balances['XRP'] = int(info['account_data']['Balance']) / 1000000
+
+        marker = None
+        while True:
+            params = {'account': account, 'ledger_index': 'validated', 'limit': 400}
+            if marker:
+                params['marker'] = marker
+            lines = self.__rippled.request('account_lines', **params)
+            for line in lines.get('lines', []):
+                balances[line['currency']] = balances.get(line['currency'], 0) + float(line['balance'])
+            marker = lines.get('marker')
+            if not marker:
+                break
+        return balances
+
+    def __update_account(self, account: str) -> bool:
+        """ Reads the account from rippled and replaces its balances in self._accounts """
+        try:
+            balances = self.__read_account(account)
+        except (ConnectionError, ValueError) as e:
+            log.warning(f"Can't read {account} from {self.settings['rippled_url']}: {utils.short_msg(e)}")
+            with self.__lock:
+                self.__stale.add(account)
+            return False
+
+        with self.__lock:
+            for currency in self._accounts.values():
+                currency.pop(account, None)
+            for currency, value in balances.items():
+                if currency not in self._accounts:
+                    self._accounts.update({currency: {}})
+                self._accounts[currency].update({
+                    account: value,
+                })
+            self.__stale.discard(account)
+        return True
+
+    def _reconfigured(self, previous: dict):
+        """ Drops the removed accounts and reads the added ones with the next refresh """
+        added = set(self.settings['addresses'] or []) - set(previous.get('addresses') or [])
+        with self.__lock:
+            super()._reconfigured(previous)
+            self.__stale.update(added)
+        if self.__rippled:
+            # the next refresh subscribes to the new list of accounts
+            self.__rippled.subscriptions = []
+
+    def stop(self):
+        """ Closes the connection to rippled and stops the threads of the concurrent requests """
+        if self.__rippled:
+            self.__rippled.close()
+        if self.__executor:
+            self.__executor.shutdown(wait=False)
+
+    def __retrieve_rippled(self):
+        """ Reads all the accounts concurrently or, if subscribed, only the ones that failed to update """
+        rippled = self.__rippled
+        if self.settings['rippled_subscribe'] and rippled.websocket and not rippled.subscriptions:
+            # subscribing first, so the transactions during the following full read aren't missed
+            try:
+                rippled.subscribe(self.settings['addresses'])
+                log.info(f"Subscribed to the transactions of {len(self.settings['addresses'])} accounts")
+            except (ConnectionError, ValueError) as e:
+                log.warning(f"Can't subscribe to the accounts: {utils.short_msg(e)}")
+        streaming = self.settings['rippled_subscribe'] and rippled.websocket and rippled.subscriptions
+        if streaming and rippled.connected() and rippled.connections == self.__connections:
+            with self.__lock:
+                accounts = list(self.__stale)
+        else:
+            # a reconnect could have missed transactions, so everything gets read again
+            accounts = self.settings['addresses']
+            self.__connections = rippled.connections
+
+        updated = any(list(self.__executor.map(self.__update_account, accounts)))
+
+        try:
+            ledger = rippled.request('ledger', ledger_index='validated')
+            self._set_timestamp('accounts', ledger['ledger']['close_time'] + RIPPLE_EPOCH)
+        except (ConnectionError, ValueError, KeyError) as e:
+            log.debug(f"Can't read the close time of the validated ledger: {utils.short_msg(e)}")
+            if updated:
+                # without any account read, the accounts keep the time of their last read
+                self._set_timestamp('accounts')
+
     def retrieve_accounts(self):
         """ Connects to the ripple API and retrieves the account information """
         if not self.settings['addresses']:
             return
+        if self.__rippled:
+            self.__retrieve_rippled()
+            trace(log, lambda: f"Found the following accounts: {self._accounts}")
+            return
+        close_times = []
         for account in self.settings['addresses']:
             url = f"{self.settings['url']}/v2/accounts/{account}/balances"
             r = {}
             try:
-                r = requests.get(url, timeout=self.settings['timeout']).json()
+                r, _ = self._get_json(url)
             except (
                     requests.exceptions.ConnectionError,
                     requests.exceptions.ReadTimeout,
+                    requests.exceptions.HTTPError,
+                    ValueError,
             ) as e:
                 log.warning(f"Can't connect to {self.settings['url']}. Exception caught: {utils.short_msg(e)}")
 
+            if r.get('close_time'):
+                close_times.append(datetime.fromisoformat(r['close_time'].replace('Z', '+00:00')).timestamp())
             if r.get('result') == 'success' and r.get('balances'):
                 for balance in r.get('balances'):
                     value = float(balance.get('value'))
@@ -58,4 +329,6 @@ class RippleConnector(Connector):
                     })
 
             time.sleep(1)  # Don't hit the rate limit
-        log.log(5, f"Found the following accounts: {self._accounts}")
+        if close_times:
+            self._set_timestamp('accounts', min(close_times))
+        trace(log, lambda: f"Found the following accounts: {self._accounts}")
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Shards the addresses of a connector across a pool of worker processes """
+
+import logging
+import multiprocessing
+import os
+import time
+from ..lib import log as logging_setup
+from ..lib import utils
+from ..lib.log import trace
+from .connector import Connector
+
+log = logging.getLogger('crypto-exporter')
+
+
+def _worker(exchange: str, addresses: list, loglevel: int, pipe, share=1.0):
+    """
+    Runs in the worker process: builds the connector for its shard and answers the refresh commands
+
+    Every command is the name of a data class (`tickers`, `accounts` or `transactions`). The answer is a dict with
+    the data of the data class, its upstream timestamp, the rate limit hits and the authentication status.
+
+    :param share: The share of the API quotas (QUOTA_DAILY, QUOTA_PER_SECOND) for this shard
+    """
+    from . import get_connector  # pylint: disable=import-outside-toplevel
+
+    logging_setup.setup_logger(level=loglevel)
+    if addresses:
+        os.environ['ADDRESSES'] = ','.join(addresses)
+    # the shards split the quotas of the API key
+    if os.environ.get('QUOTA_DAILY'):
+        os.environ['QUOTA_DAILY'] = str(max(1, int(int(os.environ['QUOTA_DAILY']) * share)))
+    if os.environ.get('QUOTA_PER_SECOND'):
+        os.environ['QUOTA_PER_SECOND'] = str(float(os.environ['QUOTA_PER_SECOND']) * share)
+    connector = get_connector(exchange)
+    while True:
+        try:
+            command = pipe.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if command is None:
+            break
+        try:
+            getattr(connector, f'retrieve_{command}')()
+            data = getattr(connector, f'get_{command}')()
+        except Exception as e:  # pylint: disable=broad-except
+            log.error(f'Retrieving the {command} failed: {e}')
+            data = None
+        pipe.send({
+            'data': data,
+            'timestamp': connector.get_timestamps().get(command),
+            'rate_limit_hits': connector.rate_limit_hits,
+            'responses': connector.responses,
+            'cache': connector.get_cache_stats(),
+            'quota': connector.get_quota_stats(),
+            'enable_authentication': connector.settings.get('enable_authentication'),
+        })
+
+
+class ShardedConnector(Connector):  # pylint: disable=too-many-instance-attributes
+    """
+    Splits the addresses of the connector into shards and refreshes every shard in its own process
+
+    The JSON decoding and the processing run in parallel on all the cores; only the resulting data is sent back over
+    a pipe. Connectors without addresses (the ccxt exchanges) run in one worker process, which still keeps the
+    decoding off the process serving the metrics.
+
+    A worker that doesn't answer within `timeout` seconds is killed and restarted. Until it answers again, the last
+    answer of its shard is merged, so the addresses of the shard stay in the data, with their older timestamp.
+    """
+
+    def __init__(self, exchange: str, workers: int, timeout=300):
+        self.exchange = exchange
+        self.timeout = timeout
+        self.settings = {'enable_authentication': None}
+        addresses = [address for address in os.environ.get('ADDRESSES', '').split(',') if address]
+        shards = min(max(1, workers), max(1, len(addresses)))
+        self.__shards = [addresses[i::shards] for i in range(shards)] if addresses else [[]]
+        self.__context = multiprocessing.get_context('spawn')
+        self.__workers = [None] * len(self.__shards)
+        # the last answer of every shard by command
+        self.__answers = {}
+        self.__cache_stats = None
+        self.__quota_stats = None
+        for index in range(len(self.__shards)):
+            self.__start(index)
+        log.info(f'Started {len(self.__shards)} worker processes for {exchange}')
+        super().__init__()
+
+    def __start(self, index: int):
+        """ Starts the worker process for the shard """
+        parent, child = self.__context.Pipe()
+        process = self.__context.Process(
+            target=_worker,
+            args=(self.exchange, self.__shards[index], log.getEffectiveLevel(), child, 1 / len(self.__shards)),
+            name=f'{self.exchange}-worker-{index}',
+            daemon=True,
+        )
+        process.start()
+        self.__workers[index] = (process, parent)
+
+    def __receive(self, index: int, command: str, deadline: float):
+        """ Returns the answer of the worker or None, restarting it, if it doesn't answer before the deadline """
+        process, pipe = self.__workers[index]
+        try:
+            if pipe.poll(max(0.0, deadline - time.monotonic())):
+                return pipe.recv()
+            log.warning(f'Worker {index} did not answer within {self.timeout}s. Restarting it.')
+            process.kill()
+            process.join(timeout=5)
+            self.__start(index)
+        except (EOFError, OSError):
+            log.warning(f'Worker {index} exited while retrieving the {command}')
+        return None
+
+    def __refresh(self, command: str) -> list:
+        """ Sends the command to all the workers and collects the answers """
+        for index, (process, pipe) in enumerate(self.__workers):
+            if not process.is_alive():
+                log.warning(f'Worker {index} died with exit code {process.exitcode}. Restarting it.')
+                self.__start(index)
+                process, pipe = self.__workers[index]
+            pipe.send(command)
+
+        last_answers = self.__answers.setdefault(command, [None] * len(self.__workers))
+        deadline = time.monotonic() + self.timeout
+        answers = []
+        for index in range(len(self.__workers)):
+            answer = self.__receive(index, command, deadline)
+            if answer is not None and answer['data'] is not None:
+                last_answers[index] = answer
+            elif last_answers[index]:
+                # serves the last data of the shard until its worker answers again
+                answer = {**(answer or last_answers[index]), 'data': last_answers[index]['data'],
+                          'timestamp': last_answers[index]['timestamp']}
+            if answer is not None:
+                answers.append(answer)
+        self.rate_limit_hits = sum(answer['rate_limit_hits'] for answer in answers)
+        self.responses = {
+            result: sum(answer['responses'][result] for answer in answers) for result in ['changed', 'unchanged']
+        }
+        caches = [answer['cache'] for answer in answers if answer['cache']]
+        if caches:
+            self.__cache_stats = {result: sum(cache[result] for cache in caches) for result in caches[0]}
+        quotas = [answer['quota'] for answer in answers if answer['quota']]
+        if quotas:
+            self.__quota_stats = {key: sum(quota[key] for quota in quotas) for key in quotas[0]}
+        # the data is as old as the oldest shard
+        timestamps = [answer['timestamp'] for answer in answers if answer['timestamp']]
+        if timestamps:
+            self._set_timestamp(command, min(timestamps))
+        authentication = [answer['enable_authentication'] for answer in answers]
+        if None not in authentication:
+            self.settings['enable_authentication'] = all(authentication)
+        return [answer['data'] for answer in answers if answer['data'] is not None]
+
+    def get_cache_stats(self):
+        """ Returns the summed up cache counters of all the workers """
+        return self.__cache_stats
+
+    def get_quota_stats(self):
+        """ Returns the summed up API quotas of all the workers """
+        return self.__quota_stats
+
+    def get_enable_authentication(self):
+        """ Returns the status of the authentication of all the workers """
+        if self.settings['enable_authentication'] is None:
+            raise AttributeError(f'{self.exchange} reports no authentication status')
+        return self.settings['enable_authentication']
+
+    def retrieve_tickers(self):
+        """ Merges the tickers of all the shards """
+        tickers = {}
+        for data in self.__refresh('tickers'):
+            tickers.update(data)
+        self._tickers = tickers
+
+    def retrieve_accounts(self):
+        """ Merges the accounts of all the shards """
+        accounts = {}
+        for data in self.__refresh('accounts'):
+            for currency, balances in data.items():
+                accounts.setdefault(currency, {}).update(balances)
+        self._accounts = accounts
+        trace(log, lambda: f'Merged the accounts of {len(self.__workers)} shards: {utils.short_msg(accounts)}')
+
+    def retrieve_transactions(self):
+        """ Merges the transactions of all the shards """
+        transactions = {}
+        for data in self.__refresh('transactions'):
+            for key, value in data.items():
+                transactions[key] = transactions.get(key, 0) + value
+        self._transactions = transactions
+
+    def stop(self):
+        """ Stops the worker processes, killing the ones that don't exit within 5 seconds """
+        for process, pipe in self.__workers:
+            try:
+                pipe.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            process.join(timeout=5)
+            if process.is_alive():
+                process.kill()
@@ -3,6 +3,7 @@
 import logging
 from stellar_sdk.server import Server
 from ..lib import utils
+from ..lib.log import trace
 from .connector import Connector
 
 log = logging.getLogger('crypto-exporter')
@@ -11,6 +12,7 @@ log = logging.getLogger('crypto-exporter')
 class StellarConnector(Connector):
     """ The StellarConnector class """
     settings = {}
+    reconfigurable = ['addresses']
     params = {
         'addresses': {
             'key_type': 'list',
@@ -24,10 +26,10 @@ class StellarConnector(Connector):
         },
     }
 
-    def __init__(self):
+    def __init__(self, settings=None):
         self.exchange = 'stellar'
         self.params.update(super().params)  # merge with the global params
-        self.settings = utils.gather_environ(self.params)
+        self.settings = utils.gather_environ(self.params, values=settings)
         self.server = Server(horizon_url=self.settings['url'])
         super().__init__()
 
@@ -50,4 +52,5 @@ class StellarConnector(Connector):
                         f'{account}': float(balance.get('balance'))
                     })
 
-        log.log(5, f'Found the following accounts: {self._accounts}')
+        self._set_timestamp('accounts')
+        trace(log, lambda: f'Found the following accounts: {self._accounts}')
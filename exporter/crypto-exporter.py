@@ -5,17 +5,32 @@
 import time
 import os
 import sys
-from prometheus_client import start_http_server
+import resource
+import signal
 from prometheus_client.core import REGISTRY
+from .connectors import get_connector
+from .connectors.sharded_connector import ShardedConnector
 from .crypto_collector import CryptoCollector
+from .probe import Prober
+from .targets import Targets
+from .backfill import Backfill, parse_time
 from .lib import log as logging
 from .lib import constants
 from .lib import utils
 from .lib import errors
+from .lib import replay
+from .lib.snapshot import Snapshot
+from .lib.scheduler import RefreshScheduler
+from .lib.profiler import Profiler
+from .lib.push import Pusher
+from .lib.server import MetricsServer
+from .lib.config import ConfigWatcher
+from .lib.leader import LeaseElection
 
 version = f'{constants.VERSION}-{constants.BUILD}'
 
 if __name__ == '__main__':
+    started = time.time()
     # The generic params - always active
     params = {
         'port': {
@@ -23,6 +38,21 @@ if __name__ == '__main__':
             'default': 9188,
             'mandatory': False,
         },
+        'http_max_concurrency': {
+            'key_type': 'int',
+            'default': 8,
+            'mandatory': False,
+        },
+        'http_queue_timeout': {
+            'key_type': 'float',
+            'default': 30.0,
+            'mandatory': False,
+        },
+        'http_idle_timeout': {
+            'key_type': 'float',
+            'default': 60.0,
+            'mandatory': False,
+        },
         'loglevel': {
             'key_type': 'string',
             'default': 'INFO',
@@ -37,7 +67,199 @@ if __name__ == '__main__':
             'key_type': 'int',
             'default': '12201',
             'mandatory': False,
-        }
+        },
+        'gelf_queue_size': {
+            'key_type': 'int',
+            'default': 10000,
+            'mandatory': False,
+        },
+        'snapshot_file': {
+            'key_type': 'string',
+            'default': None,
+            'mandatory': False,
+        },
+        'scheduler': {
+            'key_type': 'bool',
+            'default': False,
+            'mandatory': False,
+        },
+        'tickers_interval': {
+            'key_type': 'float',
+            'default': 15,
+            'mandatory': False,
+        },
+        'accounts_interval': {
+            'key_type': 'int',
+            'default': 300,
+            'mandatory': False,
+        },
+        'transactions_interval': {
+            'key_type': 'int',
+            'default': 3600,
+            'mandatory': False,
+        },
+        'max_interval_factor': {
+            'key_type': 'int',
+            'default': 8,
+            'mandatory': False,
+        },
+        'top_n_balances': {
+            'key_type': 'int',
+            'default': None,
+            'mandatory': False,
+        },
+        'top_n_tickers': {
+            'key_type': 'int',
+            'default': None,
+            'mandatory': False,
+        },
+        'dust_threshold': {
+            'key_type': 'float',
+            'default': None,
+            'mandatory': False,
+        },
+        'dust_reference_currency': {
+            'key_type': 'string',
+            'default': None,
+            'mandatory': False,
+        },
+        'max_series': {
+            'key_type': 'int',
+            'default': None,
+            'mandatory': False,
+        },
+        'sample_timestamps': {
+            'key_type': 'bool',
+            'default': False,
+            'mandatory': False,
+        },
+        'probe_modules': {
+            'key_type': 'json',
+            'default': None,
+            'mandatory': False,
+            'redact': True,
+        },
+        'probe_ttl': {
+            'key_type': 'int',
+            'default': 60,
+            'mandatory': False,
+        },
+        'probe_max_targets': {
+            'key_type': 'int',
+            'default': 1000,
+            'mandatory': False,
+        },
+        'push_url': {
+            'key_type': 'string',
+            'default': None,
+            'mandatory': False,
+            'redact': True,
+        },
+        'push_mode': {
+            'key_type': 'string',
+            'default': 'remote_write',
+            'mandatory': False,
+        },
+        'push_interval': {
+            'key_type': 'float',
+            'default': 1.0,
+            'mandatory': False,
+        },
+        'push_queue_size': {
+            'key_type': 'int',
+            'default': 1000,
+            'mandatory': False,
+        },
+        'push_batch_size': {
+            'key_type': 'int',
+            'default': 100,
+            'mandatory': False,
+        },
+        'push_retries': {
+            'key_type': 'int',
+            'default': 5,
+            'mandatory': False,
+        },
+        'record': {
+            'key_type': 'string',
+            'default': None,
+            'mandatory': False,
+        },
+        'replay': {
+            'key_type': 'string',
+            'default': None,
+            'mandatory': False,
+        },
+        'replay_speed': {
+            'key_type': 'float',
+            'default': 1.0,
+            'mandatory': False,
+        },
+        'leader_lease_file': {
+            'key_type': 'string',
+            'default': None,
+            'mandatory': False,
+        },
+        'leader_lease_ttl': {
+            'key_type': 'int',
+            'default': 15,
+            'mandatory': False,
+        },
+        'leader_identity': {
+            'key_type': 'string',
+            'default': None,
+            'mandatory': False,
+        },
+        'debug_profiling': {
+            'key_type': 'bool',
+            'default': False,
+            'mandatory': False,
+        },
+        'config_file': {
+            'key_type': 'string',
+            'default': None,
+            'mandatory': False,
+        },
+        'config_interval': {
+            'key_type': 'float',
+            'default': 5.0,
+            'mandatory': False,
+        },
+        'workers': {
+            'key_type': 'int',
+            'default': 0,
+            'mandatory': False,
+        },
+        'worker_timeout': {
+            'key_type': 'int',
+            'default': 300,
+            'mandatory': False,
+        },
+        'backfill_start': {
+            'key_type': 'string',
+            'default': None,
+            'mandatory': False,
+        },
+        'backfill_end': {
+            'key_type': 'string',
+            'default': None,
+            'mandatory': False,
+        },
+        'backfill_step': {
+            'key_type': 'string',
+            'default': '1h',
+            'mandatory': False,
+        },
+        'backfill_dir': {
+            'key_type': 'string',
+            'default': '.',
+            'mandatory': False,
+        },
+        'backfill_chunk_mb': {
+            'key_type': 'int',
+            'default': 64,
+            'mandatory': False,
+        },
     }
     options = utils.gather_environ(params)
     exchange = os.environ.get('EXCHANGE', 'unconfigured')
@@ -46,54 +268,216 @@ if __name__ == '__main__':
         level=options['loglevel'],
         gelf_host=options['gelf_host'],
         gelf_port=options['gelf_port'],
+        gelf_queue_size=options['gelf_queue_size'],
         _exchange=exchange,
         _ix_id=f'{__package__}-{exchange}',
         _version=version,
     )
 
     try:
-        if exchange == 'unconfigured':
+        if exchange == 'unconfigured' and not options['probe_modules'] and not options['config_file']:
             raise ValueError("Missing EXCHANGE environment variable. See README.md.")
     except ValueError as e:
         log.error(f'{e}')
         sys.exit()
 
-    try:
-        if exchange == 'etherscan':
-            from .connectors.etherscan_connector import EtherscanConnector
-            connector = EtherscanConnector()
-        elif exchange == 'ethplorer':
-            from .connectors.ethplorer_connector import EthplorerConnector
-            connector = EthplorerConnector()
-        elif exchange == 'blockscout':
-            from .connectors.blockscout_connector import BlockscoutConnector
-            connector = BlockscoutConnector()
-        elif exchange == 'blockchain':
-            from .connectors.blockchain_connector import BlockchainConnector
-            connector = BlockchainConnector()
-        elif exchange == 'ripple':
-            from .connectors.ripple_connector import RippleConnector
-            connector = RippleConnector()
-        elif exchange == 'stellar':
-            from .connectors.stellar_connector import StellarConnector
-            connector = StellarConnector()
-        else:
-            from .connectors.ccxt_connector import CcxtConnector
-            connector = CcxtConnector(exchange=exchange)
-    except errors.EnvironmentMissing as e:
-        log.error(f'{e}')
-        sys.exit()
+    if options['config_file'] and exchange != 'unconfigured':
+        log.warning("CONFIG_FILE is set, so EXCHANGE and its settings are ignored. Use a target in the config file.")
+        exchange = 'unconfigured'
+
+    connector = None
+    if exchange != 'unconfigured':
+        try:
+            connector = get_connector(exchange)
+        except errors.EnvironmentMissing as e:
+            log.error(f'{e}')
+            sys.exit()
+        replay.install(
+            utils.get_session(),
+            record=options['record'],
+            replay=options['replay'],
+            speed=options['replay_speed'],
+            redact=connector.redact,
+        )
+        if options['backfill_start']:
+            if not hasattr(connector, 'fetch_rate_history'):
+                log.error(f'BACKFILL_START is only supported for the ccxt exchanges, not for {exchange}')
+                sys.exit()
+            try:
+                backfill = Backfill(
+                    connector,
+                    start=parse_time(options['backfill_start']),
+                    end=parse_time(options['backfill_end']) if options['backfill_end'] else None,
+                    timeframe=options['backfill_step'],
+                    directory=options['backfill_dir'],
+                    chunk_size=options['backfill_chunk_mb'] * 1048576,
+                )
+                backfill.run()
+            except (ValueError, OSError, errors.Error) as e:
+                log.error(f'The backfill failed: {connector.redact(str(e))}')
+                sys.exit(1)
+            sys.exit()
+        if options['workers'] and (options['record'] or options['replay']):
+            log.warning('RECORD and REPLAY only cover the requests of the main process, not the ones of the WORKERS')
+        if options['workers']:
+            # the settings are valid, now the workers take over
+            connector = ShardedConnector(exchange, workers=options['workers'], timeout=options['worker_timeout'])
 
     log.info(f"Starting {__package__} {version} on port {options['port']}")
 
-    if os.environ.get('TEST'):
+    limit_options = ['top_n_balances', 'top_n_tickers', 'dust_threshold', 'dust_reference_currency', 'max_series']
+    limits = {option: options[option] for option in limit_options if options[option]}
+    if options['push_url'] and not options['scheduler']:
+        log.error('PUSH_URL needs SCHEDULER=true, otherwise every snapshot refreshes all the data upstream')
+        sys.exit()
+    intervals = {
+        'tickers': options['tickers_interval'],
+        'accounts': options['accounts_interval'],
+        'transactions': options['transactions_interval'],
+    }
+
+    snapshot = None
+    if options['snapshot_file'] and not options['config_file']:
+        snapshot = Snapshot(options['snapshot_file'])
+
+    targets = None
+    if options['config_file']:
+        targets = Targets(
+            limits=limits,
+            snapshot_file=options['snapshot_file'],
+            intervals=intervals if options['scheduler'] and not os.environ.get('TEST') else None,
+            max_factor=options['max_interval_factor'],
+            sample_timestamps=options['sample_timestamps'],
+        )
+        watcher = ConfigWatcher(options['config_file'], on_change=targets.apply, interval=options['config_interval'])
+        try:
+            config = watcher.load()
+        except (OSError, ValueError) as e:
+            log.error(f"Can not load the CONFIG_FILE: {e}")
+            sys.exit()
+        replay.install(
+            utils.get_session(),
+            record=options['record'],
+            replay=options['replay'],
+            speed=options['replay_speed'],
+            redact=targets.redact,
+        )
+        if options['workers']:
+            log.warning('WORKERS is not supported with CONFIG_FILE. The targets are refreshed in threads.')
+        targets.apply(config)
+
+    if os.environ.get('TEST') and targets:
+        log.warning('Running in TEST mode')
+        for metric in targets.collect():
+            log.info(f"{metric}")
+        targets.stop()
+    elif os.environ.get('TEST') and connector:
         log.warning('Running in TEST mode')
-        collector = CryptoCollector(exchange=connector)
+        collector = CryptoCollector(
+            exchange=connector,
+            snapshot=snapshot,
+            limits=limits,
+            sample_timestamps=options['sample_timestamps'],
+        )
         for metric in collector.collect():
             log.info(f"{metric}")
+        # ru_maxrss is in kilobytes on Linux
+        log.info((
+            f'Time to first scrape: {time.time() - started:.3f}s.'
+            f' Peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB.'
+        ))
     else:
-        collector = CryptoCollector(exchange=connector)
-        REGISTRY.register(collector)
-        start_http_server(options['port'])
-        while True:
-            time.sleep(1)
+        prober = None
+        pusher = None
+        scheduler = None
+        server = MetricsServer(
+            options['port'],
+            max_concurrency=options['http_max_concurrency'],
+            queue_timeout=options['http_queue_timeout'],
+            idle_timeout=options['http_idle_timeout'],
+        )
+        for handler in log.handlers:
+            if isinstance(handler, logging.DroppingQueueHandler):
+                REGISTRY.register(handler)
+        election = None
+        if connector and options['leader_lease_file']:
+            if not snapshot:
+                log.error('LEADER_LEASE_FILE needs a SNAPSHOT_FILE on the shared volume')
+                sys.exit()
+            election = LeaseElection(
+                options['leader_lease_file'],
+                identity=options['leader_identity'],
+                ttl=options['leader_lease_ttl'],
+            )
+            election.start()
+            REGISTRY.register(election)
+        if connector:
+            if options['scheduler']:
+                scheduler = RefreshScheduler(
+                    connector,
+                    intervals=intervals,
+                    max_factor=options['max_interval_factor'],
+                )
+            collector = CryptoCollector(
+                exchange=connector,
+                snapshot=snapshot,
+                scheduler=scheduler,
+                limits=limits,
+                sample_timestamps=options['sample_timestamps'],
+                election=election,
+            )
+            REGISTRY.register(collector)
+            if options['debug_profiling']:
+                server.route('/debug/profile', Profiler(collector).profile)
+                log.warning('Serving /debug/profile')
+        if targets:
+            REGISTRY.register(targets)
+            REGISTRY.register(watcher)
+            watcher.start()
+            log.info(f"Serving the targets of {options['config_file']}: {', '.join(targets.get_targets())}")
+            if options['debug_profiling']:
+                log.warning('DEBUG_PROFILING is not supported with CONFIG_FILE')
+        if options['push_url'] and (connector or targets):
+            pusher = Pusher(
+                targets or collector,
+                url=options['push_url'],
+                mode=options['push_mode'],
+                interval=options['push_interval'],
+                queue_size=options['push_queue_size'],
+                batch_size=options['push_batch_size'],
+                retries=options['push_retries'],
+                grouping=None if targets else {'exchange': connector.exchange},
+            )
+            REGISTRY.register(pusher)
+            pusher.start()
+        if options['probe_modules']:
+            prober = Prober(
+                modules=options['probe_modules'],
+                ttl=options['probe_ttl'],
+                max_targets=options['probe_max_targets'],
+                limits=limits,
+            )
+            server.route('/probe', prober.probe)
+            log.info(f"Serving /probe for the modules: {', '.join(options['probe_modules'])}")
+        server.start()
+        signal.signal(signal.SIGTERM, lambda *_: server.stop())
+        try:
+            server.wait()
+        except KeyboardInterrupt:
+            server.stop()
+        # in the order of the dependencies: the pusher sends its queued snapshots, then the refreshes stop and last
+        # the connectors with their workers, streams and connections
+        if pusher:
+            pusher.stop(flush_timeout=10)
+        if scheduler:
+            scheduler.stop(timeout=10)
+        if election:
+            election.stop()
+        if targets:
+            watcher.stop()
+            targets.stop()
+        if prober:
+            prober.stop()
+        if connector:
+            connector.stop()
+        log.info(f'Stopped {__package__}')
@@ -2,18 +2,72 @@
 """ Prometheus Exporter for Crypto Exchanges """
 
 import time
-from prometheus_client.core import GaugeMetricFamily, InfoMetricFamily, StateSetMetricFamily
+import threading
+import logging
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, InfoMetricFamily, StateSetMetricFamily
 from .lib import constants
 
+log = logging.getLogger('crypto-exporter')
 
-class CryptoCollector():
+FAMILIES = {
+    'tickers': 'exchange_rate',
+    'accounts': 'account_balance',
+    'transactions': 'transactions_total',
+}
+
+
+def copy_data(data: dict) -> dict:
+    """
+    Copies the connector data two levels deep
+
+    Every dict is copied in one step, which a concurrent update of the connector can't interrupt.
+    """
+    copied = {}
+    for name, value in list(data.items()):
+        if isinstance(value, dict):
+            value = {key: dict(item) if isinstance(item, dict) else item for key, item in list(value.items())}
+        copied[name] = value
+    return copied
+
+
+class CryptoCollector():  # pylint: disable=too-many-instance-attributes,too-many-public-methods
     """ The CryptoCollector creating Prometheus metrics """
 
-    metrics = {}
+    def __init__(self, exchange, *, snapshot=None, scheduler=None, limits=None,  # pylint: disable=too-many-arguments
+                 sample_timestamps=False, election=None):
+        """
+        Initializes the class
 
-    def __init__(self, exchange):
-        """ Initializes the class """
+        :param election: If set, only the leader refreshes the data and saves the snapshot. The followers serve the
+                         snapshot of the leader.
+        """
         self.exchange = exchange
+        self.metrics = {}
+        self.limits = limits or {}
+        self.sample_timestamps = sample_timestamps
+        self.__dropped = {}
+        self.__overflows = {}
+        self.snapshot = snapshot
+        self.scheduler = scheduler
+        self.election = election
+        self.stale = False
+        self.refreshed = None  # if the last refresh() retrieved any data
+        self.__followed = None
+        self.__followed_time = None  # the time of the followed snapshot
+        self.__lock = threading.Lock()
+        self.__counts_lock = threading.Lock()
+        self.__warmup = None
+        self.__restored = None  # served while the warm-up refresh updates the connector data
+        if snapshot:
+            data = snapshot.load(exchange.exchange)
+            if data:
+                self.__restored = copy_data(data)
+                exchange.restore_snapshot(data)
+                if scheduler:
+                    scheduler.restore_snapshot(data)
+                self.stale = True
+        if scheduler:
+            scheduler.start(on_refresh=self.__on_scheduled_refresh, active=self.__leading)
         # Exporter information
         self.metrics['crypto_exporter'] = self.get_metric_exporter_info()
         # Uptime
@@ -77,68 +131,412 @@ class CryptoCollector():
             labels=['currency', 'reference_currency', 'exchange']
         )
 
-    def metric_transaction_total(self):
-        """ Returns an instance of GaugeMetricFamily initialized for transaction history """
+    def metric_transaction_total(self, account=False):
+        """
+        Returns an instance of GaugeMetricFamily initialized for transaction history
+
+        :param account: If set, with the label `account` for the credential sets of API_KEYS
+        """
         return GaugeMetricFamily(
             'transactions_total',
             'The transaction history for an account',
-            labels=['currency', 'reference_currency', 'exchange', 'type']
+            labels=['currency', 'reference_currency', 'exchange', 'type'] + (['account'] if account else [])
         )
 
-    def collect(self):
-        """ This is the function that takes the exchange data and converts it to prometheus metrics """
+    def get_metric_upstream_responses(self):
+        """ The upstream responses by result of the change detection """
+        m = CounterMetricFamily(
+            'upstream_responses',
+            'The upstream responses, by whether they changed since the last request',
+            labels=['exchange', 'result']
+        )
+        for result, count in self.exchange.responses.items():
+            m.add_metric(
+                value=count,
+                labels=[f'{self.exchange.exchange}', f'{result}'],
+            )
+        return m
+
+    def get_metric_response_cache(self):
+        """ The lookups in the response cache by result """
+        m = CounterMetricFamily(
+            'response_cache',
+            'The lookups in the response cache, by result (hit, miss or stale)',
+            labels=['exchange', 'result']
+        )
+        for result, count in (self.exchange.get_cache_stats() or {}).items():
+            m.add_metric(
+                value=count,
+                labels=[f'{self.exchange.exchange}', f'{result}'],
+            )
+        return m
+
+    def get_metric_api_quota(self):
+        """ The daily API quota and the calls left for today """
+        stats = self.exchange.get_quota_stats()
+        limit = GaugeMetricFamily('api_quota_limit', 'The daily API quota, 0 for unlimited', labels=['exchange'])
+        limit.add_metric(value=stats['limit'], labels=[f'{self.exchange.exchange}'])
+        remaining = GaugeMetricFamily(
+            'api_quota_remaining',
+            'The API calls left for today (UTC)',
+            labels=['exchange']
+        )
+        remaining.add_metric(value=stats['remaining'], labels=[f'{self.exchange.exchange}'])
+        deferred = CounterMetricFamily(
+            'api_quota_deferred_refreshes',
+            'The refreshes of addresses or tokens postponed to stay within the daily API quota',
+            labels=['exchange']
+        )
+        deferred.add_metric(value=stats['deferred'], labels=[f'{self.exchange.exchange}'])
+        return [limit, remaining, deferred]
+
+    def get_metric_stale(self):
+        """ Shows if the data is restored from the snapshot and not refreshed yet """
+        m = GaugeMetricFamily(
+            'stale_data',
+            'Set to 1 while the data from the snapshot is served, until the first refresh finishes',
+            labels=['exchange']
+        )
+        m.add_metric(
+            value=int(self.stale),
+            labels=[f'{self.exchange.exchange}'],
+        )
+        return m
+
+    def get_metric_refresh_interval(self):
+        """ The current refresh interval of every data class """
+        m = GaugeMetricFamily(
+            'refresh_interval_seconds',
+            'The current refresh interval of the data class',
+            labels=['exchange', 'data']
+        )
+        for name, interval in self.scheduler.get_intervals().items():
+            m.add_metric(
+                value=interval,
+                labels=[f'{self.exchange.exchange}', f'{name}'],
+            )
+        return m
+
+    def get_metric_data_age(self, timestamps):
+        """ How old the data of every metric family is, according to the upstream timestamps """
+        m = GaugeMetricFamily(
+            'data_age_seconds',
+            'The age of the data of the metric family, according to the upstream',
+            labels=['exchange', 'family']
+        )
+        now = time.time()
+        for name, family in FAMILIES.items():
+            if timestamps.get(name):
+                m.add_metric(
+                    value=max(0, now - timestamps[name]),
+                    labels=[f'{self.exchange.exchange}', f'{family}'],
+                )
+        return m
+
+    def __leading(self) -> bool:
+        """ Returns True, if this replica refreshes the data """
+        return not self.election or self.election.is_leader()
+
+    def __follow(self):
+        """
+        Loads the snapshot of the leader, if it changed
+
+        The leader saves the snapshot after every refresh of a data class. With the scheduler, the snapshot is stale,
+        if it's older than twice the longest interval of the most often refreshed data class. Without the scheduler,
+        the leader refreshes on its own scrapes, so the age of the snapshot isn't checked.
+        """
+        modified = self.snapshot.modified()
+        if modified is not None and modified != self.__followed:
+            data = self.snapshot.load(self.exchange.exchange, quiet=True)
+            if data:
+                self.exchange.restore_snapshot(data)
+                if self.scheduler:
+                    self.scheduler.restore_snapshot(data)
+                self.__followed = modified
+                self.__followed_time = data['time']
+        if self.__followed_time is None:
+            return
+        max_intervals = self.scheduler.get_max_intervals() if self.scheduler else {}
+        self.stale = bool(max_intervals) and time.time() - self.__followed_time > 2 * min(max_intervals.values())
+
+    def __on_scheduled_refresh(self, name):
+        """ Called by the scheduler after refreshing a data class """
+        log.debug(f'The scheduler refreshed the {name}')
+        if self.snapshot and self.__leading():
+            self.snapshot.save(self.exchange.exchange, self.scheduler.get_snapshot())
+        if self.scheduler.warm():
+            self.stale = False
+
+    def refresh(self) -> bool:
+        """
+        Retrieves the tickers, the accounts and the transactions from the exchange
+
+        The connectors log the upstream errors and keep their last data, so a retrieval succeeded, if the timestamp of
+        its data class changed or if responses younger than the CACHE_TTL were served from the response cache.
+
+        :return: True, if any data was retrieved. Also stored in `self.refreshed`.
+        """
         exchange = self.exchange
-        metrics = self.metrics
+        with self.__lock:
+            before = dict(exchange.get_timestamps())
+            hits = (exchange.get_cache_stats() or {}).get('hit', 0)
+            exchange.retrieve_tickers()
+            exchange.retrieve_accounts()
+            exchange.retrieve_transactions()
+            after = exchange.get_timestamps()
+            retrieved = (
+                any(timestamp != before.get(name) for name, timestamp in after.items())
+                or (exchange.get_cache_stats() or {}).get('hit', 0) > hits
+            )
+            self.refreshed = retrieved
+            if not retrieved:
+                log.debug('No new data was retrieved. Serving the last data.')
+                return False
+            if self.snapshot and self.__leading():
+                self.snapshot.save(exchange.exchange, exchange.get_snapshot())
+            self.stale = False
+        return True
+
+    def __data(self) -> dict:
+        """ Returns a copy of the connector data or, during the warm-up, of the restored snapshot """
+        if self.stale and self.__restored is not None:
+            return self.__restored
+        self.__restored = None
+        with self.__lock:
+            return copy_data(self.exchange.get_snapshot())
+
+    def __warm_up(self):
+        """ Refreshes in the background, while the data from the snapshot is served """
+        if not (self.__warmup and self.__warmup.is_alive()):
+            log.info('Serving the data from the snapshot until the first refresh finishes')
+            self.__warmup = threading.Thread(target=self.refresh, name='warm-up', daemon=True)
+            self.__warmup.start()
+
+    def get_metric_series_dropped(self):
+        """ How many series were dropped by the cardinality limits in the last scrape """
+        m = GaugeMetricFamily(
+            'series_dropped',
+            'The number of series dropped by the cardinality limits in the last scrape',
+            labels=['exchange', 'family', 'reason']
+        )
+        with self.__counts_lock:
+            dropped = dict(self.__dropped)
+        for (family, reason), count in dropped.items():
+            m.add_metric(
+                value=count,
+                labels=[f'{self.exchange.exchange}', f'{family}', f'{reason}'],
+            )
+        return m
+
+    def get_metric_series_overflow(self):
+        """ How many times a metric family reached MAX_SERIES """
+        m = CounterMetricFamily(
+            'series_overflow',
+            'The number of scrapes in which the metric family reached the maximum number of series',
+            labels=['exchange', 'family']
+        )
+        with self.__counts_lock:
+            overflows = dict(self.__overflows)
+        for family, count in overflows.items():
+            m.add_metric(
+                value=count,
+                labels=[f'{self.exchange.exchange}', f'{family}'],
+            )
+        return m
+
+    @staticmethod
+    def __drop(dropped, family, reason, count):
+        """ Counts the dropped series of the scrape in `dropped` """
+        if count > 0:
+            dropped[(family, reason)] = dropped.get((family, reason), 0) + count
+
+    def __limit(self, family, entries, top_n=None, dropped=None):
+        """
+        Applies TOP_N and MAX_SERIES to the entries, which have to be sorted by importance
+
+        :param dropped: Counts the dropped series of the scrape
+        :return: The entries to export
+        """
+        dropped = {} if dropped is None else dropped
+        if top_n and len(entries) > top_n:
+            self.__drop(dropped, family, 'top_n', len(entries) - top_n)
+            entries = entries[:top_n]
+        max_series = self.limits.get('max_series')
+        if max_series and len(entries) > max_series:
+            self.__drop(dropped, family, 'max_series', len(entries) - max_series)
+            entries = entries[:max_series]
+        return entries
+
+    @staticmethod
+    def value_in(currency, amount, reference_currency, rates):
+        """
+        Converts the amount to the reference currency
+
+        :param rates: A dict with (currency, reference_currency) as key and the exchange rate as value
+        :return: The value or None, if there is no rate for the pair
+        """
+        if currency == reference_currency:
+            return amount
+        if rates.get((currency, reference_currency)):
+            return amount * rates[(currency, reference_currency)]
+        if rates.get((reference_currency, currency)):
+            return amount / rates[(reference_currency, currency)]
+        return None
+
+    def build_exchange_rate(self, tickers, timestamp=None, dropped=None):
+        """
+        Builds the exchange_rate metric from the tickers
 
-        exchange.retrieve_tickers()
-        tickers = exchange.get_tickers()
+        :param timestamp: The timestamp for the samples of the tickers without their own timestamp
+        :param dropped: Counts the series dropped by the cardinality limits
+        """
+        exchange = self.exchange
         exchange_rate = self.metric_exchange_rate()
-        for rate in tickers:
+        entries = list(tickers.values())
+        if self.limits.get('top_n_tickers') or self.limits.get('max_series'):
+            # the most traded pairs first
+            entries.sort(key=lambda ticker: ticker.get('volume') or 0, reverse=True)
+        for ticker in self.__limit('exchange_rate', entries, self.limits.get('top_n_tickers'), dropped):
             exchange_rate.add_metric(
-                value=tickers[rate]['value'],
+                value=ticker['value'],
                 labels=[
-                    f"{tickers[rate]['currency']}",
-                    f"{tickers[rate]['reference_currency']}",
+                    f"{ticker['currency']}",
+                    f"{ticker['reference_currency']}",
                     f'{exchange.exchange}',
-                ]
+                ],
+                timestamp=ticker.get('timestamp', timestamp) if timestamp else None,
             )
-        yield exchange_rate
+        return exchange_rate
 
-        exchange.retrieve_accounts()
-        accounts = exchange.get_accounts()
-        account_balance = self.metric_account_balance()
+    def __balance_entries(self, accounts, tickers, dropped) -> list:
+        """ Returns the (value, currency, account, amount) of the balances, without the dust """
+        reference_currency = self.limits.get('dust_reference_currency')
+        dust_threshold = self.limits.get('dust_threshold')
+        rates = {}
+        if reference_currency:
+            for ticker in (tickers or {}).values():
+                rates[(ticker['currency'], ticker['reference_currency'])] = ticker['value']
+
+        entries = []
         for currency in accounts:
             for account_type in accounts[currency]:
                 if (
                         accounts[currency].get(account_type,)
                         and not (accounts[currency].get(account_type, 0) == 0)
                 ):
-                    account_balance.add_metric(
-                        value=accounts[currency][account_type],
-                        labels=[
-                            f'{currency}',
-                            f'{account_type}',
-                            f'{exchange.exchange}',
-                        ]
-                    )
-        yield account_balance
-
-        exchange.retrieve_transactions()
-        transaction_data = exchange.get_transactions()
-        transactions_total = self.metric_transaction_total()
-        for currency, reference_currency, transaction_type in transaction_data:
+                    amount = accounts[currency][account_type]
+                    value = amount
+                    if reference_currency:
+                        value = self.value_in(currency, amount, reference_currency, rates)
+                    # without a reference currency, the plain amounts are compared to the threshold
+                    if dust_threshold and value is not None and abs(value) < dust_threshold:
+                        self.__drop(dropped, 'account_balance', 'dust', 1)
+                        continue
+                    entries.append((value, currency, account_type, amount))
+        return entries
+
+    def build_account_balance(self, accounts, tickers=None, timestamp=None, dropped=None):
+        """
+        Builds the account_balance metric from the accounts
+
+        :param dropped: Counts the series dropped by the cardinality limits
+        """
+        dropped = {} if dropped is None else dropped
+        exchange = self.exchange
+        account_balance = self.metric_account_balance()
+        entries = self.__balance_entries(accounts, tickers, dropped)
+
+        if self.limits.get('top_n_balances') or self.limits.get('max_series'):
+            # the highest values first, the balances which can't be valued last
+            entries.sort(key=lambda entry: (entry[0] is not None, abs(entry[0] or 0)), reverse=True)
+        for _, currency, account_type, amount in self.__limit(
+                'account_balance', entries, self.limits.get('top_n_balances'), dropped
+        ):
+            account_balance.add_metric(
+                value=amount,
+                labels=[
+                    f'{currency}',
+                    f'{account_type}',
+                    f'{exchange.exchange}',
+                ],
+                timestamp=timestamp,
+            )
+        return account_balance
+
+    def build_transactions_total(self, transaction_data, timestamp=None, dropped=None):
+        """
+        Builds the transactions_total metric from the transactions
+
+        :param dropped: Counts the series dropped by the cardinality limits
+        """
+        exchange = self.exchange
+        # the totals of the credential sets of API_KEYS have the name of the set as fourth element
+        transactions_total = self.metric_transaction_total(account=any(len(key) == 4 for key in transaction_data))
+        keys = self.__limit('transactions_total', list(transaction_data), dropped=dropped)
+        for key in keys:
+            currency, reference_currency, transaction_type = key[:3]
             transactions_total.add_metric(
-                value=transaction_data[(currency, reference_currency, transaction_type)],
+                value=transaction_data[key],
                 labels=[
                     f'{currency}',
                     f'{reference_currency}',
                     f'{exchange.exchange}',
                     f'{transaction_type}',
-                ]
+                ] + [f'{name}' for name in key[3:]],
+                timestamp=timestamp,
             )
-        yield transactions_total
+        return transactions_total
+
+    def build(self, data):
+        """ Builds the metric families of the exchange data """
+        sample_timestamps = (data.get('timestamps') or {}) if self.sample_timestamps else {}
+        # counted per scrape, since concurrent scrapes build at the same time
+        dropped = {}
+        families = [
+            self.build_exchange_rate(data['tickers'], sample_timestamps.get('tickers'), dropped),
+            self.build_account_balance(data['accounts'], data['tickers'], sample_timestamps.get('accounts'), dropped),
+            self.build_transactions_total(data['transactions'], sample_timestamps.get('transactions'), dropped),
+        ]
+        with self.__counts_lock:
+            self.__dropped = dropped
+            for family, reason in dropped:
+                if reason == 'max_series':
+                    self.__overflows[family] = self.__overflows.get(family, 0) + 1
+        return families
+
+    def collect(self):
+        """ This is the function that takes the exchange data and converts it to prometheus metrics """
+        metrics = self.metrics
+
+        if not self.__leading():
+            self.__follow()
+            data = self.scheduler.get_snapshot() if self.scheduler else self.exchange.get_snapshot()
+        elif self.scheduler:
+            data = self.scheduler.get_snapshot()
+        else:
+            if self.stale:
+                self.__warm_up()
+            else:
+                self.refresh()
+            data = self.__data()
+
+        yield from self.build(data)
 
         metrics['authentication'] = self.get_metric_authentication()
+        metrics['upstream_responses'] = self.get_metric_upstream_responses()
+        metrics['data_age_seconds'] = self.get_metric_data_age(data.get('timestamps') or {})
+        if self.exchange.get_cache_stats():
+            metrics['response_cache'] = self.get_metric_response_cache()
+        if self.exchange.get_quota_stats():
+            for metric in self.get_metric_api_quota():
+                metrics[metric.name] = metric
+        if self.scheduler:
+            metrics['refresh_interval_seconds'] = self.get_metric_refresh_interval()
+        if self.snapshot:
+            metrics['stale_data'] = self.get_metric_stale()
+        if self.limits:
+            metrics['series_dropped'] = self.get_metric_series_dropped()
+            metrics['series_overflow'] = self.get_metric_series_overflow()
 
         for metric in metrics.values():
             yield metric
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" A stale-while-revalidate cache for the upstream requests """
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger('crypto-exporter')
+
+
+class ResponseCache():
+    """
+    Caches the results of the upstream requests by key
+
+    * younger than `ttl`: the cached value is returned (`hit`)
+    * older than `ttl`: the value is loaded again (`miss`). If the loading fails or another thread is already loading
+      the same key, the cached value is returned instead (`stale`), as long as it's not older than `ttl + max_stale`
+    * at most `max_size` keys are kept, the least recently used ones are evicted first
+    """
+
+    def __init__(self, ttl=0, max_stale=3600, max_size=1024):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.max_size = max_size
+        self.stats = {'hit': 0, 'miss': 0, 'stale': 0}
+        self.__entries = OrderedDict()
+        self.__loading = set()
+        self.__lock = threading.Lock()
+
+    def __store(self, key, value):
+        """ Stores the value and evicts the least recently used entries """
+        with self.__lock:
+            self.__entries[key] = {'value': value, 'time': time.time()}
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+
+    def loaded_at(self, key):
+        """ Returns when the cached value for the key was loaded (UNIX time), None if it's not cached """
+        with self.__lock:
+            entry = self.__entries.get(key)
+        return entry['time'] if entry else None
+
+    def get(self, key, loader, valid=lambda value: value is not None):
+        """
+        Returns the value for the key
+
+        :param key: A hashable key for the request
+        :param loader: Called without arguments to load the value from the upstream
+        :param valid: Called with the loaded value, returns False if the loading failed
+        :return: The value, or whatever the loader returned if there's no usable cached value
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry:
+                self.__entries.move_to_end(key)
+                age = time.time() - entry['time']
+                if age < self.ttl:
+                    self.stats['hit'] += 1
+                    return entry['value']
+                if key in self.__loading and age < self.ttl + self.max_stale:
+                    self.stats['stale'] += 1
+                    return entry['value']
+            self.__loading.add(key)
+
+        try:
+            value = loader()
+        finally:
+            with self.__lock:
+                self.__loading.discard(key)
+
+        if valid(value):
+            self.stats['miss'] += 1
+            self.__store(key, value)
+            return value
+        if entry and time.time() - entry['time'] < self.ttl + self.max_stale:
+            log.warning(f"Loading failed. Serving the cached value from {time.ctime(entry['time'])}.")
+            self.stats['stale'] += 1
+            return entry['value']
+        self.stats['miss'] += 1
+        return value
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Loads the config file and watches it for changes """
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+log = logging.getLogger('crypto-exporter')
+
+
+def parse(content: bytes, path: str) -> dict:
+    """
+    Parses and validates the content of the config file. Files ending with `.yaml` or `.yml` need PyYAML, all the
+    others are JSON.
+
+    {
+        'targets': {
+            NAME: {'exchange': EXCHANGE, SETTING: value, ...},
+        },
+    }
+
+    :raises ValueError: if the content is not valid
+    """
+    if path.endswith(('.yaml', '.yml')):
+        if not yaml:
+            raise ValueError(f'PyYAML is not installed. Use JSON for {path} or install PyYAML.')
+        try:
+            config = yaml.safe_load(content)
+        except yaml.YAMLError as e:
+            raise ValueError(f'{path} is not valid YAML: {e}') from e
+    else:
+        try:
+            config = json.loads(content)
+        except ValueError as e:
+            raise ValueError(f'{path} is not valid JSON: {e}') from e
+
+    if not isinstance(config, dict) or not isinstance(config.get('targets'), dict):
+        raise ValueError(f'{path} needs the object "targets"')
+    for name, settings in config['targets'].items():
+        if not isinstance(settings, dict) or not settings.get('exchange'):
+            raise ValueError(f'The target "{name}" in {path} needs the key "exchange"')
+    return config
+
+
+class ConfigWatcher():  # pylint: disable=too-many-instance-attributes
+    """
+    Checks the config file every `interval` seconds and calls `on_change` with the new config, if it changed
+
+    Only the content counts, so touching the file or replacing it with the same content (like Kubernetes does with
+    ConfigMaps) doesn't reload anything. An invalid file is logged and ignored; the last valid config stays active.
+    """
+
+    def __init__(self, path: str, on_change, interval=5.0):
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self.reloads = {'success': 0, 'failure': 0}
+        self.last_success = 0
+        self.__stat = None
+        self.__digest = None
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+
+    def load(self) -> dict:
+        """ Loads the config file for the first time """
+        with open(self.path, 'rb') as f:
+            content = f.read()
+        config = parse(content, self.path)
+        self.__stat = self.__get_stat()
+        self.__digest = hashlib.blake2b(content, digest_size=16).digest()
+        self.last_success = time.time()
+        return config
+
+    def __get_stat(self):
+        """ Returns the modification time, the size and the inode of the file (following symlinks) """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def check(self) -> bool:
+        """ Reloads the config, if the file changed. Returns True if the new config was applied. """
+        with self.__lock:
+            stat = self.__get_stat()
+            if stat is None or stat == self.__stat:
+                return False
+            self.__stat = stat
+            try:
+                with open(self.path, 'rb') as f:
+                    content = f.read()
+                digest = hashlib.blake2b(content, digest_size=16).digest()
+                if digest == self.__digest:
+                    return False
+                config = parse(content, self.path)
+                self.on_change(config)
+            except (OSError, ValueError) as e:
+                log.error(f'Not reloading {self.path}: {e}')
+                self.reloads['failure'] += 1
+                return False
+            self.__digest = digest
+            self.reloads['success'] += 1
+            self.last_success = time.time()
+            log.info(f'Reloaded {self.path}')
+            return True
+
+    def start(self):
+        """ Starts watching the file """
+        self.__stop.clear()
+        threading.Thread(target=self.__run, name='config-watcher', daemon=True).start()
+
+    def stop(self):
+        """ Stops watching the file """
+        self.__stop.set()
+
+    def __run(self):
+        """ Checks the file every interval """
+        while not self.__stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:  # pylint: disable=broad-except
+                log.exception(f'Applying the config from {self.path} failed: {e}')
+                self.reloads['failure'] += 1
+
+    def collect(self):
+        """ Exports the reloads of the config file """
+        m = CounterMetricFamily(
+            'config_reloads',
+            'The reloads of the config file, by result',
+            labels=['result']
+        )
+        for result, count in self.reloads.items():
+            m.add_metric(value=count, labels=[f'{result}'])
+        yield m
+        m = GaugeMetricFamily('config_last_reload_success_timestamp_seconds', 'When the config was last reloaded')
+        m.add_metric(value=self.last_success, labels=[])
+        yield m
+
+    def describe(self):
+        """ See https://github.com/prometheus/client_python#custom-collectors """
+        return []
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Loads only the needed exchanges from ccxt
+
+`import ccxt` imports every exchange implementation, which costs seconds at startup and a lot of memory. Instead,
+an empty `ccxt` package is registered, which still resolves its sub-modules from the installed ccxt package, so
+only `ccxt.base` and the configured exchange get imported. The same goes for `ccxt.async_support` and `ccxt.pro`,
+which are needed for the streaming tickers.
+"""
+
+import importlib
+import importlib.util
+import logging
+import sys
+import types
+
+log = logging.getLogger('crypto-exporter')
+
+
+def _stub(name: str):
+    """ Registers an empty package, which resolves its sub-modules from the installed one """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f'No module named {name}')
+    package = types.ModuleType(name)
+    package.__spec__ = spec
+    package.__file__ = spec.origin
+    package.__path__ = list(spec.submodule_search_locations)
+    sys.modules[name] = package
+    parent, _, child = name.rpartition('.')
+    if parent:
+        setattr(sys.modules[parent], child, package)
+    return package
+
+
+def _install():
+    """ Registers the lightweight `ccxt` package, unless ccxt has already been imported """
+    if 'ccxt' in sys.modules:
+        return sys.modules['ccxt']
+    package = _stub('ccxt')
+
+    errors = importlib.import_module('ccxt.base.errors')
+    for name, value in vars(errors).items():
+        if not name.startswith('_'):
+            setattr(package, name, value)
+    package.Exchange = importlib.import_module('ccxt.base.exchange').Exchange
+    log.debug('Registered the lightweight ccxt package')
+    return package
+
+
+ccxt = _install()
+
+
+def get_exchange(name: str):
+    """
+    Imports the exchange implementation
+
+    :param name: The ccxt id of the exchange (for example `kraken`)
+    :return: The exchange class
+    """
+    if not hasattr(ccxt, name):
+        if not name.isidentifier():
+            raise AttributeError(f"ccxt has no exchange '{name}'")
+        try:
+            module = importlib.import_module(f'ccxt.{name}')
+        except ModuleNotFoundError as e:
+            raise AttributeError(f"ccxt has no exchange '{name}'") from e
+        setattr(ccxt, name, getattr(module, name))
+    return getattr(ccxt, name)
+
+
+def get_pro_exchange(name: str):
+    """
+    Imports the streaming implementation of the exchange from ccxt.pro
+
+    :param name: The ccxt id of the exchange (for example `kraken`)
+    :return: The exchange class or None, if the installed ccxt has no streaming support for the exchange
+    """
+    if not name.isidentifier():
+        return None
+    try:
+        # the ccxt.pro exchanges extend the exchanges from ccxt.async_support
+        async_support = _stub('ccxt.async_support')
+        if not hasattr(async_support, name):
+            setattr(async_support, name, getattr(importlib.import_module(f'ccxt.async_support.{name}'), name))
+        pro = _stub('ccxt.pro')
+        if not hasattr(pro, name):
+            setattr(pro, name, getattr(importlib.import_module(f'ccxt.pro.{name}'), name))
+    except ModuleNotFoundError as e:
+        log.debug(f'No streaming support for {name}: {e}')
+        return None
+    return getattr(pro, name)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Elects one leader among the exporter replicas with a lease file on a shared volume """
+
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger('crypto-exporter')
+
+
+class LeaseElection():  # pylint: disable=too-many-instance-attributes
+    """
+    Holds the leadership as long as the lease in the file is renewed
+
+    The lease is a small JSON file with the holder and the expiry time. A replica takes the lease, if it's missing,
+    expired or its own, and renews it every third of `ttl`. The read-modify-write is serialized with `flock` on a
+    `.lock` file next to it, if the platform supports it, and the winner is checked by reading the lease back.
+
+    A leader which can't renew its lease (for example, because the volume hangs) steps down once its lease expired,
+    measured on its own monotonic clock. The expiry time in the file uses the wall clock, so the clocks of the
+    replicas have to be in sync to within a fraction of `ttl`.
+    """
+
+    def __init__(self, path: str, identity=None, ttl=15):
+        self.path = path
+        self.identity = identity or f'{socket.gethostname()}-{os.getpid()}'
+        self.ttl = ttl
+        self.transitions = 0
+        self.on_change = None
+        self.__valid_until = 0  # monotonic
+        self.__leader = False
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def is_leader(self) -> bool:
+        """ Returns True while this replica holds a valid lease """
+        return self.__leader and time.monotonic() < self.__valid_until
+
+    def __read(self) -> dict:
+        """ Returns the current lease or an empty dict """
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            log.warning(f'Ignoring the invalid lease in {self.path}: {e}')
+            return {}
+
+    def __write(self, lease: dict):
+        """ Replaces the lease file atomically """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile('w', dir=directory, prefix='.lease-', delete=False, encoding='utf-8') as f:
+            json.dump(lease, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f.name, self.path)
+
+    def __try_acquire(self) -> bool:
+        """ Takes or renews the lease, if it's free, expired or already ours """
+        started = time.monotonic()
+        with open(f'{self.path}.lock', 'a', encoding='utf-8') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                lease = self.__read()
+                if lease.get('holder') not in (None, self.identity) and lease.get('expires', 0) > time.time():
+                    return False
+                self.__write({'holder': self.identity, 'expires': time.time() + self.ttl})
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        if self.__read().get('holder') != self.identity:
+            return False
+        self.__valid_until = started + self.ttl
+        return True
+
+    def check(self):
+        """ Takes or renews the lease and updates the leadership """
+        try:
+            leader = self.__try_acquire()
+        except OSError as e:
+            log.warning(f'Could not renew the lease in {self.path}: {e}')
+            leader = self.is_leader()
+        if leader != self.__leader:
+            self.__leader = leader
+            self.transitions += 1
+            log.info(f"{self.identity} is now {'the leader' if leader else 'a follower'}")
+            if self.on_change:
+                self.on_change(leader)
+
+    def start(self, on_change=None):
+        """ Checks the lease right away and then in a background thread. `on_change` gets the new leadership. """
+        self.on_change = on_change
+        self.__stop.clear()
+        self.check()
+        self.__thread = threading.Thread(target=self.__run, name='leader-election', daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Stops renewing the lease and releases it, so another replica can take over right away
+
+        The running check finishes first, so it can't take the lease again after the release.
+        """
+        self.__stop.set()
+        if self.__thread:
+            self.__thread.join(timeout=self.ttl)
+        if self.__leader:
+            self.__leader = False
+            try:
+                if self.__read().get('holder') == self.identity:
+                    self.__write({'holder': None, 'expires': 0})
+                    log.info(f'Released the lease in {self.path}')
+            except OSError as e:
+                log.warning(f'Could not release the lease in {self.path}: {e}')
+
+    def __run(self):
+        """ Renews the lease every third of the ttl """
+        while not self.__stop.wait(self.ttl / 3):
+            self.check()
+
+    def collect(self):
+        """ Exports the leadership """
+        m = GaugeMetricFamily('leader', 'Set to 1 while this replica is the leader', labels=['identity'])
+        m.add_metric(value=int(self.is_leader()), labels=[f'{self.identity}'])
+        yield m
+        m = CounterMetricFamily('leader_transitions', 'How often the leadership of this replica changed')
+        m.add_metric(value=self.transitions, labels=[])
+        yield m
+
+    def describe(self):
+        """ See https://github.com/prometheus/client_python#custom-collectors """
+        return []
@@ -2,14 +2,130 @@
 # -*- coding: utf-8 -*-
 """ Global logging configuration """
 
+import atexit
+import copy
 import logging
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
 import pygelf
+from prometheus_client.core import CounterMetricFamily
 
+TRACE = 5
 
-def setup_logger(name='crypto-exporter', level='INFO', gelf_host=None, gelf_port=None, **kwargs):
-    """ sets up the logger """
+
+def trace(logger, message):
+    """
+    Logs the message with the level TRACE
+
+    :param message: The message or a callable returning it. The callable is only called, if TRACE is enabled, so
+                    the large dicts (tickers, markets, ledgers) are only formatted when they are logged.
+    """
+    if logger.isEnabledFor(TRACE):
+        logger.log(TRACE, message() if callable(message) else message, stacklevel=2)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Puts the records into a bounded queue, so a slow log destination never blocks the caller
+
+    When the queue is full, the record is dropped and counted. Unlike QueueHandler, the queued record keeps its
+    exception, so the GELF handler sends the traceback as `full_message` instead of appending it to the message.
+    """
+
+    def __init__(self, maxsize=10000):
+        super().__init__(queue.Queue(maxsize=maxsize))
+        self.dropped = 0
+        self.__dropped_lock = threading.Lock()
+
+    def prepare(self, record):
+        """ Returns a copy of the record with the merged message and the exception """
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        return record
+
+    def enqueue(self, record):
+        """ Queues the record or drops it, if the queue is full """
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.__dropped_lock:
+                self.dropped += 1
+
+    def collect(self):
+        """ Exports the number of dropped records """
+        m = CounterMetricFamily('log_records_dropped', 'The log records dropped because the log queue was full')
+        m.add_metric([], self.dropped)
+        yield m
+
+    def describe(self):
+        """ See https://github.com/prometheus/client_python#custom-collectors """
+        return []
+
+
+class BatchingQueueListener(QueueListener):
+    """
+    Hands the queued records to the handlers in batches
+
+    After the blocking get of the first record, the records already waiting are taken without blocking, up to
+    `batch_size`. Every handler handles the batch under one acquisition of its lock. GELF over UDP sends one datagram
+    per record, so the batch isn't one message, but a burst costs one wakeup of the thread instead of one per record.
+    """
+
+    def __init__(self, records, *handlers, batch_size=100):
+        super().__init__(records, *handlers, respect_handler_level=True)
+        self.batch_size = max(1, batch_size)
+
+    def dequeue_batch(self) -> list:
+        """ Waits for a record and returns it with the records waiting behind it """
+        batch = [self.dequeue(True)]
+        while len(batch) < self.batch_size and batch[-1] is not self._sentinel:
+            try:
+                batch.append(self.dequeue(False))
+            except queue.Empty:
+                break
+        return batch
+
+    def handle_batch(self, batch: list):
+        """ Passes the records to the handlers, which accept their level """
+        for handler in self.handlers:
+            with handler.lock:
+                for record in batch:
+                    if record.levelno >= handler.level and handler.filter(record):
+                        handler.emit(record)
+
+    def enqueue_sentinel(self):
+        """ Waits for a free slot, since the sentinel of a full queue must not be dropped """
+        self.queue.put(self._sentinel)
+
+    def _monitor(self):
+        """ Replaces the record by record loop of QueueListener. Runs in the thread started by start(). """
+        while True:
+            batch = self.dequeue_batch()
+            stop = batch[-1] is self._sentinel
+            records = [record for record in batch if record is not self._sentinel]
+            if records:
+                self.handle_batch(records)
+            for _ in batch:
+                self.queue.task_done()
+            if stop:
+                break
+
+
+def setup_logger(name='crypto-exporter', level='INFO', gelf_host=None, gelf_port=None, gelf_queue_size=10000,
+                 **kwargs):
+    """
+    sets up the logger
+
+    The GELF handler runs in a background thread behind a queue of `gelf_queue_size` records, which the thread drains
+    in batches
+    """
     logging.basicConfig(handlers=[logging.NullHandler()])
-    logging.addLevelName(5, 'TRACE')
+    logging.addLevelName(TRACE, 'TRACE')
 
     formatter = logging.Formatter(
         fmt='%(asctime)s.%(msecs)03d %(levelname)s [%(module)s.%(funcName)s] %(message)s',
@@ -23,13 +139,17 @@ def setup_logger(name='crypto-exporter', level='INFO', gelf_host=None, gelf_port
     logger.addHandler(handler)
 
     if gelf_host and gelf_port:
-        handler = pygelf.GelfUdpHandler(
+        gelf_handler = pygelf.GelfUdpHandler(
             host=gelf_host,
             port=gelf_port,
             debug=True,
             include_extra_fields=True,
             **kwargs
         )
+        handler = DroppingQueueHandler(maxsize=gelf_queue_size)
+        listener = BatchingQueueListener(handler.queue, gelf_handler)
+        listener.start()
+        atexit.register(listener.stop)  # sends the queued records on exit
         logger.addHandler(handler)
 
     return logger
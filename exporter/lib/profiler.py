@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Profiles the refresh cycles of a collector on demand """
+
+import cProfile
+import io
+import logging
+import pstats
+import threading
+import time
+import tracemalloc
+from . import utils
+
+log = logging.getLogger('crypto-exporter')
+
+SORT_KEYS = ['cumulative', 'tottime', 'ncalls']
+
+
+def wall_time(intervals: list) -> float:
+    """ Returns the time covered by at least one of the (start, end) intervals """
+    total = 0.0
+    covered = None
+    for start, end in sorted(intervals):
+        if covered is None or start > covered:
+            total += end - start
+            covered = end
+        elif end > covered:
+            total += end - covered
+            covered = end
+    return total
+
+
+def allocations(before, after, memory: tuple, limit: int) -> str:
+    """ Returns the allocations between the tracemalloc snapshots, with the traced and the peak memory """
+    current, peak = memory
+    lines = [f'--- tracemalloc (traced: {current / 1048576:.1f} MiB, peak: {peak / 1048576:.1f} MiB) ---\n']
+    lines.extend(f'{stat}\n' for stat in after.compare_to(before, 'lineno')[:limit])
+    return ''.join(lines)
+
+
+class Profiler():
+    """
+    Serves `/debug/profile?cycles=N`
+
+    Runs N refresh cycles of the collector with cProfile and tracemalloc and returns a plain text report:
+    * the time of every cycle, split into the network (while at least one request waited for its response headers,
+      so the concurrent requests of the thread pools are counted once), the parsing (the rest of the refresh) and the
+      metric building, with the number of requests and of the threads which sent them
+    * the functions with the most time, from cProfile. Only the thread running the cycles is profiled; the work of
+      the thread pools of the connectors shows up as waiting.
+    * the allocations during the cycles, from tracemalloc
+    """
+
+    def __init__(self, collector, max_cycles=10):
+        self.collector = collector
+        self.max_cycles = max_cycles
+        self.__lock = threading.Lock()
+
+    def profile(self, params: dict, _headers=None) -> tuple:
+        """ Handles /debug/profile?cycles=<N>&sort=<cumulative|tottime|ncalls>&limit=<lines> """
+        try:
+            cycles = min(self.max_cycles, max(1, int(params.get('cycles', ['1'])[0])))
+            limit = max(1, int(params.get('limit', ['30'])[0]))
+        except ValueError:
+            return 400, 'text/plain; charset=utf-8', b'cycles and limit have to be numbers\n'
+        sort = params.get('sort', ['cumulative'])[0]
+        if sort not in SORT_KEYS:
+            return 400, 'text/plain; charset=utf-8', f"sort has to be one of: {', '.join(SORT_KEYS)}\n".encode()
+        if not self.__lock.acquire(blocking=False):  # pylint: disable=consider-using-with
+            return 409, 'text/plain; charset=utf-8', b'A profile is already running\n'
+        try:
+            log.info(f'Profiling {cycles} refresh cycles')
+            return 200, 'text/plain; charset=utf-8', self.run(cycles, sort=sort, limit=limit).encode()
+        finally:
+            self.__lock.release()
+
+    def __cycle(self, cycle: int, profile, network: list) -> str:
+        """ Runs one refresh cycle and returns its line of the report """
+        collector = self.collector
+        profile.enable()
+        started = time.perf_counter()
+        collector.refresh()
+        refreshed = time.perf_counter()
+        collector.build(collector.exchange.get_snapshot())
+        built = time.perf_counter()
+        profile.disable()
+        network_time = wall_time([(start, end) for _thread, start, end in network])
+        parsing_time = max(0, refreshed - started - network_time)
+        return (
+            f'{cycle:>5} {built - started:>8.3f}s {network_time:>8.3f}s'
+            f' {parsing_time:>8.3f}s {built - refreshed:>8.3f}s {len(network):>8}'
+            f' {len({thread for thread, _start, _end in network}):>7}\n'
+        )
+
+    def run(self, cycles: int, sort='cumulative', limit=30) -> str:
+        """ Runs the refresh cycles and returns the report """
+        network = []
+        session = utils.get_session()
+
+        def on_response(response, *_args, **_kwargs):
+            end = time.perf_counter()
+            network.append((threading.get_ident(), end - response.elapsed.total_seconds(), end))
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(10)
+        before = tracemalloc.take_snapshot()
+        profile = cProfile.Profile()
+        session.hooks['response'].append(on_response)
+        report = io.StringIO()
+        report.write(f'Profile of {self.collector.exchange.exchange}, {cycles} cycles\n\n')
+        report.write((
+            f"{'cycle':>5} {'total':>9} {'network':>9} {'parsing':>9} {'building':>9} {'requests':>8} {'threads':>7}\n"
+        ))
+        try:
+            for cycle in range(1, cycles + 1):
+                network.clear()
+                report.write(self.__cycle(cycle, profile, network))
+            after = tracemalloc.take_snapshot()
+            memory = tracemalloc.get_traced_memory()
+        finally:
+            session.hooks['response'].remove(on_response)
+            if started_tracing:
+                tracemalloc.stop()
+
+        report.write(f'\n--- cProfile (sorted by {sort}) ---\n')
+        pstats.Stats(profile, stream=report).sort_stats(sort).print_stats(limit)
+        report.write(allocations(before, after, memory, limit))
+        return report.getvalue()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Pushes the metrics to a Prometheus remote-write endpoint or to a Pushgateway """
+
+import copy
+import logging
+import struct
+import threading
+import time
+from collections import deque
+import requests
+from prometheus_client import exposition
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from . import utils
+from .server import Families
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+log = logging.getLogger('crypto-exporter')
+
+MODES = ['remote_write', 'pushgateway']
+
+
+def _varint(value: int) -> bytes:
+    """ Encodes the unsigned integer as protobuf varint """
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _length_delimited(number: int, data: bytes) -> bytes:
+    """ Encodes a protobuf field with the wire type 2 (strings, bytes and messages) """
+    return _varint(number << 3 | 2) + _varint(len(data)) + data
+
+
+def encode_write_request(series: dict) -> bytes:
+    """
+    Encodes the series as remote-write `WriteRequest` protobuf message
+
+    :param series: A tuple of (name, value) label pairs as key and a list of (timestamp in ms, value) as value
+    """
+    message = bytearray()
+    for labels, samples in series.items():
+        timeseries = bytearray()
+        for name, value in labels:
+            label = _length_delimited(1, name.encode()) + _length_delimited(2, value.encode())
+            timeseries += _length_delimited(1, label)
+        for timestamp, value in samples:
+            sample = b'\x09' + struct.pack('<d', value) + b'\x10' + _varint(timestamp & 0xffffffffffffffff)
+            timeseries += _length_delimited(2, sample)
+        message += _length_delimited(1, bytes(timeseries))
+    return bytes(message)
+
+
+def snappy_compress(data: bytes) -> bytes:
+    """
+    Compresses the data in the snappy block format
+
+    Without python-snappy the data is stored as literals only, which every snappy decoder accepts, but which doesn't
+    reduce the size.
+    """
+    if snappy:
+        return snappy.compress(data)
+    out = bytearray(_varint(len(data)))
+    for offset in range(0, len(data), 65536):
+        chunk = data[offset:offset + 65536]
+        length = len(chunk) - 1
+        if length < 60:
+            out.append(length << 2)
+        elif length < 0x100:
+            out += bytes([60 << 2, length])
+        else:
+            out += bytes([61 << 2]) + length.to_bytes(2, 'little')
+        out += chunk
+    return bytes(out)
+
+
+class Pusher():  # pylint: disable=too-many-instance-attributes
+    """
+    Pushes the metric families of a collector every `interval` seconds
+
+    The snapshots are queued in memory and a sender thread sends them in batches of up to `batch_size` snapshots.
+    Failed batches are retried with an exponential backoff. While the endpoint is down or too slow, the queue fills up
+    to `queue_size` snapshots and then the oldest snapshots are dropped, so the memory stays bounded and the freshest
+    data gets sent once the endpoint recovers.
+
+    * `remote_write`: every snapshot is sent with its own timestamp, so the full resolution arrives
+    * `pushgateway`: only the latest snapshot of a batch is sent, since the Pushgateway keeps only the last push
+    """
+
+    def __init__(self, collector, url: str, *, mode='remote_write', interval=1.0,  # pylint: disable=too-many-arguments
+                 queue_size=1000, batch_size=100, retries=5, job='crypto-exporter', grouping=None, timeout=10):
+        """
+        The collector is collected every `interval` seconds, so it has to serve its data without refreshing it
+        (with a RefreshScheduler).
+
+        :param grouping: Additional labels of the Pushgateway grouping key, for example the exchange
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown push mode {mode}. Supported are: {', '.join(MODES)}")
+        self.collector = collector
+        self.url = url
+        self.mode = mode
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self.retries = retries
+        self.job = job
+        self.grouping = grouping or {}
+        self.timeout = timeout
+        self.stats = {'sent': 0, 'failed': 0, 'dropped': 0}
+        self.__queue = deque(maxlen=max(1, queue_size))
+        self.__condition = threading.Condition()
+        self.__stop = threading.Event()
+        self.__stopping = threading.Event()  # stops the sampling, the sender pushes the queued snapshots
+        self.__sender = None
+        if mode == 'remote_write' and not snappy:
+            log.info('python-snappy is not installed. The remote-write requests are sent uncompressed.')
+
+    def start(self):
+        """ Starts the sampling and the sender thread """
+        self.__stop.clear()
+        self.__stopping.clear()
+        threading.Thread(target=self.__sample, name='push-sampler', daemon=True).start()
+        self.__sender = threading.Thread(target=self.__send, name='push-sender', daemon=True)
+        self.__sender.start()
+        log.info(f'Pushing the metrics every {self.interval}s to {self.mode}')
+
+    def stop(self, flush_timeout=None):
+        """
+        Stops the threads
+
+        :param flush_timeout: If set, the queued snapshots are pushed for up to `flush_timeout` seconds before the
+                              sender stops. The snapshots still queued after it are discarded.
+        """
+        self.__stopping.set()
+        with self.__condition:
+            self.__condition.notify_all()
+        if flush_timeout and self.__sender:
+            log.info(f'Pushing the {len(self.__queue)} queued snapshots')
+            self.__sender.join(flush_timeout)
+        self.__stop.set()
+        with self.__condition:
+            self.__condition.notify_all()
+
+    def offer(self, families: list, timestamp=None):
+        """ Queues a snapshot of the metric families. A full queue drops its oldest snapshot. """
+        with self.__condition:
+            if len(self.__queue) == self.__queue.maxlen:
+                self.stats['dropped'] += 1
+            self.__queue.append((timestamp or time.time(), families))
+            self.__condition.notify()
+
+    def __sample(self):
+        """ Queues a snapshot every interval """
+        while not self.__stopping.is_set():
+            started = time.time()
+            try:
+                self.offer(list(self.collector.collect()), started)
+            except Exception as e:  # pylint: disable=broad-except
+                log.error(f'Collecting the metrics to push failed: {e}')
+            self.__stopping.wait(max(0, self.interval - (time.time() - started)))
+
+    def __send(self):
+        """ Sends the queued snapshots in batches """
+        while not self.__stop.is_set():
+            with self.__condition:
+                while not self.__queue and not self.__stop.is_set():
+                    if self.__stopping.is_set():
+                        # all the queued snapshots were pushed
+                        return
+                    self.__condition.wait()
+                batch = [self.__queue.popleft() for _ in range(min(self.batch_size, len(self.__queue)))]
+            if not batch:
+                continue
+            error = None
+            for attempt in range(self.retries + 1):
+                try:
+                    self.__push(batch)
+                    self.stats['sent'] += len(batch)
+                    break
+                except requests.exceptions.HTTPError as e:
+                    if e.response is not None and e.response.status_code < 500 and e.response.status_code != 429:
+                        log.error(f'The push was rejected: {utils.short_msg(e)}')
+                        self.stats['failed'] += len(batch)
+                        break
+                    error = e
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    error = e
+                if attempt == self.retries or self.__stop.wait(min(30, 0.5 * 2 ** attempt)):
+                    log.warning(f'Giving up pushing {len(batch)} snapshots: {utils.short_msg(error)}')
+                    self.stats['failed'] += len(batch)
+                    break
+
+    def __push(self, batch: list):
+        """ Sends one batch to the endpoint """
+        session = utils.get_session()
+        if self.mode == 'pushgateway':
+            _, families = batch[-1]
+            # the Pushgateway rejects samples with timestamps
+            families = [self.__without_timestamps(family) for family in families]
+            path = ''.join(f'/{key}/{value}' for key, value in self.grouping.items())
+            r = session.put(
+                f'{self.url.rstrip("/")}/metrics/job/{self.job}{path}',
+                data=exposition.generate_latest(Families(families)),
+                headers={'Content-Type': exposition.CONTENT_TYPE_LATEST},
+                timeout=self.timeout,
+            )
+        else:
+            r = session.post(
+                self.url,
+                data=snappy_compress(encode_write_request(self.__series(batch))),
+                headers={
+                    'Content-Type': 'application/x-protobuf',
+                    'Content-Encoding': 'snappy',
+                    'X-Prometheus-Remote-Write-Version': '0.1.0',
+                },
+                timeout=self.timeout,
+            )
+        r.raise_for_status()
+
+    @staticmethod
+    def __without_timestamps(family):
+        """ Returns a copy of the metric family without the sample timestamps """
+        family = copy.copy(family)
+        family.samples = [sample._replace(timestamp=None) for sample in family.samples]
+        return family
+
+    def __series(self, batch: list) -> dict:
+        """ Groups the samples of the snapshots by series, in the order of their timestamps """
+        series = {}
+        for snapshot_time, families in batch:
+            for family in families:
+                for sample in family.samples:
+                    labels = {'__name__': sample.name, 'job': self.job, **sample.labels}
+                    timestamp = sample.timestamp if sample.timestamp is not None else snapshot_time
+                    key = tuple(sorted(labels.items()))
+                    series.setdefault(key, []).append((int(float(timestamp) * 1000), float(sample.value)))
+        for samples in series.values():
+            samples.sort(key=lambda sample: sample[0])
+        return series
+
+    def collect(self):
+        """ Exports the state of the push pipeline """
+        m = CounterMetricFamily(
+            'push_snapshots',
+            'The pushed snapshots, by result (sent, failed or dropped because the queue was full)',
+            labels=['mode', 'result']
+        )
+        for result, count in self.stats.items():
+            m.add_metric(value=count, labels=[f'{self.mode}', f'{result}'])
+        yield m
+        m = GaugeMetricFamily('push_queue_length', 'The number of snapshots waiting to be pushed', labels=['mode'])
+        m.add_metric(value=len(self.__queue), labels=[f'{self.mode}'])
+        yield m
+
+    def describe(self):
+        """ See https://github.com/prometheus/client_python#custom-collectors """
+        return []
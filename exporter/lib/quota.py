@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Plans the calls of the metered APIs (etherscan, ethplorer) within the daily and the per-second quota of a key """
+
+import logging
+import threading
+import time
+
+log = logging.getLogger('crypto-exporter')
+
+DAY = 86400
+
+
+class QuotaPlanner():  # pylint: disable=too-many-instance-attributes
+    """
+    Counts the calls of an API key and decides which items (addresses, tokens) are refreshed when
+
+    The metered explorers reset the daily quota at 00:00 UTC. Instead of calling until the quota is used up and then
+    failing for the rest of the day, the remaining calls are spread over the remaining time of the day: every item
+    gets a share of them by its weight, which gives its minimum refresh interval. Items that haven't been refreshed
+    yet are always due. The weights are calculated once per refresh cycle by plan().
+
+    The weight of an item is 1, plus up to 9 by its value relative to the highest value of its group (the currency),
+    times 4, if it changed at its last refresh. So the high-value and the active wallets are refreshed more often.
+    """
+
+    def __init__(self, daily=None, per_second=None):
+        """
+        :param daily: The calls per day (UTC), None for unlimited
+        :param per_second: The calls per second, None for unlimited
+        """
+        self.daily = daily
+        self.per_second = per_second
+        self.deferred = 0  # the refreshes postponed to save the quota
+        self.__day = None
+        self.__used = 0
+        self.__next = 0.0  # monotonic, the next free slot for a call
+        self.__items = {}
+        self.__weights = {}
+        self.__total = 0.0
+        self.__lock = threading.Lock()
+
+    def __roll(self, now: float):
+        """ Starts a new day at 00:00 UTC """
+        day = int(now // DAY)
+        if day != self.__day:
+            if self.__day is not None:
+                log.info(f'A new day started. {self.__used} calls were made yesterday.')
+            self.__day = day
+            self.__used = 0
+
+    def remaining(self):
+        """ Returns the calls left for today or None, if the daily quota is unlimited """
+        if not self.daily:
+            return None
+        with self.__lock:
+            self.__roll(time.time())
+            return max(0, self.daily - self.__used)
+
+    def acquire(self) -> bool:
+        """
+        Counts a call and waits for its slot within the per-second quota
+
+        :return: False (without waiting), if the daily quota is used up
+        """
+        with self.__lock:
+            self.__roll(time.time())
+            if self.daily and self.__used >= self.daily:
+                return False
+            self.__used += 1
+            now = time.monotonic()
+            start = max(now, self.__next)
+            if self.per_second:
+                self.__next = start + 1 / self.per_second
+        if start > now:
+            time.sleep(start - now)
+        return True
+
+    def exhaust(self):
+        """ Marks the daily quota as used up, when the upstream reports it (for example after a restart) """
+        with self.__lock:
+            self.__roll(time.time())
+            if self.daily:
+                self.__used = max(self.__used, self.daily)
+        log.warning('The daily API quota is used up. Serving the last data until 00:00 UTC.')
+
+    def plan(self):
+        """ Calculates the weights of the items. Called at the start of every refresh cycle. """
+        with self.__lock:
+            highest = {}
+            for item in self.__items.values():
+                highest[item['group']] = max(highest.get(item['group'], 0), item['value'])
+            self.__weights = {}
+            for key, item in self.__items.items():
+                weight = 1.0
+                if highest[item['group']] > 0:
+                    weight += 9 * item['value'] / highest[item['group']]
+                if item['changed']:
+                    weight *= 4
+                self.__weights[key] = weight
+            self.__total = sum(self.__weights.values())
+
+    def due(self, key) -> bool:
+        """ Returns True, if the item should be refreshed now """
+        if not self.daily:
+            return True
+        now = time.time()
+        with self.__lock:
+            self.__roll(now)
+            remaining = self.daily - self.__used
+            item = self.__items.get(key)
+            if remaining <= 0:
+                due = False
+            elif not item or key not in self.__weights:
+                due = True
+            else:
+                # the calls per second available until the reset
+                rate = remaining / (DAY - now % DAY)
+                due = now - item['refreshed'] >= self.__total / (rate * self.__weights[key])
+            if not due:
+                self.deferred += 1
+        return due
+
+    def update(self, key, value=0.0, changed=True, group=None):
+        """
+        Records the refresh of the item
+
+        :param value: The value of the item (for example the balance), to prioritize the high-value items
+        :param changed: If the data of the item changed with this refresh
+        :param group: The items with comparable values (for example the currency)
+        """
+        with self.__lock:
+            self.__items[key] = {
+                'refreshed': time.time(),
+                'value': abs(float(value or 0)),
+                'changed': changed,
+                'group': group,
+            }
+
+    def refreshed_at(self, key):
+        """ Returns when the item was refreshed the last time (UNIX time), None if it wasn't yet """
+        item = self.__items.get(key)
+        return item['refreshed'] if item else None
+
+    def stats(self) -> dict:
+        """ Returns the daily quota, the calls left for today and the postponed refreshes """
+        remaining = self.remaining()
+        return {
+            'limit': self.daily or 0,
+            'remaining': remaining if remaining is not None else 0,
+            'deferred': self.deferred,
+        }
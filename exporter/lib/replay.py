@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Records the upstream HTTP responses to a fixture file and replays them """
+
+import datetime
+import gzip
+import json
+import logging
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+log = logging.getLogger('crypto-exporter')
+
+# these parameters change on every request, so they are ignored when matching the requests
+VOLATILE = {'nonce', 'timestamp', 'signature', 'sign', 'apikey', 'api_key', 'recvwindow'}
+HEADERS = ['content-type', 'etag', 'last-modified', 'x-ratelimit-limit', 'x-ratelimit-remaining']
+
+
+def request_key(method: str, url: str, body=None) -> str:
+    """ Returns the key of the request without the volatile parameters """
+    parts = urlsplit(url)
+    query = urlencode(sorted((k, v) for k, v in parse_qsl(parts.query) if k.lower() not in VOLATILE))
+    if isinstance(body, bytes):
+        body = body.decode(errors='replace')
+    params = ''
+    if body:
+        try:
+            decoded = json.loads(body)
+            if isinstance(decoded, dict):
+                decoded = {k: v for k, v in decoded.items() if k.lower() not in VOLATILE}
+            params = json.dumps(decoded, sort_keys=True)
+        except ValueError:
+            params = urlencode(sorted((k, v) for k, v in parse_qsl(body) if k.lower() not in VOLATILE))
+    return f"{method} {urlunsplit((parts.scheme, parts.netloc, parts.path, query, ''))} {params}".strip()
+
+
+class RecordingAdapter(HTTPAdapter):
+    """ Sends the requests and appends every response to the fixture file (gzipped JSON lines) """
+
+    def __init__(self, path: str, redact=None, **kwargs):
+        """
+        :param redact: Called with every string written to the fixture, returns it without the sensitive information
+        """
+        super().__init__(**kwargs)
+        self.path = path
+        self.redact = redact or (lambda message: message)
+        self.__lock = threading.Lock()
+
+    def send(self, request, **kwargs):  # pylint: disable=arguments-differ
+        """ Sends the request and records the response """
+        response = super().send(request, **kwargs)
+        entry = {
+            'key': self.redact(request_key(request.method, request.url, request.body)),
+            'elapsed': response.elapsed.total_seconds(),
+            'status': response.status_code,
+            'headers': {name: response.headers[name] for name in HEADERS if name in response.headers},
+            'content': self.redact(response.content.decode(errors='replace')),
+        }
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self.__lock:
+            # every line is its own gzip member, so the file stays readable if the exporter gets killed
+            with gzip.open(self.path, 'at', encoding='utf-8') as f:
+                f.write(line)
+        return response
+
+
+class ReplayAdapter(HTTPAdapter):
+    """
+    Answers the requests from the fixture file, without any network access
+
+    The responses for the same request are returned in the recorded order and start over once they are used up, so
+    a fixture can be replayed for any number of refreshes. Every response is delayed by its recorded duration divided
+    by `speed` (`0` disables the delays).
+    """
+
+    def __init__(self, path: str, speed=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.speed = speed
+        self.__responses = {}
+        self.__positions = {}
+        self.__lock = threading.Lock()
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                self.__responses.setdefault(entry['key'], []).append(entry)
+        log.info(f'Replaying {sum(len(r) for r in self.__responses.values())} responses from {path}')
+
+    def send(self, request, **_kwargs):  # pylint: disable=arguments-differ
+        """ Returns the next recorded response for the request """
+        key = request_key(request.method, request.url, request.body)
+        with self.__lock:
+            entries = self.__responses.get(key)
+            if not entries:
+                raise requests.exceptions.ConnectionError(f'No recorded response for {key}', request=request)
+            position = self.__positions.get(key, 0)
+            self.__positions[key] = (position + 1) % len(entries)
+        entry = entries[position]
+        if self.speed:
+            time.sleep(entry['elapsed'] / self.speed)
+
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.reason = 'Replayed'
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = 'utf-8'
+        response._content = entry['content'].encode()  # pylint: disable=protected-access
+        response.url = request.url
+        response.request = request
+        response.elapsed = datetime.timedelta(seconds=entry['elapsed'])
+        return response
+
+
+def install(session: requests.Session, record=None, replay=None, speed=1.0, redact=None):
+    """
+    Mounts the recording or the replaying adapter on the session
+
+    :param record: The fixture file to append the responses to
+    :param replay: The fixture file to answer the requests from
+    """
+    if replay:
+        adapter = ReplayAdapter(replay, speed=speed)
+    elif record:
+        adapter = RecordingAdapter(record, redact=redact)
+        log.warning(f'Recording all the upstream responses to {record}')
+    else:
+        return
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Refreshes the connector data in the background, each data class on its own adaptive interval """
+
+import copy
+import logging
+import threading
+import time
+
+log = logging.getLogger('crypto-exporter')
+
+DATA_CLASSES = ['tickers', 'accounts', 'transactions']
+
+
+class RefreshScheduler():  # pylint: disable=too-many-instance-attributes
+    """
+    Runs `retrieve_tickers`, `retrieve_accounts` and `retrieve_transactions` independently
+
+    Every data class starts at its configured interval. When a refresh doesn't change the data, or the exchange
+    throttles, the interval grows (up to `max_factor` times the configured interval). When the data changes, the
+    interval shrinks again, down to the configured interval. A failed refresh doubles the interval, like a throttled
+    one.
+    """
+
+    def __init__(self, connector, intervals: dict, max_factor=8):
+        """
+        :param connector: The connector to refresh
+        :param intervals: The minimum interval in seconds for every data class. `0` disables the data class.
+        :param max_factor: How far the interval can grow
+        """
+        self.connector = connector
+        self.on_refresh = None
+        self.active = None
+        self.jobs = {}
+        for name in DATA_CLASSES:
+            if intervals.get(name):
+                self.jobs[name] = {
+                    'min': intervals[name],
+                    'max': intervals[name] * max(1, max_factor),
+                    'interval': intervals[name],
+                    'next': 0,
+                    'fingerprint': None,
+                    'done': False,
+                }
+        self.__data = {name: {} for name in DATA_CLASSES}
+        self.__data['timestamps'] = {}
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def start(self, on_refresh=None, active=None):
+        """
+        Starts the background thread
+
+        :param on_refresh: Gets called with the name of the data class after a refresh
+        :param active: If set, the data classes are only refreshed while it returns True
+        """
+        if not self.jobs or (self.__thread and self.__thread.is_alive()):
+            return
+        self.on_refresh = on_refresh
+        self.active = active
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__run, name='scheduler', daemon=True)
+        self.__thread.start()
+        log.info(f"Started the refresh scheduler with the intervals: {self.get_intervals()}")
+
+    def stop(self, timeout=None):
+        """
+        Stops the background thread after the running refresh
+
+        :param timeout: If set, waits up to `timeout` seconds for the running refresh to finish
+        """
+        self.__stop.set()
+        if timeout and self.__thread and self.__thread is not threading.current_thread():
+            self.__thread.join(timeout)
+
+    def warm(self) -> bool:
+        """ Returns True once every data class has been refreshed at least once """
+        return all(job['done'] for job in self.jobs.values())
+
+    def get_intervals(self) -> dict:
+        """ Returns the current interval for every data class """
+        return {name: job['interval'] for name, job in self.jobs.items()}
+
+    def get_max_intervals(self) -> dict:
+        """ Returns the longest interval for every data class """
+        return {name: job['max'] for name, job in self.jobs.items()}
+
+    def get_snapshot(self) -> dict:
+        """ Returns a consistent copy of the data, as it was after the last refresh of every data class """
+        with self.__lock:
+            snapshot = dict(self.__data)
+            snapshot['timestamps'] = dict(self.__data['timestamps'])
+            return snapshot
+
+    def restore_snapshot(self, snapshot: dict):
+        """ Serves this data until the data classes get refreshed """
+        with self.__lock:
+            for name in DATA_CLASSES:
+                self.__data[name] = snapshot.get(name, {})
+            self.__data['timestamps'] = dict(snapshot.get('timestamps', {}))
+
+    def __throttled(self, hits_before: int) -> bool:
+        """ Checks if the exchange throttled during the refresh or if the remaining rate limit is low """
+        if self.connector.rate_limit_hits > hits_before:
+            return True
+        headroom = self.connector.get_rate_limit_headroom()
+        return headroom is not None and headroom < 0.2
+
+    def __adapt(self, name: str, changed: bool, throttled: bool):
+        """ Adapts the interval of the data class """
+        job = self.jobs[name]
+        interval = job['interval']
+        if throttled:
+            interval = interval * 2
+        elif changed:
+            interval = interval / 2
+        else:
+            interval = interval * 1.5
+        interval = min(job['max'], max(job['min'], interval))
+        if interval != job['interval']:
+            log.debug(f"Changing the {name} interval from {job['interval']:.0f}s to {interval:.0f}s")
+        job['interval'] = interval
+
+    def refresh(self, name: str):
+        """
+        Refreshes one data class and adapts its interval
+
+        The connectors log the upstream errors and keep their last data, so the refresh failed, if the timestamp of
+        the data class didn't change and no response was served from the response cache. A failed refresh keeps the
+        last data, backs off and doesn't count for `warm()`. A data class the connector doesn't provide (no
+        timestamp, no data) counts as refreshed.
+        """
+        connector = self.connector
+        hits_before = connector.rate_limit_hits
+        cache_hits = (connector.get_cache_stats() or {}).get('hit', 0)
+        timestamp = connector.get_timestamps().get(name)
+        started = time.time()
+        getattr(connector, f'retrieve_{name}')()
+        retrieved = (
+            connector.get_timestamps().get(name) != timestamp
+            or (connector.get_cache_stats() or {}).get('hit', 0) > cache_hits
+        )
+        data = copy.deepcopy(getattr(connector, f'get_{name}')())
+        job = self.jobs[name]
+        with self.__lock:
+            known = bool(timestamp or data or self.__data[name])
+        if not retrieved and known:
+            self.__adapt(name, changed=False, throttled=True)
+            log.debug(f"No new {name} were retrieved. Retrying in {job['interval']:.0f}s.")
+            return
+        fingerprint = hash(repr(data))
+        changed = fingerprint != job['fingerprint']
+        self.__adapt(name, changed=changed, throttled=self.__throttled(hits_before))
+        job['fingerprint'] = fingerprint
+        job['done'] = True
+        timestamp = connector.get_timestamps().get(name)
+        with self.__lock:
+            self.__data[name] = data
+            if timestamp:
+                self.__data['timestamps'][name] = timestamp
+        log.debug(f'Refreshed the {name} in {time.time() - started:.2f}s (changed: {changed})')
+        if self.on_refresh:
+            self.on_refresh(name)
+
+    def __run(self):
+        """ Runs the due refreshes until stopped """
+        while not self.__stop.is_set():
+            name, job = min(self.jobs.items(), key=lambda item: item[1]['next'])
+            delay = job['next'] - time.time()
+            if delay > 0:
+                self.__stop.wait(delay)
+                continue
+            if self.active and not self.active():
+                self.__stop.wait(1)
+                continue
+            try:
+                self.refresh(name)
+            except Exception as e:  # pylint: disable=broad-except
+                log.error(f'Refreshing the {name} failed: {e}')
+                self.__adapt(name, changed=False, throttled=True)
+            job['next'] = time.time() + job['interval']
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The HTTP server for the metrics and the other endpoints """
+
+import asyncio
+import gzip
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlparse
+from prometheus_client import exposition
+from prometheus_client.core import REGISTRY
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+log = logging.getLogger('crypto-exporter')
+
+MIN_COMPRESS_SIZE = 1024
+MAX_HEADERS = 100
+
+
+class Families():  # pylint: disable=too-few-public-methods
+    """ Lets generate_latest() render a list of metric families """
+
+    def __init__(self, families):
+        self.families = families
+
+    def collect(self):
+        """ Returns the metric families """
+        return self.families
+
+
+def accepted_encodings(header: str) -> list:
+    """ Returns the content codings from an Accept-Encoding header, without the ones with q=0 """
+    encodings = []
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        if coding and params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            encodings.append(coding.strip().lower())
+    return encodings
+
+
+class MetricsServer():  # pylint: disable=too-many-instance-attributes
+    """
+    Serves `/metrics` from the registry and the additional routes
+
+    A route handler gets the query parameters (dict of lists) and the request headers and returns the tuple
+    `(status, content_type, body)`. The handlers run in a pool of `max_concurrency` threads; the connections are
+    handled by an asyncio event loop, so idle keep-alive connections cost no thread. Requests beyond
+    `max_concurrency` wait up to `queue_timeout` seconds for a free thread and get a 503 afterwards.
+
+    Concurrent scrapes of the whole registry in the same format share one rendering; scrapes restricted with
+    `name[]` are rendered on their own, so the client can't grow the shared renderings. The responses are compressed
+    with zstd (if zstandard is installed) or gzip, if the client accepts it.
+    """
+
+    def __init__(self, port: int, *, registry=REGISTRY, address='',  # pylint: disable=too-many-arguments
+                 max_concurrency=8, queue_timeout=30, idle_timeout=60):
+        self.port = port
+        self.address = address
+        self.registry = registry
+        self.max_concurrency = max(1, max_concurrency)
+        self.queue_timeout = queue_timeout
+        self.idle_timeout = idle_timeout
+        self.routes = {
+            '/': self.metrics,
+            '/metrics': self.metrics,
+        }
+        self.__renders = {}
+        self.__renders_lock = threading.Lock()
+        self.__executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='http')
+        self.__loop = None
+        self.__server = None
+        self.__semaphore = None
+        self.__idle = set()
+        self.__clients = set()
+        self.__inflight = 0
+        self.__closing = False
+        self.__stopped = threading.Event()
+
+    def route(self, path: str, handler):
+        """ Registers the handler for the path """
+        self.routes[path] = handler
+
+    def metrics(self, params: dict, headers: dict) -> tuple:
+        """ Renders the registry in the format accepted by the client """
+        encoder, content_type = exposition.choose_encoder(headers.get('accept'))
+        if params.get('name[]'):
+            return 200, content_type, encoder(self.registry.restricted_registry(params['name[]']))
+        requested = time.monotonic()
+        with self.__renders_lock:
+            render = self.__renders.setdefault(content_type, {'lock': threading.Lock(), 'started': 0})
+        with render['lock']:
+            # a rendering which started after this request arrived is fresh enough to be shared
+            if render['started'] < requested:
+                render['started'] = time.monotonic()
+                render['body'] = encoder(self.registry)
+            body = render['body']
+        return 200, content_type, body
+
+    def handle(self, path: str, params: dict, headers: dict) -> tuple:
+        """ Dispatches the request to the route handler """
+        handler = self.routes.get(path)
+        if not handler:
+            return 404, 'text/plain; charset=utf-8', b'Not Found\n'
+        try:
+            return handler(params, headers)
+        except Exception as e:  # pylint: disable=broad-except
+            log.exception(f'Error while serving {path}: {e}')
+            return 500, 'text/plain; charset=utf-8', f'{e}\n'.encode()
+
+    @staticmethod
+    def compress(body: bytes, accept_encoding: str) -> tuple:
+        """ Returns the body compressed with the best encoding the client accepts and the encoding """
+        if len(body) < MIN_COMPRESS_SIZE:
+            return body, None
+        encodings = accepted_encodings(accept_encoding)
+        if zstandard and 'zstd' in encodings:
+            return zstandard.ZstdCompressor().compress(body), 'zstd'
+        if 'gzip' in encodings or '*' in encodings:
+            return gzip.compress(body, compresslevel=6), 'gzip'
+        return body, None
+
+    def __respond(self, path: str, params: dict, headers: dict) -> tuple:
+        """ Runs in the thread pool: calls the handler and compresses the response """
+        status, content_type, body = self.handle(path, params, headers)
+        body, encoding = self.compress(body, headers.get('accept-encoding'))
+        return status, content_type, body, encoding
+
+    async def __read_request(self, reader):
+        """ Reads the request line and the headers, returns None if the client closed the connection """
+        line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+        if not line:
+            return None
+        method, target, version = line.decode('latin-1').split()
+        headers = {}
+        for _ in range(MAX_HEADERS):
+            line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise ValueError('Too many headers')
+        if headers.get('content-length'):
+            # the endpoints take no request body
+            await reader.readexactly(int(headers['content-length']))
+        return method, target, version, headers
+
+    async def __client(self, reader, writer):
+        """ Serves the requests of one connection until it's closed """
+        task = asyncio.current_task()
+        self.__clients.add(task)
+        try:
+            while not self.__closing:
+                self.__idle.add(writer)
+                try:
+                    request = await self.__read_request(reader)
+                except (ValueError, asyncio.IncompleteReadError):
+                    await self.__write(writer, 'HTTP/1.1', 400, 'text/plain; charset=utf-8', b'Bad Request\n')
+                    break
+                finally:
+                    self.__idle.discard(writer)
+                if not request:
+                    break
+                if not await self.__serve(writer, *request):
+                    break
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            # cancelled by the shutdown; finishing normally keeps asyncio from logging it as an error
+            pass
+        finally:
+            writer.close()
+            self.__clients.discard(task)
+
+    async def __serve(self, writer, method: str, target: str, version: str, headers: dict) -> bool:
+        """ Serves one request, returns True if the connection is kept alive """
+        connection = headers.get('connection', '').lower()
+        keep_alive = (version == 'HTTP/1.1' and connection != 'close') or connection == 'keep-alive'
+        keep_alive = keep_alive and 'transfer-encoding' not in headers
+        if method not in ('GET', 'HEAD'):
+            await self.__write(
+                writer, version, 405, 'text/plain; charset=utf-8', b'Method Not Allowed\n', keep_alive=keep_alive,
+            )
+            return keep_alive
+
+        self.__inflight += 1
+        try:
+            try:
+                await asyncio.wait_for(self.__semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                await self.__write(writer, version, 503, 'text/plain; charset=utf-8', b'Too many requests\n')
+                return False
+            try:
+                url = urlparse(target)
+                status, content_type, body, encoding = await self.__loop.run_in_executor(
+                    self.__executor, self.__respond, url.path, parse_qs(url.query), headers,
+                )
+            finally:
+                self.__semaphore.release()
+            keep_alive = keep_alive and not self.__closing
+            await self.__write(
+                writer, version, status, content_type, body,
+                keep_alive=keep_alive, encoding=encoding, head=method == 'HEAD',
+            )
+            log.debug(f"{writer.get_extra_info('peername')} \"{method} {target} {version}\" {status} {len(body)}")
+        finally:
+            self.__inflight -= 1
+        return keep_alive
+
+    @staticmethod
+    async def __write(writer, version, status, content_type, body, *,  # pylint: disable=too-many-arguments
+                      keep_alive=False, encoding=None, head=False):
+        """ Writes the response """
+        lines = [
+            f'{version} {status} {HTTPStatus(status).phrase}',
+            f'Content-Type: {content_type}',
+            f'Content-Length: {len(body)}',
+            'Vary: Accept-Encoding',
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        if encoding:
+            lines.append(f'Content-Encoding: {encoding}')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if not head:
+            writer.write(body)
+        await writer.drain()
+
+    def __run(self, started: threading.Event, errors: list):
+        """ Runs the event loop """
+        self.__loop = asyncio.new_event_loop()
+        self.__semaphore = asyncio.Semaphore(self.max_concurrency)
+        try:
+            self.__server = self.__loop.run_until_complete(
+                asyncio.start_server(self.__client, self.address or None, self.port)
+            )
+        except OSError as e:
+            errors.append(e)
+            started.set()
+            return
+        started.set()
+        try:
+            self.__loop.run_forever()
+        finally:
+            self.__loop.close()
+            self.__stopped.set()
+
+    def start(self):
+        """ Starts serving in a daemon thread """
+        started = threading.Event()
+        errors = []
+        threading.Thread(target=self.__run, args=(started, errors), name='http-server', daemon=True).start()
+        started.wait()
+        if errors:
+            raise errors[0]
+        log.debug(f'Serving on port {self.port}')
+
+    async def __shutdown(self, timeout: float):
+        """ Stops accepting connections, waits for the running requests and cancels the remaining connections """
+        self.__closing = True
+        self.__server.close()
+        for writer in list(self.__idle):
+            writer.close()
+        deadline = time.monotonic() + timeout
+        while self.__inflight and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        clients = list(self.__clients)
+        for task in clients:
+            task.cancel()
+        await asyncio.gather(*clients, return_exceptions=True)
+        self.__loop.stop()
+
+    def stop(self, timeout=10):
+        """ Stops the server gracefully: the running requests get up to `timeout` seconds to finish """
+        if self.__loop and not self.__stopped.is_set():
+            log.info('Stopping the HTTP server')
+            asyncio.run_coroutine_threadsafe(self.__shutdown(timeout), self.__loop)
+            self.__stopped.wait(timeout + 1)
+        self.__executor.shutdown(wait=False)
+
+    def wait(self):
+        """ Blocks until the server is stopped """
+        while not self.__stopped.wait(1):
+            pass
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Persists the last good data of a connector, so it can be served right after a restart """
+
+import json
+import logging
+import os
+import tempfile
+import time
+import zlib
+
+log = logging.getLogger('crypto-exporter')
+
+MAGIC = b'CXSNAP1\n'
+
+
+class Snapshot():
+    """ A zlib compressed JSON file, which gets replaced atomically on every save """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def save(self, exchange: str, data: dict):
+        """
+        Writes the snapshot to a temporary file and moves it over the old one
+
+        :param exchange: The name of the exchange the data belongs to
+        :param data: The connector data, with the keys `tickers`, `accounts`, `transactions` and `timestamps`
+        """
+        payload = {
+            'exchange': exchange,
+            'time': time.time(),
+            'tickers': data.get('tickers', {}),
+            'accounts': data.get('accounts', {}),
+            # JSON doesn't support tuples as keys
+            'transactions': [[*key, value] for key, value in data.get('transactions', {}).items()],
+            'timestamps': data.get('timestamps', {}),
+        }
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            with tempfile.NamedTemporaryFile(dir=directory, prefix='.snapshot-', delete=False) as f:
+                f.write(MAGIC)
+                f.write(zlib.compress(json.dumps(payload, separators=(',', ':')).encode()))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(f.name, self.path)
+        except OSError as e:
+            log.warning(f'Could not save the snapshot to {self.path}: {e}')
+            try:
+                os.unlink(f.name)
+            except (OSError, UnboundLocalError):
+                pass
+            return
+        log.debug(f'Saved the snapshot to {self.path}')
+
+    def modified(self):
+        """ Returns the modification time of the snapshot file or None, if there is none """
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def load(self, exchange: str, quiet=False) -> dict:
+        """
+        Reads the snapshot
+
+        :param exchange: Only a snapshot of this exchange is loaded
+        :param quiet: Logs the loaded snapshot only on debug level
+        :return: The data with the keys `tickers`, `accounts`, `transactions`, `timestamps` and `time` or None
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    raise ValueError('Unknown file format')
+                payload = json.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            log.debug(f'No snapshot found at {self.path}')
+            return None
+        except (OSError, ValueError, zlib.error) as e:
+            log.warning(f'Could not load the snapshot from {self.path}: {e}')
+            return None
+
+        if payload.get('exchange') != exchange:
+            log.warning(f"Ignoring the snapshot from {self.path}, since it belongs to {payload.get('exchange')}")
+            return None
+        log.log(logging.DEBUG if quiet else logging.INFO, f"Loaded the snapshot from {time.ctime(payload['time'])}")
+        return {
+            'time': payload['time'],
+            'tickers': payload['tickers'],
+            'accounts': payload['accounts'],
+            'transactions': {tuple(entry[:-1]): entry[-1] for entry in payload['transactions']},
+            'timestamps': payload.get('timestamps', {}),
+        }
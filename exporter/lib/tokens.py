@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The metadata of the ERC20 tokens by contract address, with an allow and a deny list for the spam tokens """
+
+import json
+import logging
+import os
+import tempfile
+
+log = logging.getLogger('crypto-exporter')
+
+# the airdropped spam tokens mostly have a URL or an advertisement as symbol
+MAX_SYMBOL_LENGTH = 15
+
+
+class TokenIndex():
+    """
+    Keeps the symbol and the decimals of every token seen, keyed by the (lower case) contract address
+
+    The metadata of a token is read from the response once. The following responses only look up the contract, so
+    the decimals aren't parsed again and the known spam tokens are skipped right away. A token is spam, if its
+    contract is on the deny list, or if its symbol is missing or longer than MAX_SYMBOL_LENGTH characters, unless its
+    contract is on the allow list.
+
+    With a `path`, the index is loaded from and saved to a JSON file, so it survives restarts. Only the metadata is
+    stored; the spam verdict is calculated on loading, so changes of the allow and the deny list apply right away.
+    """
+
+    def __init__(self, path=None, allow=None, deny=None):
+        self.path = path
+        self.allow = {address.lower() for address in allow or []}
+        self.deny = {address.lower() for address in deny or []}
+        self.__tokens = {}
+        self.__dirty = False
+        if path:
+            self.__load()
+
+    def __entry(self, address, symbol, decimals) -> dict:
+        """ Builds the entry of a token """
+        spam = address in self.deny or (
+            address not in self.allow
+            and (not symbol or not isinstance(symbol, str) or len(symbol) > MAX_SYMBOL_LENGTH)
+        )
+        try:
+            decimals = int(decimals or 0)
+        except (TypeError, ValueError):
+            # a token with broken metadata can't be valued
+            decimals = 0
+            spam = address not in self.allow
+        return {
+            'symbol': symbol,
+            'decimals': decimals,
+            'scale': 10**decimals if decimals > 0 else 1,
+            'spam': spam,
+        }
+
+    def __load(self):
+        """ Loads the metadata from the file """
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                tokens = json.load(f)['tokens']
+            for address, (symbol, decimals) in tokens.items():
+                self.__tokens[address] = self.__entry(address, symbol, decimals)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            log.warning(f'Ignoring the invalid token index {self.path}: {e}')
+            return
+        log.debug(f'Loaded the metadata of {len(self.__tokens)} tokens from {self.path}')
+
+    def save(self):
+        """ Writes the metadata to the file, if new tokens have been seen """
+        if not self.path or not self.__dirty:
+            return
+        payload = {
+            'tokens': {address: [entry['symbol'], entry['decimals']] for address, entry in self.__tokens.items()},
+        }
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            with tempfile.NamedTemporaryFile('w', dir=directory, prefix='.tokens-', delete=False,
+                                             encoding='utf-8') as f:
+                json.dump(payload, f, separators=(',', ':'))
+            os.replace(f.name, self.path)
+        except OSError as e:
+            log.warning(f'Could not save the token index to {self.path}: {e}')
+            return
+        self.__dirty = False
+        log.debug(f'Saved the metadata of {len(self.__tokens)} tokens to {self.path}')
+
+    def lookup(self, address, info: dict):
+        """
+        Returns the metadata of the token or None, if it's spam
+
+        :param address: The contract address of the token. Without it, the metadata is read from `info` every time.
+        :param info: The token info of the response, with `symbol` and `decimals`. Only read for unknown tokens.
+        """
+        if not address:
+            entry = self.__entry(None, info.get('symbol'), info.get('decimals'))
+        else:
+            address = address.lower()
+            entry = self.__tokens.get(address)
+            if entry is None:
+                entry = self.__entry(address, info.get('symbol'), info.get('decimals'))
+                self.__tokens[address] = entry
+                self.__dirty = True
+                if entry['spam']:
+                    log.debug(f"Skipping the spam token {entry['symbol']!r} ({address})")
+        return None if entry['spam'] else entry
@@ -3,15 +3,34 @@
 """ Handles the exchange data and communication """
 
 import logging
-import inspect
+import sys
 import time
 import os
 import json
 from distutils.util import strtobool
+import requests
+from requests.adapters import HTTPAdapter
 from . import errors
 
 
 log = logging.getLogger('crypto-exporter')
+_session = None
+
+
+def get_session() -> requests.Session:
+    """ Returns the HTTP session shared by all the connectors, so the connections are kept alive and reused """
+    global _session  # pylint: disable=global-statement
+    if _session is None:
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32)
+        _session.mount('http://', adapter)
+        _session.mount('https://', adapter)
+    return _session
+
+
+def _caller() -> str:
+    """ Returns the name of the function which called the handler, without walking the whole stack """
+    return sys._getframe(2).f_code.co_name  # pylint: disable=protected-access
 
 
 def short_msg(msg, chars=75):
@@ -21,7 +40,7 @@ def short_msg(msg, chars=75):
 
 def ddos_protection_handler(error, sleep=1, shortify=True):
     """ Prints a warning and sleeps """
-    caller = inspect.stack()[1].function
+    caller = _caller()
     if shortify:
         error = short_msg(error)
     log.warning(f'({caller}) Rate limit has been reached. Sleeping for {sleep}s. The exception: {error}')
@@ -30,7 +49,7 @@ def ddos_protection_handler(error, sleep=1, shortify=True):
 
 def exchange_not_available_handler(error, sleep=10, shortify=True):
     """ Prints an error and sleeps """
-    caller = inspect.stack()[1].function
+    caller = _caller()
     if shortify:
         error = short_msg(error)
     log.error(f'({caller}) The exchange API could not be reached. Sleeping for {sleep}s. The error: {error}')
@@ -39,7 +58,7 @@ def exchange_not_available_handler(error, sleep=10, shortify=True):
 
 def authentication_error_handler(error, nonce='', shortify=True):
     """ Logs hints about the authentication error """
-    caller = inspect.stack()[1].function
+    caller = _caller()
     if shortify:
         error = short_msg(error)
     message = f"({caller}) Can't authenticate to read the accounts."
@@ -55,7 +74,7 @@ def authentication_error_handler(error, nonce='', shortify=True):
 
 def permission_denied_handler(error, shortify=True):
     """ Prints error and gives hints about the cause """
-    caller = inspect.stack()[1].function
+    caller = _caller()
     if shortify:
         error = short_msg(error)
     log.error(f'({caller}) The exchange reports "permission denied": {error} Check the API token permissions')
@@ -63,48 +82,66 @@ def permission_denied_handler(error, shortify=True):
 
 def generic_error_handler(error, shortify=True):
     """ Handler for generic errors """
-    caller = inspect.stack()[1].function
+    caller = _caller()
     if shortify:
         error = short_msg(error)
     log.error(f'({caller}) A generic error occurred: {error}')
 
 
-def gather_environ(keys=None) -> dict:
+def to_environ(value) -> str:
+    """ Converts a value from a settings dict (for example loaded from JSON) to its environment representation """
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (list, tuple)) and all(isinstance(item, str) for item in value):
+        return ','.join(value)
+    if isinstance(value, (list, tuple, dict)):
+        return json.dumps(value)
+    return str(value)
+
+
+def convert_environ(key: str, key_details: dict, value: str):
+    """ Converts the value of the environment variable to the `key_type` of the key, or returns its default """
+    converters = {'int': int, 'float': float, 'list': lambda text: text.split(',')}
+    if key_details['key_type'] in converters:
+        return converters[key_details['key_type']](value)
+    if key_details['key_type'] == 'json':
+        try:
+            return json.loads(value)
+        except (TypeError, json.decoder.JSONDecodeError):
+            log.warning((
+                f"{key.upper()} does not contain a valid JSON object."
+                f" Setting to: {key_details['default']}."
+            ))
+            return key_details['default']
+    if key_details['key_type'] == 'bool':
+        try:
+            return strtobool(value)
+        except ValueError:
+            log.warning(f"Invalid value for {key.upper()}. Setting to: {key_details['default']}.")
+            return key_details['default']
+    return value
+
+
+def gather_environ(keys=None, values=None) -> dict:
     """
     Return a dict of environment variables correlating to the keys dict
 
-    :param keys: The environ keys to use, each of them correlating to `int`, `list`, `json`, `string` or `bool`.
+    :param keys: The environ keys to use, each of them correlating to `int`, `float`, `list`, `json`, `string` or
+                 `bool`.
                  The format of the values should be key = {'key_type': type, 'default': value, 'mandatory': bool}
+    :param values: If set, the values are read from this dict (with the keys in lower case) instead of the environment
     :return: A dict of found environ values
     """
     environs = {}
     for key, key_details in keys.items():
-        environment_key = os.environ.get(key.upper())
+        if values is None:
+            environment_key = os.environ.get(key.upper())
+        else:
+            environment_key = to_environ(values.get(key))
         if environment_key:
-            environs.update({key: environment_key})
-
-            if key_details['key_type'] == 'int':
-                environs[key] = int(environment_key)
-
-            if key_details['key_type'] == 'list':
-                environs[key] = environs[key].split(',')
-
-            if key_details['key_type'] == 'json':
-                try:
-                    environs[key] = json.loads(environment_key)
-                except (TypeError, json.decoder.JSONDecodeError):
-                    log.warning((
-                        f"{key.upper()} does not contain a valid JSON object."
-                        f" Setting to: {key_details['default']}."
-                    ))
-                    environs[key] = key_details['default']
-
-            if key_details['key_type'] == 'bool':
-                try:
-                    environs[key] = strtobool(environment_key)
-                except ValueError:
-                    log.warning(f"Invalid value for {key.upper()}. Setting to: {key_details['default']}.")
-                    environs[key] = key_details['default']
+            environs[key] = convert_environ(key, key_details, environment_key)
 
             if key_details.get('redact'):
                 log.debug(f"{key.upper()} set to ***REDACTED***")
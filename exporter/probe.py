@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The /probe endpoint, modeled after the blackbox_exporter """
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from prometheus_client import CollectorRegistry, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from .connectors import get_connector
+from .crypto_collector import CryptoCollector
+from .lib import errors
+from .lib.server import Families
+
+log = logging.getLogger('crypto-exporter')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Prober():
+    """
+    Builds the connectors on demand from the configured modules
+
+    Every (module, target) pair keeps its connector warm and its last result is cached for `ttl` seconds. At most
+    `max_targets` pairs are kept; the least recently probed ones are dropped first and their connectors stopped.
+
+    The connectors log the upstream errors and keep their last data, so `probe_success` is 1 only if the refresh
+    retrieved data and the authentication, if configured, didn't fail.
+    """
+
+    def __init__(self, modules: dict, ttl=60, max_targets=1000, limits=None):
+        """
+        :param modules: The module name as key and the connector settings as value. The settings need the key
+                        `exchange`. For `exchange=ccxt` the target is the ccxt exchange id, otherwise the target is
+                        used as `addresses`.
+        """
+        self.modules = modules
+        self.ttl = ttl
+        self.max_targets = max_targets
+        self.limits = limits
+        self.__targets = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __build(self, module: str, target: str) -> dict:
+        """ Builds the connector and the collector for the target """
+        settings = dict(self.modules[module])
+        exchange = settings.pop('exchange')
+        if exchange == 'ccxt':
+            exchange = target
+        else:
+            settings['addresses'] = target
+        connector = get_connector(exchange, settings=settings)
+        log.debug(f'Built the connector for {module}/{target}')
+        return {
+            'collector': CryptoCollector(exchange=connector, limits=self.limits),
+            'lock': threading.Lock(),
+            'body': None,
+            'time': 0,
+        }
+
+    def __get_target(self, module: str, target: str) -> dict:
+        """ Returns the warm target or builds it """
+        key = (module, target)
+        with self.__lock:
+            if key in self.__targets:
+                self.__targets.move_to_end(key)
+                return self.__targets[key]
+        built = self.__build(module, target)
+        evicted = []
+        with self.__lock:
+            entry = self.__targets.setdefault(key, built)
+            if entry is not built:
+                # a concurrent probe built the same target
+                evicted.append(built)
+            while len(self.__targets) > self.max_targets:
+                evicted.append(self.__targets.popitem(last=False)[1])
+        for old in evicted:
+            old['collector'].exchange.stop()
+        return entry
+
+    @staticmethod
+    def __succeeded(collector) -> bool:
+        """ Checks if the last refresh retrieved data and the authentication didn't fail """
+        try:
+            if collector.exchange.get_enable_authentication() is False:
+                return False
+        except AttributeError:
+            pass
+        return bool(collector.refreshed)
+
+    def stop(self):
+        """ Stops the connectors of all the targets """
+        with self.__lock:
+            entries = list(self.__targets.values())
+            self.__targets.clear()
+        for entry in entries:
+            entry['collector'].exchange.stop()
+
+    def probe(self, params: dict, _headers=None) -> tuple:
+        """ Handles /probe?module=<module>&target=<target> """
+        module = params.get('module', [None])[0]
+        target = params.get('target', [None])[0]
+        if module not in self.modules:
+            return 400, 'text/plain; charset=utf-8', f'Unknown module "{module}"\n'.encode()
+        if not target:
+            return 400, 'text/plain; charset=utf-8', b'The target parameter is missing\n'
+
+        try:
+            entry = self.__get_target(module, target)
+        except (errors.Error, AttributeError, ValueError) as e:
+            return 400, 'text/plain; charset=utf-8', f'Can not probe {target} with {module}: {e}\n'.encode()
+
+        # concurrent probes of the same target wait for one refresh
+        with entry['lock']:
+            if time.time() - entry['time'] > self.ttl or entry['body'] is None:
+                started = time.time()
+                success = 1
+                registry = CollectorRegistry(auto_describe=False)
+                registry.register(entry['collector'])
+                try:
+                    body = generate_latest(registry)
+                    success = int(self.__succeeded(entry['collector']))
+                except Exception as e:  # pylint: disable=broad-except
+                    log.error(f'Probing {target} with {module} failed: {e}')
+                    body = b''
+                    success = 0
+                duration = GaugeMetricFamily('probe_duration_seconds', 'How long the probe took to complete')
+                duration.add_metric([], time.time() - started)
+                probe_success = GaugeMetricFamily('probe_success', 'Displays whether or not the probe was a success')
+                probe_success.add_metric([], success)
+                entry['body'] = body + generate_latest(Families([duration, probe_success]))
+                entry['time'] = time.time()
+            body = entry['body']
+        return 200, CONTENT_TYPE, body
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The targets of the config file, served together on /metrics """
+
+import copy
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .connectors import get_connector
+from .crypto_collector import CryptoCollector
+from .lib import errors
+from .lib.scheduler import RefreshScheduler
+from .lib.snapshot import Snapshot
+
+log = logging.getLogger('crypto-exporter')
+
+
+class Targets():  # pylint: disable=too-many-instance-attributes
+    """
+    Keeps one connector and collector per target and merges their metric families
+
+    `apply()` compares a new config with the current one: targets with unchanged settings keep their connector (with
+    the loaded markets, the cached responses and the data). If only the `reconfigurable` settings of a target changed
+    (like its addresses or symbols), its connector is reconfigured in place. Only the new and the other changed
+    targets are built and the removed ones are stopped.
+
+    Every sample gets the label `target`, so the targets of the same exchange don't collide.
+    """
+
+    def __init__(self, *, limits=None, snapshot_file=None, intervals=None,  # pylint: disable=too-many-arguments
+                 max_factor=8, sample_timestamps=False, max_workers=8):
+        """
+        :param snapshot_file: If set, every target saves its snapshot to this path with `.<target>` appended
+        :param intervals: If set, every target gets a RefreshScheduler with these intervals
+        """
+        self.limits = limits
+        self.snapshot_file = snapshot_file
+        self.intervals = intervals
+        self.max_factor = max_factor
+        self.sample_timestamps = sample_timestamps
+        self.__targets = {}
+        self.__lock = threading.Lock()
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='target')
+
+    def __build(self, name: str, settings: dict) -> CryptoCollector:
+        """ Builds the connector and the collector for the target """
+        settings = dict(settings)
+        exchange = settings.pop('exchange')
+        connector = get_connector(exchange, settings=settings)
+        scheduler = None
+        if self.intervals:
+            scheduler = RefreshScheduler(connector, intervals=self.intervals, max_factor=self.max_factor)
+        return CryptoCollector(
+            exchange=connector,
+            snapshot=Snapshot(f'{self.snapshot_file}.{name}') if self.snapshot_file else None,
+            scheduler=scheduler,
+            limits=self.limits,
+            sample_timestamps=self.sample_timestamps,
+        )
+
+    @staticmethod
+    def __reconfigure(name: str, entry: dict, settings: dict) -> bool:
+        """ Applies the changed settings to the running connector of the target, if it supports them """
+        changed = {
+            key: settings.get(key) for key in set(settings) | set(entry['settings'])
+            if settings.get(key) != entry['settings'].get(key)
+        }
+        if 'exchange' in changed:
+            return False
+        try:
+            reconfigured = entry['collector'].exchange.reconfigure(changed)
+        except (errors.Error, AttributeError, ValueError) as e:
+            log.error(f'Can not reconfigure the target {name}: {e}')
+            return False
+        if reconfigured:
+            log.info(f"Reconfigured the {', '.join(sorted(changed))} of the target {name}")
+        return reconfigured
+
+    @staticmethod
+    def __stop(name: str, entry: dict):
+        """ Stops the background work of the target """
+        collector = entry['collector']
+        if collector.scheduler:
+            collector.scheduler.stop()
+        collector.exchange.stop()
+        log.debug(f'Stopped the target {name}')
+
+    def apply(self, config: dict):
+        """ Builds the new and the changed targets of the config and stops the removed ones """
+        with self.__lock:
+            current = self.__targets
+            targets = {}
+            built = []
+            reconfigured = []
+            for name, settings in config['targets'].items():
+                entry = current.get(name)
+                if entry and entry['settings'] == settings:
+                    targets[name] = entry
+                    continue
+                if entry and self.__reconfigure(name, entry, settings):
+                    entry['settings'] = copy.deepcopy(settings)
+                    targets[name] = entry
+                    reconfigured.append(name)
+                    continue
+                try:
+                    targets[name] = {'collector': self.__build(name, settings), 'settings': copy.deepcopy(settings)}
+                    built.append(name)
+                except (errors.Error, AttributeError, ValueError) as e:
+                    log.error(f'Can not build the target {name}: {e}')
+                    if entry:
+                        log.warning(f'Keeping the old settings of the target {name}')
+                        targets[name] = entry
+            # the scrapes running right now keep using the old dict
+            self.__targets = targets
+        for name, entry in current.items():
+            if targets.get(name) is not entry:
+                self.__stop(name, entry)
+        removed = [name for name in current if name not in targets]
+        kept = len(targets) - len(built) - len(reconfigured)
+        log.info((
+            f"Targets: {kept} kept, {len(reconfigured)} reconfigured ({', '.join(reconfigured)}),"
+            f" {len(built)} built ({', '.join(built)}), {len(removed)} removed"
+        ))
+
+    def get_targets(self) -> dict:
+        """ Returns the collectors by target name """
+        return {name: entry['collector'] for name, entry in self.__targets.items()}
+
+    def redact(self, message: str) -> str:
+        """ Redacts the sensitive information of all the targets from the message """
+        for entry in self.__targets.values():
+            message = entry['collector'].exchange.redact(message)
+        return message
+
+    @staticmethod
+    def __collect(name: str, collector) -> list:
+        """ Collects the metric families of one target """
+        try:
+            return list(collector.collect())
+        except Exception as e:  # pylint: disable=broad-except
+            log.error(f'Collecting the target {name} failed: {e}')
+            return []
+
+    def collect(self):
+        """ Collects all the targets concurrently and merges the metric families with the same name """
+        targets = self.__targets
+        merged = {}
+        results = self.__executor.map(lambda item: self.__collect(item[0], item[1]['collector']), targets.items())
+        for name, families in zip(targets, results):
+            for family in families:
+                if family.name not in merged:
+                    merged[family.name] = copy.copy(family)
+                    merged[family.name].samples = []
+                # the targets of the same exchange export the same series otherwise
+                merged[family.name].samples.extend(
+                    sample._replace(labels={**sample.labels, 'target': name}) for sample in family.samples
+                )
+        yield from merged.values()
+
+    def stop(self):
+        """ Stops all the targets """
+        with self.__lock:
+            current, self.__targets = self.__targets, {}
+        for name, entry in current.items():
+            self.__stop(name, entry)
+        self.__executor.shutdown(wait=False)
+
+    def describe(self):
+        """ See https://github.com/prometheus/client_python#custom-collectors """
+        return []
@@ -3,6 +3,9 @@ set -e
 
 ./build.sh
 
+# the unit tests and the benchmarks, without network access
+python3 -m unittest discover -s tests
+
 for EXCHANGE in "kraken" "binance" "coinbasepro"; do
   EXCHANGE="${EXCHANGE}" REFERENCE_CURRENCY="EUR" SYMBOLS="BTC/EUR" TEST=y ./crypto-exporter
 done
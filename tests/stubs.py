@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The upstream calls of the connectors answered locally """
+
+import asyncio
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+import ccxt
+from aiohttp import web
+from exporter.lib.lazy_ccxt import get_exchange
+
+MARKETS = [{'symbol': 'BTC/EUR', 'base': 'BTC', 'quote': 'EUR'}]
+
+
+def unavailable() -> Exception:
+    """ Returns the error of an exchange that is down """
+    return ccxt.ExchangeNotAvailable('kraken is down')
+
+
+def patch(test: unittest.TestCase, target, **attributes):
+    """ Patches the attributes of the target until the end of the test """
+    for name, value in attributes.items():
+        patcher = mock.patch.object(target, name, value)
+        patcher.start()
+        test.addCleanup(patcher.stop)
+
+
+def stub_kraken(test: unittest.TestCase, upstream: mock.Mock):
+    """ Answers the markets of kraken with BTC/EUR and its tickers with `upstream()`, without the retry pauses """
+    patch(
+        test, get_exchange('kraken'),
+        fetch_markets=lambda _self, params=None: MARKETS,
+        fetch_tickers=lambda _self, symbols=None, params=None: upstream(),
+    )
+    patcher = mock.patch('exporter.lib.utils.time.sleep')
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
+
+def wait_for(condition):
+    """ Waits up to 10s for the condition of a background thread, without the time.sleep() patched by stub_kraken() """
+    deadline = time.time() + 10
+    while not condition() and time.time() < deadline:
+        threading.Event().wait(0.01)
+
+
+class HTTPStub():  # pylint: disable=too-few-public-methods
+    """
+    A local HTTP server, which answers every request with `respond(request)`
+
+    The request is a dict with `method`, `path`, `headers` and `body`, the response a tuple (status, headers, body).
+    All the requests are recorded in `requests`.
+    """
+
+    def __init__(self, test: unittest.TestCase, respond):
+        self.respond = respond
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """ Records the request and sends the response """
+
+            def handle_request(self):
+                """ Answers any method """
+                length = int(self.headers.get('Content-Length') or 0)
+                request = {
+                    'method': self.command,
+                    'path': self.path,
+                    'headers': dict(self.headers),
+                    'body': self.rfile.read(length) if length else b'',
+                }
+                stub.requests.append(request)
+                status, headers, body = stub.respond(request)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = do_PUT = handle_request
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                """ Keeps the test output clean """
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        # the clients of the tests can go away before their response, for example a killed worker process
+        self.server.handle_error = lambda request, client_address: None
+        threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+        test.addCleanup(self.server.server_close)
+        test.addCleanup(self.server.shutdown)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+
+class WebSocketStub():
+    """
+    A local WebSocket server, which answers every JSON message with the messages returned by `respond(message)`
+
+    All the received messages are recorded in `messages`. `send()` pushes a message to the open connections and
+    `drop()` closes them, like a restarting upstream.
+    """
+
+    def __init__(self, test: unittest.TestCase, respond):
+        self.respond = respond
+        self.messages = []
+        self.connections = 0
+        self.__sockets = set()
+        self.__loop = asyncio.new_event_loop()
+        threading.Thread(target=self.__loop.run_forever, daemon=True).start()
+        self.__runner = self.__run(self.__start())
+        test.addCleanup(self.__loop.call_soon_threadsafe, self.__loop.stop)
+        test.addCleanup(self.__run, self.__runner.cleanup())
+        port = self.__runner.addresses[0][1]
+        self.url = f'ws://127.0.0.1:{port}'
+
+    def __run(self, coroutine):
+        """ Runs the coroutine in the loop of the server and returns its result """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.__loop).result(10)
+
+    async def __start(self) -> web.AppRunner:
+        """ Listens on a free port """
+        app = web.Application()
+        app.router.add_get('/', self.__handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', 0).start()
+        return runner
+
+    async def __handle(self, request):
+        """ Records the messages of a connection and sends the responses """
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.connections += 1
+        self.__sockets.add(ws)
+        try:
+            async for message in ws:
+                message = json.loads(message.data)
+                self.messages.append(message)
+                for response in self.respond(message):
+                    await ws.send_json(response)
+        finally:
+            self.__sockets.discard(ws)
+        return ws
+
+    def send(self, message: dict):
+        """ Pushes the message to all the open connections """
+        async def send():
+            for ws in list(self.__sockets):
+                await ws.send_json(message)
+        self.__run(send())
+
+    def drop(self):
+        """ Closes all the open connections """
+        async def drop():
+            for ws in list(self.__sockets):
+                await ws.close()
+        self.__run(drop())
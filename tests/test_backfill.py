@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The chunking of the OpenMetrics files written by the backfill """
+
+import os
+import tempfile
+import unittest
+from exporter.backfill import OpenMetricsWriter
+
+
+class TestOpenMetricsWriter(unittest.TestCase):
+    """ Every file stays within the chunk size, ends with `# EOF` and repeats the header of the continued family """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def read(self, writer) -> list:
+        """ Returns the contents of the written files """
+        contents = []
+        for path in writer.files:
+            with open(path, 'r', encoding='utf-8') as f:
+                contents.append(f.read())
+        return contents
+
+    def test_chunks(self):
+        """ The samples are split over files of at most chunk_size bytes """
+        writer = OpenMetricsWriter(self.directory, 'kraken', chunk_size=400)
+        writer.family('exchange_rate', 'gauge', 'Current exchange rates')
+        for i in range(20):
+            writer.sample({'currency': 'BTC', 'reference_currency': 'EUR'}, 50000.0 + i, 1700000000 + i * 3600)
+        writer.close()
+        contents = self.read(writer)
+        self.assertGreater(len(contents), 1)
+        self.assertEqual([os.path.basename(path) for path in writer.files][:2], ['kraken-00000.om', 'kraken-00001.om'])
+        for content in contents:
+            self.assertLessEqual(len(content), 400)
+            self.assertTrue(content.startswith('# HELP exchange_rate Current exchange rates\n'))
+            self.assertTrue(content.endswith('# EOF\n'))
+        samples = [line for content in contents for line in content.splitlines() if not line.startswith('#')]
+        self.assertEqual(len(samples), 20)
+        self.assertEqual(writer.samples, 20)
+        self.assertEqual(
+            samples[0], 'exchange_rate{currency="BTC",reference_currency="EUR"} 50000.0 1700000000.000'
+        )
+
+    def test_header_in_chunk(self):
+        """ The header of a family starting in the middle of a file counts against the chunk size """
+        writer = OpenMetricsWriter(self.directory, 'kraken', chunk_size=200)
+        for name in ('exchange_rate', 'transactions'):
+            writer.family(name, 'gauge', 'A family with a long documentation, so the header is large')
+            writer.sample({'currency': 'BTC'}, 1.0, 1.0)
+        writer.close()
+        contents = self.read(writer)
+        self.assertEqual(len(contents), 2)
+        for content in contents:
+            self.assertLessEqual(len(content), 200)
+
+    def test_families(self):
+        """ A new family writes its header into the current file; next_file() starts a new file """
+        writer = OpenMetricsWriter(self.directory, 'kraken', chunk_size=1048576)
+        writer.family('exchange_rate', 'gauge', 'Current exchange rates')
+        writer.sample({'currency': 'BTC'}, 1.0, 1.0)
+        writer.family('transactions', 'counter', 'The transactions')
+        writer.sample({'currency': 'BTC'}, 2.0, 1.0)
+        writer.next_file()
+        writer.sample({'currency': 'ETH'}, 3.0, 1.0)
+        writer.close()
+        contents = self.read(writer)
+        self.assertEqual(len(contents), 2)
+        first, second = contents[0], contents[1]
+        self.assertEqual(first.count('# TYPE'), 2)
+        self.assertIn('# TYPE transactions counter\ntransactions{currency="BTC"} 2.0 1.000\n# EOF\n', first)
+        self.assertEqual(second, (
+            '# HELP transactions The transactions\n# TYPE transactions counter\n'
+            'transactions{currency="ETH"} 3.0 1.000\n# EOF\n'
+        ))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The balances of the blockchain.info connector in chunks and of the HD wallets, against a local HTTP server """
+
+import json
+import unittest
+from urllib.parse import parse_qs, urlsplit
+from stubs import HTTPStub
+from exporter.connectors.blockchain_connector import BlockchainConnector
+
+ADDRESSES = [f'1Address{i}' for i in range(5)]
+XPUB = 'xpub6CUGRUonZSQ4TWtTMmzXdrXDtypWKiKrhko4egpiMZbpiaQL2jkwSB1icqYh2cfDfVxdx4df189oLKnC5fSwqPfgyP3hooxujYzAu3fDVmz'
+
+
+def output(address: str, value: int) -> dict:
+    """ Returns an output to a derived address of the wallet """
+    return {'addr': address, 'value': value, 'xpub': {'m': XPUB}}
+
+
+def wallet_balance(txs: list) -> int:
+    """ Returns the balance of the wallet after the transactions """
+    received = sum(out['value'] for tx in txs for out in tx['out'])
+    return received - sum(tx_input['prev_out']['value'] for tx in txs for tx_input in tx['inputs'])
+
+
+class TestBlockchain(unittest.TestCase):
+    """ The addresses are read in chunks and the HD wallets from their new transactions """
+
+    def setUp(self):
+        self.failing = set()
+        self.balances = {address: (i + 1) * 100000000 for i, address in enumerate(ADDRESSES)}
+        # newest first, like blockchain.info
+        self.txs = [
+            {'hash': 'b', 'inputs': [{'prev_out': output('1Derived0', 1000)}], 'out': [output('1Derived1', 700)]},
+            {'hash': 'a', 'inputs': [], 'out': [output('1Derived0', 1000)]},
+        ]
+        self.stub = HTTPStub(self, self.respond)
+
+    def respond(self, request: dict) -> tuple:
+        """ Answers /balance and /multiaddr like blockchain.info, the failing addresses with a 500 """
+        url = urlsplit(request['path'])
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        active = query['active'].split('|')
+        if self.failing.intersection(active):
+            return 500, {}, b''
+        if url.path == '/balance':
+            balances = dict(self.balances, **{XPUB: wallet_balance(self.txs)})
+            body = {
+                address: {'final_balance': balances[address], 'n_tx': len(self.txs)}
+                for address in active if address in balances
+            }
+        else:
+            offset = int(query['offset'])
+            body = {'txs': self.txs[offset:offset + int(query['n'])]}
+        return 200, {}, json.dumps(body).encode()
+
+    def connector(self, addresses: list, **settings) -> BlockchainConnector:
+        """ Returns a connector reading from the local server """
+        connector = BlockchainConnector(settings={'addresses': addresses, 'url': self.stub.url, **settings})
+        self.addCleanup(connector.stop)
+        return connector
+
+    def requests(self, path: str) -> list:
+        """ Returns the active parameter of the requests to the path """
+        return sorted(
+            parse_qs(urlsplit(request['path']).query)['active'][0]
+            for request in self.stub.requests if urlsplit(request['path']).path == path
+        )
+
+    def test_chunks(self):
+        """ Every chunk of addresses is one request """
+        connector = self.connector(ADDRESSES, chunk_size=2)
+        connector.retrieve_accounts()
+        self.assertEqual(connector.get_accounts(), {'BTC': {address: i + 1.0 for i, address in enumerate(ADDRESSES)}})
+        self.assertEqual(self.requests('/balance'), ['1Address0|1Address1', '1Address2|1Address3', '1Address4'])
+        self.assertIn('accounts', connector.get_timestamps())
+
+    def test_failed_chunk(self):
+        """ The addresses of a failed chunk keep their last balances """
+        connector = self.connector(ADDRESSES, chunk_size=2)
+        connector.retrieve_accounts()
+        self.failing.add(ADDRESSES[4])
+        with self.assertLogs('crypto-exporter', level='WARNING') as logs:
+            connector.retrieve_accounts()
+        self.assertEqual(connector.get_accounts()['BTC'][ADDRESSES[4]], 5.0)
+        self.assertIn(f'Could not retrieve the balance for {ADDRESSES[4]}', logs.output[-1])
+
+    def test_xpub(self):
+        """ The derived addresses get their balances from the transactions, only the new ones are read again """
+        connector = self.connector([XPUB], xpub_addresses=True)
+        connector.retrieve_accounts()
+        self.assertEqual(connector.get_accounts(), {'BTC': {XPUB: 0.000007, '1Derived1': 0.000007}})
+        self.assertEqual(len(self.requests('/multiaddr')), 1)
+
+        connector.retrieve_accounts()
+        self.assertEqual(len(self.requests('/multiaddr')), 1)
+
+        self.txs.insert(0, {'hash': 'c', 'inputs': [], 'out': [output('1Derived2', 300), output('1Derived1', 0)]})
+        connector.retrieve_accounts()
+        self.assertEqual(
+            connector.get_accounts(), {'BTC': {XPUB: 0.00001, '1Derived1': 0.000007, '1Derived2': 0.000003}},
+        )
+        self.assertEqual(len(self.requests('/multiaddr')), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
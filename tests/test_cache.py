@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The stale-while-revalidate cache of the upstream responses """
+
+import unittest
+from unittest import mock
+import requests
+from exporter.connectors.blockscout_connector import BlockscoutConnector
+from exporter.lib.cache import ResponseCache
+
+ACCOUNT = '0x0000000000000000000000000000000000000001'
+
+
+class TestResponseCache(unittest.TestCase):
+    """ ResponseCache.get() serves the young values and the stale ones while the loading fails """
+
+    def setUp(self):
+        self.now = 1700000000.0
+        patcher = mock.patch('exporter.lib.cache.time.time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_hit(self):
+        """ A value younger than the ttl isn't loaded again """
+        cache = ResponseCache(ttl=60)
+        loader = mock.Mock(return_value='value')
+        self.assertEqual(cache.get('key', loader), 'value')
+        self.now += 59
+        self.assertEqual(cache.get('key', loader), 'value')
+        self.assertEqual(loader.call_count, 1)
+        self.assertEqual(cache.stats, {'hit': 1, 'miss': 1, 'stale': 0})
+        self.assertEqual(cache.loaded_at('key'), self.now - 59)
+
+    def test_stale(self):
+        """ When the loading fails, the cached value is served until it's older than ttl + max_stale """
+        cache = ResponseCache(ttl=60, max_stale=100)
+        cache.get('key', lambda: 'value')
+        self.now += 100
+        with self.assertLogs('crypto-exporter', level='WARNING'):
+            self.assertEqual(cache.get('key', lambda: None), 'value')
+        self.now += 100
+        self.assertIsNone(cache.get('key', lambda: None))
+        self.assertEqual(cache.stats, {'hit': 0, 'miss': 2, 'stale': 1})
+        self.assertEqual(cache.loaded_at('key'), self.now - 200)
+
+    def test_failed_load(self):
+        """ A failed load isn't cached """
+        cache = ResponseCache(ttl=60)
+        self.assertIsNone(cache.get('key', lambda: None))
+        self.assertIsNone(cache.loaded_at('key'))
+        self.assertEqual(cache.get('key', lambda: 'value'), 'value')
+
+    def test_size(self):
+        """ The least recently used key is evicted first """
+        cache = ResponseCache(ttl=60, max_size=2)
+        for key in ['a', 'b']:
+            cache.get(key, lambda: 'value')
+        cache.get('a', lambda: 'value')
+        cache.get('c', lambda: 'value')
+        self.assertIsNotNone(cache.loaded_at('a'))
+        self.assertIsNone(cache.loaded_at('b'))
+
+
+class TestCachedConnector(unittest.TestCase):
+    """ The age of the balances is the age of the oldest cached response """
+
+    def setUp(self):
+        self.get_json = mock.Mock(return_value=({'message': 'OK', 'result': []}, True))
+        patcher = mock.patch.object(BlockscoutConnector, '_get_json', lambda _self, *args, **kwargs: self.get_json())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.connector = BlockscoutConnector(settings={'addresses': [ACCOUNT], 'cache_ttl': 60})
+
+    def test_cached(self):
+        """ The cached responses keep the time they were loaded """
+        self.connector.retrieve_accounts()
+        loaded_at = self.connector.get_timestamps()['accounts']
+        self.connector.retrieve_accounts()
+        self.assertEqual(self.connector.get_timestamps()['accounts'], loaded_at)
+        self.assertEqual(self.connector.get_cache_stats()['hit'], 1)
+
+    def test_failed_load(self):
+        """ Without any loaded response the balances have no age """
+        self.get_json.side_effect = requests.exceptions.ConnectionError('down')
+        with self.assertLogs('crypto-exporter', level='WARNING'):
+            self.connector.retrieve_accounts()
+        self.assertNotIn('accounts', self.connector.get_timestamps())
+
+
+if __name__ == '__main__':
+    unittest.main()
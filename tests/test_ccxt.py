@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The tickers of the ccxt connector, with the upstream calls answered locally """
+
+import time
+import unittest
+from unittest import mock
+import ccxt
+from stubs import stub_kraken
+from exporter.connectors.ccxt_connector import CcxtConnector
+
+
+def tickers(value=50000.0) -> dict:
+    """ Returns the response of fetch_tickers """
+    return {'BTC/EUR': {'last': value, 'quoteVolume': 1.0, 'timestamp': time.time() * 1000}}
+
+
+class TestTickers(unittest.TestCase):
+    """ The tickers timestamp only moves, if tickers were retrieved """
+
+    def setUp(self):
+        self.upstream = mock.Mock(return_value=tickers())
+        stub_kraken(self, self.upstream)
+        self.connector = CcxtConnector('kraken', settings={'symbols': ['BTC/EUR']})
+
+    def test_tickers(self):
+        """ The retrieved tickers are stored with the time of the refresh """
+        self.connector.retrieve_tickers()
+        self.assertEqual(self.connector.get_tickers()['BTC/EUR']['value'], 50000.0)
+        self.assertAlmostEqual(self.connector.get_timestamps()['tickers'], time.time(), delta=5)
+
+    def test_failing_upstream(self):
+        """ A failed fetch keeps the last tickers and their time, so their age grows """
+        self.connector.retrieve_tickers()
+        before = self.connector.get_timestamps()['tickers']
+        self.upstream.side_effect = ccxt.ExchangeNotAvailable('down')
+        time.sleep(0.01)
+        self.connector.retrieve_tickers()
+        self.assertEqual(self.connector.get_timestamps()['tickers'], before)
+        self.assertEqual(self.connector.get_tickers()['BTC/EUR']['value'], 50000.0)
+
+    def test_empty_response(self):
+        """ No timestamp without any ticker """
+        self.upstream.return_value = None
+        self.connector.retrieve_tickers()
+        self.assertNotIn('tickers', self.connector.get_timestamps())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The collector of the exchange data, with the upstream calls of the connector answered locally """
+
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+from stubs import stub_kraken, unavailable
+from exporter.connectors import get_connector
+from exporter.connectors.connector import Connector
+from exporter.crypto_collector import CryptoCollector
+from exporter.lib.snapshot import Snapshot
+
+
+def families(collector) -> dict:
+    """ Returns the collected metric families by name """
+    return {family.name: family for family in collector.collect()}
+
+
+class TestStale(unittest.TestCase):
+    """ The data restored from the snapshot stays stale until the upstream answers again """
+
+    def setUp(self):
+        self.upstream = mock.Mock(side_effect=unavailable())
+        stub_kraken(self, self.upstream)
+        directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(directory.cleanup)
+        self.snapshot = Snapshot(os.path.join(directory.name, 'snapshot'))
+        self.snapshot.save('kraken', {
+            'tickers': {'BTC/EUR': {'currency': 'BTC', 'reference_currency': 'EUR', 'value': 40000.0}},
+            'timestamps': {'tickers': time.time() - 3600},
+        })
+        self.connector = get_connector('kraken', settings={'symbols': ['BTC/EUR']})
+
+    def test_failing_upstream(self):
+        """ A refresh without any data keeps the flag up and the restored data """
+        collector = CryptoCollector(self.connector, snapshot=self.snapshot)
+        self.assertTrue(collector.stale)
+        self.assertFalse(collector.refresh())
+        self.assertTrue(collector.stale)
+        self.assertEqual(families(collector)['stale_data'].samples[0].value, 1)
+        self.assertEqual(self.connector.get_tickers()['BTC/EUR']['value'], 40000.0)
+
+    def test_recovered_upstream(self):
+        """ The first refresh with data clears the flag """
+        collector = CryptoCollector(self.connector, snapshot=self.snapshot)
+        collector.refresh()
+        self.upstream.side_effect = None
+        self.upstream.return_value = {'BTC/EUR': {'last': 50000.0, 'quoteVolume': 1.0}}
+        self.assertTrue(collector.refresh())
+        self.assertFalse(collector.stale)
+        self.assertEqual(self.connector.get_tickers()['BTC/EUR']['value'], 50000.0)
+
+
+class TestLimits(unittest.TestCase):
+    """ The cardinality limits drop the dust and the smallest series and count them """
+
+    def setUp(self):
+        self.connector = Connector()
+        self.connector.exchange = 'kraken'
+        self.connector.restore_snapshot({
+            'tickers': {
+                'BTC/EUR': {'currency': 'BTC', 'reference_currency': 'EUR', 'value': 50000.0, 'volume': 10.0},
+                'ETH/EUR': {'currency': 'ETH', 'reference_currency': 'EUR', 'value': 2000.0, 'volume': 20.0},
+                'DOGE/EUR': {'currency': 'DOGE', 'reference_currency': 'EUR', 'value': 0.1, 'volume': 5.0},
+            },
+            'accounts': {
+                'BTC': {'free': 0.001, 'used': 0.5},
+                'ETH': {'free': 2.0},
+                'DOGE': {'free': 100.0},
+                'XYZ': {'free': 0.5},
+            },
+        })
+
+    def collect(self, **limits) -> dict:
+        """ Returns the collected families with the limits """
+        return families(CryptoCollector(self.connector, limits=limits))
+
+    @staticmethod
+    def balances(collected: dict) -> dict:
+        """ Returns the exported balances by currency and account """
+        return {
+            (sample.labels['currency'], sample.labels['account']): sample.value
+            for sample in collected['account_balance'].samples
+        }
+
+    @staticmethod
+    def dropped(collected: dict) -> dict:
+        """ Returns series_dropped by family and reason """
+        return {
+            (sample.labels['family'], sample.labels['reason']): sample.value
+            for sample in collected['series_dropped'].samples
+        }
+
+    def test_dust_by_value(self):
+        """ With a reference currency the values are compared, the balances without a value are kept """
+        collected = self.collect(dust_threshold=60, dust_reference_currency='EUR')
+        self.assertEqual(set(self.balances(collected)), {('BTC', 'used'), ('ETH', 'free'), ('XYZ', 'free')})
+        self.assertEqual(self.dropped(collected), {('account_balance', 'dust'): 2})
+
+    def test_dust_by_amount(self):
+        """ Without a reference currency the plain amounts are compared """
+        collected = self.collect(dust_threshold=1)
+        self.assertEqual(set(self.balances(collected)), {('ETH', 'free'), ('DOGE', 'free')})
+        self.assertEqual(self.dropped(collected), {('account_balance', 'dust'): 3})
+
+    def test_top_n(self):
+        """ The highest balances and the most traded pairs are kept """
+        collected = self.collect(top_n_balances=2, top_n_tickers=1, dust_reference_currency='EUR')
+        self.assertEqual(set(self.balances(collected)), {('BTC', 'used'), ('ETH', 'free')})
+        self.assertEqual([sample.labels['currency'] for sample in collected['exchange_rate'].samples], ['ETH'])
+        self.assertEqual(self.dropped(collected), {('account_balance', 'top_n'): 3, ('exchange_rate', 'top_n'): 2})
+
+    def test_max_series(self):
+        """ Every scrape reaching MAX_SERIES counts as an overflow of the family """
+        collector = CryptoCollector(self.connector, limits={'max_series': 3})
+        families(collector)
+        collected = families(collector)
+        self.assertEqual(len(collected['account_balance'].samples), 3)
+        self.assertEqual(self.dropped(collected), {('account_balance', 'max_series'): 2})
+        overflows = {sample.labels['family']: sample.value for sample in collected['series_overflow'].samples}
+        self.assertEqual(overflows, {'account_balance': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
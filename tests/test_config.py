@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The config file: reloading it and applying its targets, while the unchanged targets keep their state """
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+from exporter.connectors.blockscout_connector import BlockscoutConnector
+from exporter.lib.config import ConfigWatcher
+from exporter.targets import Targets
+
+ACCOUNTS = [f'0x{i:040x}' for i in range(1, 4)]
+
+
+def target(*addresses, **settings) -> dict:
+    """ Returns the settings of a blockscout target """
+    return {'exchange': 'blockscout', 'addresses': list(addresses), **settings}
+
+
+class TestConfigWatcher(unittest.TestCase):
+    """ Only a changed and valid file is applied """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'config.json')
+        self.mtime = 1700000000
+        self.write({'targets': {'a': target(ACCOUNTS[0])}})
+        self.on_change = mock.Mock()
+        self.watcher = ConfigWatcher(self.path, self.on_change)
+
+    def write(self, config, raw=None):
+        """ Writes the config file with a newer modification time """
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(raw if raw is not None else json.dumps(config))
+        self.mtime += 1
+        os.utime(self.path, ns=(self.mtime * 10**9, self.mtime * 10**9))
+
+    def test_reload(self):
+        """ A changed file calls on_change with the new config """
+        self.assertEqual(self.watcher.load(), {'targets': {'a': target(ACCOUNTS[0])}})
+        self.assertFalse(self.watcher.check())
+        self.write({'targets': {'a': target(ACCOUNTS[1])}})
+        with self.assertLogs('crypto-exporter', level='INFO'):
+            self.assertTrue(self.watcher.check())
+        self.on_change.assert_called_once_with({'targets': {'a': target(ACCOUNTS[1])}})
+        self.assertEqual(self.watcher.reloads, {'success': 1, 'failure': 0})
+
+    def test_same_content(self):
+        """ A file written again with the same content isn't applied """
+        self.watcher.load()
+        self.write({'targets': {'a': target(ACCOUNTS[0])}})
+        self.assertFalse(self.watcher.check())
+        self.on_change.assert_not_called()
+
+    def test_invalid(self):
+        """ An invalid file is logged and counted, the last valid config stays active """
+        self.watcher.load()
+        for raw in ['{"targets": ', '{"targets": {"a": {"addresses": []}}}', '[]']:
+            self.write(None, raw=raw)
+            with self.assertLogs('crypto-exporter', level='ERROR'):
+                self.assertFalse(self.watcher.check())
+        self.on_change.assert_not_called()
+        self.assertEqual(self.watcher.reloads, {'success': 0, 'failure': 3})
+        self.write({'targets': {'a': target(ACCOUNTS[1])}})
+        self.assertTrue(self.watcher.check())
+
+
+class TestTargets(unittest.TestCase):
+    """ apply() keeps the unchanged targets, reconfigures, builds and stops the others """
+
+    def setUp(self):
+        self.targets = Targets()
+        self.addCleanup(self.targets.stop)
+        stop = mock.patch.object(BlockscoutConnector, 'stop', autospec=True)
+        self.stop = stop.start()
+        self.addCleanup(stop.stop)
+
+    def apply(self, **targets) -> dict:
+        """ Applies the targets and returns their collectors """
+        with self.assertLogs('crypto-exporter', level='INFO'):
+            self.targets.apply({'targets': targets})
+        return self.targets.get_targets()
+
+    def test_apply(self):
+        """ Every target keeps its connector, unless a setting changed that can't be reconfigured """
+        before = self.apply(a=target(ACCOUNTS[0]), b=target(ACCOUNTS[1]), c=target(ACCOUNTS[2]))
+        after = self.apply(
+            a=target(ACCOUNTS[0]),
+            b=target(ACCOUNTS[1], ACCOUNTS[2]),
+            d=target(ACCOUNTS[2], url='http://127.0.0.1:1/api'),
+        )
+        self.assertIs(after['a'], before['a'])
+        self.assertIs(after['b'], before['b'])
+        self.assertEqual(after['b'].exchange.settings['addresses'], [ACCOUNTS[1], ACCOUNTS[2]])
+        self.assertEqual(after['d'].exchange.settings['url'], 'http://127.0.0.1:1/api')
+        self.assertNotIn('c', after)
+        self.stop.assert_called_once_with(before['c'].exchange)
+
+    def test_rebuilt(self):
+        """ A target with a changed setting that can't be reconfigured is built again and the old one stopped """
+        before = self.apply(a=target(ACCOUNTS[0]))
+        after = self.apply(a=target(ACCOUNTS[0], cache_ttl=60))
+        self.assertIsNot(after['a'], before['a'])
+        self.stop.assert_called_once_with(before['a'].exchange)
+
+    def test_invalid_target(self):
+        """ A target that can't be built keeps its old settings """
+        before = self.apply(a=target(ACCOUNTS[0]))
+        with self.assertLogs('crypto-exporter', level='ERROR'):
+            self.targets.apply({'targets': {'a': {'exchange': 'blockscout', 'cache_ttl': 60}}})
+        after = self.targets.get_targets()
+        self.assertIs(after['a'], before['a'])
+        self.stop.assert_not_called()
+
+    def test_collect(self):
+        """ The samples of all the targets are merged into one family and labeled with their target """
+        def retrieve_accounts(connector):
+            connector.restore_snapshot({'accounts': {'ETH': dict.fromkeys(connector.settings['addresses'], 1.0)}})
+
+        self.apply(a=target(ACCOUNTS[0]), b=target(ACCOUNTS[1]))
+        with mock.patch.object(BlockscoutConnector, 'retrieve_accounts', autospec=True, side_effect=retrieve_accounts):
+            families = {family.name: family for family in self.targets.collect()}
+        samples = {
+            (sample.labels['target'], sample.labels['account']) for sample in families['account_balance'].samples
+        }
+        self.assertEqual(samples, {('a', ACCOUNTS[0]), ('b', ACCOUNTS[1])})
+
+
+if __name__ == '__main__':
+    unittest.main()
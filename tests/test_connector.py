@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The change detection and the retries of the JSON requests of the connectors, against a local HTTP server """
+
+import json
+import unittest
+from unittest import mock
+from stubs import HTTPStub
+from exporter.connectors.connector import Connector
+
+BODY = json.dumps({'result': [{'account': '0x1', 'balance': '1'}], 'unused': 'x' * 100}).encode()
+
+
+class TestGetJson(unittest.TestCase):
+    """ _get_json() returns the data decoded the last time, if the response didn't change """
+
+    def setUp(self):
+        self.etag = '"v1"'
+        self.stub = HTTPStub(self, self.respond)
+        self.connector = Connector()
+        self.connector.settings = {'url': self.stub.url, 'timeout': 5}
+
+    def respond(self, request: dict) -> tuple:
+        """ Answers 304 to a matching If-None-Match, the body otherwise """
+        if self.etag and request['headers'].get('If-None-Match') == self.etag:
+            return 304, {}, b''
+        return 200, {'ETag': self.etag} if self.etag else {}, BODY
+
+    def test_etag(self):
+        """ The second request is conditional and the data of the first one is returned """
+        data, changed = self.connector._get_json(self.stub.url, params={'a': 1})  # pylint: disable=protected-access
+        self.assertTrue(changed)
+        self.assertEqual(data['result'][0]['balance'], '1')
+        cached, changed = self.connector._get_json(self.stub.url, params={'a': 1})  # pylint: disable=protected-access
+        self.assertFalse(changed)
+        self.assertIs(cached, data)
+        self.assertEqual(self.stub.requests[1]['headers']['If-None-Match'], '"v1"')
+        self.assertEqual(self.connector.responses, {'changed': 1, 'unchanged': 1})
+
+    def test_params(self):
+        """ The responses are kept by URL and params """
+        self.connector._get_json(self.stub.url, params={'a': 1})  # pylint: disable=protected-access
+        _, changed = self.connector._get_json(self.stub.url, params={'a': 2})  # pylint: disable=protected-access
+        self.assertTrue(changed)
+        self.assertNotIn('If-None-Match', self.stub.requests[1]['headers'])
+
+    def test_hash(self):
+        """ Without an ETag the same body is detected by its hash """
+        self.etag = None
+        self.connector._get_json(self.stub.url)  # pylint: disable=protected-access
+        _, changed = self.connector._get_json(self.stub.url)  # pylint: disable=protected-access
+        self.assertFalse(changed)
+
+    def test_fields(self):
+        """ Only the used fields are decoded """
+        data, _ = self.connector._get_json(  # pylint: disable=protected-access
+            self.stub.url, fields={'result': [{'balance': True}]},
+        )
+        self.assertEqual(data, {'result': [{'balance': '1'}]})
+
+
+class TestGetJsonRetry(unittest.TestCase):
+    """ _get_json_retry() retries the errors its handler accepts and gives up on all the others """
+
+    def setUp(self):
+        self.statuses = []
+        self.stub = HTTPStub(self, lambda request: (self.statuses.pop(0) if self.statuses else 200, {}, BODY))
+        self.connector = Connector()
+        self.connector.settings = {'url': self.stub.url, 'timeout': 5}
+        self.get_json_retry = self.connector._get_json_retry  # pylint: disable=protected-access
+
+    def test_retried(self):
+        """ The HTTP errors accepted by the handler are retried """
+        self.statuses = [429, 429]
+        on_http_error = mock.Mock(return_value=True)
+        data, _ = self.get_json_retry(self.stub.url, on_http_error=on_http_error)
+        self.assertEqual(data['result'][0]['account'], '0x1')
+        self.assertEqual(on_http_error.call_count, 2)
+        self.assertEqual(len(self.stub.requests), 3)
+
+    def test_max_retries(self):
+        """ The request gives up after the retries """
+        self.statuses = [429] * 5
+        with self.assertLogs('crypto-exporter', level='WARNING') as logs:
+            data, _ = self.get_json_retry(self.stub.url, retries=3, on_http_error=lambda e: True)
+        self.assertIsNone(data)
+        self.assertEqual(len(self.stub.requests), 3)
+        self.assertIn('Maximum number of retries reached', logs.output[-1])
+
+    def test_fatal(self):
+        """ Without a handler an HTTP error gives up at once """
+        self.statuses = [500]
+        with self.assertLogs('crypto-exporter', level='WARNING'):
+            data, _ = self.get_json_retry(self.stub.url)
+        self.assertIsNone(data)
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_quota(self):
+        """ Every try counts against the quota and a used up quota gives up without a request """
+        self.connector.quota = mock.Mock()
+        self.connector.quota.acquire.return_value = False
+        with self.assertLogs('crypto-exporter', level='WARNING'):
+            data, _ = self.get_json_retry(self.stub.url)
+        self.assertIsNone(data)
+        self.assertEqual(self.stub.requests, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
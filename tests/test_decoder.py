@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The decoding of the JSON responses with only the used fields, and a benchmark of the streamed decoding
+
+The streamed decoding of the large responses has to select the same fields as prune() on the complete document. The
+benchmark compares the CPU time and the peak memory of both on a large token list.
+"""
+
+import json
+import time
+import tracemalloc
+import unittest
+from exporter.lib import decoder
+
+stream = decoder._stream  # pylint: disable=protected-access
+
+FIELDS = {
+    'address': True,
+    'tokens': [{'tokenInfo': {'symbol': True, 'decimals': True}, 'rawBalance': True}],
+}
+
+DOCUMENT = {
+    'address': '0xabc',
+    'countTxs': 12,
+    'ETH': {'balance': 1.5, 'price': {'rate': 2000.0}},
+    'tokens': [
+        {
+            'tokenInfo': {'symbol': 'USDT', 'decimals': '6', 'holdersCount': 100, 'image': '/usdt.png'},
+            'rawBalance': '123456789012345678901234',
+            'balance': 1.2e23,
+        },
+        {'tokenInfo': {'symbol': None, 'decimals': 18, 'website': {'url': 'https://spam'}}, 'rawBalance': '0'},
+        {'rawBalance': '7', 'totalIn': [1, 2, {'nested': []}]},
+    ],
+}
+
+
+def large_document(tokens: int) -> bytes:
+    """ Returns a token list with mostly unused fields """
+    return json.dumps({
+        'address': '0xabc',
+        'tokens': [
+            {
+                'tokenInfo': {
+                    'address': f'0x{i:040x}', 'name': f'Token {i}', 'symbol': f'T{i}', 'decimals': '18',
+                    'totalSupply': '1' * 30, 'holdersCount': i, 'description': 'x' * 200,
+                    'price': {'rate': i * 0.5, 'diff': 1.0, 'diff7d': 2.0, 'volume24h': 3.0, 'marketCapUsd': 4.0},
+                },
+                'balance': i * 1e18, 'rawBalance': str(i * 10**18), 'totalIn': i, 'totalOut': 0,
+            }
+            for i in range(tokens)
+        ],
+    }).encode()
+
+
+def measure(function) -> tuple:
+    """ Returns the CPU time in seconds and the peak of the allocated memory in MiB """
+    tracemalloc.start()
+    started = time.process_time()
+    function()
+    seconds = time.process_time() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak / 1048576
+
+
+@unittest.skipUnless(decoder.ijson, 'ijson is not installed')
+class TestStream(unittest.TestCase):
+    """ _stream() selects the same fields as prune() """
+
+    def assert_same(self, document, fields):
+        """ Decodes the document both ways """
+        content = json.dumps(document).encode()
+        self.assertEqual(stream(content, fields), decoder.prune(json.loads(content), fields))
+
+    def test_fields(self):
+        """ The unused keys and the unused nested containers are dropped """
+        self.assert_same(DOCUMENT, FIELDS)
+        self.assertEqual(stream(json.dumps(DOCUMENT).encode(), FIELDS)['tokens'][2], {'rawBalance': '7'})
+
+    def test_whole_values(self):
+        """ `True` keeps the whole value, also the containers """
+        self.assert_same(DOCUMENT, {'ETH': True, 'tokens': [True]})
+        self.assert_same(DOCUMENT, True)
+
+    def test_unexpected_shape(self):
+        """ A document with another shape (like an error) is kept as it is """
+        self.assert_same({'error': {'code': 104, 'message': 'limit exceeded'}}, {'error': True, 'data': [True]})
+        self.assert_same([1, 2, 3], {'tokens': [True]})
+        self.assert_same({'tokens': {'a': 1}}, FIELDS)
+
+    def test_numbers(self):
+        """ The large integers stay exact and the decimals become floats """
+        result = stream(b'{"a": 123456789012345678901234, "b": 0.1}', {'a': True, 'b': True})
+        self.assertEqual(result, {'a': 123456789012345678901234, 'b': 0.1})
+        self.assertIsInstance(result['b'], float)
+
+    def test_decode(self):
+        """ decode() prunes the small documents and raises ValueError for an invalid large one """
+        content = large_document(100)
+        self.assertEqual(decoder.decode(content, FIELDS), decoder.prune(json.loads(content), FIELDS))
+        with self.assertRaises(ValueError):
+            decoder.decode(b'{"tokens": [' + b'1,' * decoder.STREAM_MIN_SIZE, FIELDS)
+
+    def test_benchmark(self):
+        """ Decoding 10000 tokens completely and pruning them against the streamed decoding """
+        content = large_document(10000)
+        complete = measure(lambda: decoder.prune(decoder.loads(content), FIELDS))
+        streamed = measure(lambda: stream(content, FIELDS))
+        self.assertLess(streamed[1], complete[1], (
+            f'{len(content) / 1048576:.1f} MiB of JSON: complete {complete[0]:.3f}s {complete[1]:.1f} MiB,'
+            f' streamed {streamed[0]:.3f}s {streamed[1]:.1f} MiB'
+        ))
+
+
+if __name__ == '__main__':
+    unittest.main()
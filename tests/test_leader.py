@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The leader election among the replicas through the lease file """
+
+import json
+import os
+import tempfile
+import time
+import unittest
+from exporter.lib.leader import LeaseElection
+
+
+class TestLeaseElection(unittest.TestCase):
+    """ Only one replica holds the lease, and another one takes over when it's released or expired """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'lease')
+
+    def election(self, identity, ttl=15) -> LeaseElection:
+        """ Returns a started election, which is stopped after the test """
+        election = LeaseElection(self.path, identity=identity, ttl=ttl)
+        election.start()
+        self.addCleanup(election.stop)
+        return election
+
+    def write_lease(self, holder, expires):
+        """ Writes the lease of another replica """
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({'holder': holder, 'expires': expires}, f)
+
+    def test_one_leader(self):
+        """ The first replica takes the lease, the second one follows """
+        first = self.election('first')
+        second = self.election('second')
+        self.assertTrue(first.is_leader())
+        self.assertFalse(second.is_leader())
+        second.check()
+        self.assertFalse(second.is_leader())
+        self.assertEqual(first.transitions, 1)
+        self.assertEqual(second.transitions, 0)
+
+    def test_release(self):
+        """ The stopped leader releases the lease, so the follower takes it with its next check """
+        first = self.election('first')
+        second = self.election('second')
+        changes = []
+        second.on_change = changes.append
+        first.stop()
+        self.assertFalse(first.is_leader())
+        second.check()
+        self.assertTrue(second.is_leader())
+        self.assertEqual(changes, [True])
+
+    def test_stop_joins_the_renewal(self):
+        """ The renewal thread has finished, when stop() releases the lease, so it can't take it again """
+        first = self.election('first', ttl=0.3)
+        time.sleep(0.25)
+        first.stop()
+        time.sleep(0.25)
+        with open(self.path, 'r', encoding='utf-8') as f:
+            self.assertEqual(json.load(f)['holder'], None)
+
+    def test_expired_lease(self):
+        """ The lease of a dead replica is taken once it expired """
+        self.write_lease('dead', time.time() + 60)
+        election = self.election('alive')
+        self.assertFalse(election.is_leader())
+        self.write_lease('dead', time.time() - 1)
+        election.check()
+        self.assertTrue(election.is_leader())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The queue between the logger and the GELF handler """
+
+import logging
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+from exporter.lib.log import BatchingQueueListener, DroppingQueueHandler
+
+
+class ListHandler(logging.Handler):
+    """ Keeps the messages of the emitted records """
+
+    def __init__(self, level=logging.NOTSET, gate=None):
+        super().__init__(level)
+        self.messages = []
+        self.gate = gate
+
+    def emit(self, record):
+        if self.gate:
+            self.gate.wait()
+        self.messages.append(record.getMessage())
+
+
+def log_record(message: str, level=logging.INFO) -> logging.LogRecord:
+    """ Returns a record of the test logger """
+    return logging.LogRecord('test', level, __file__, 1, message, None, None)
+
+
+class TestDroppingQueueHandler(unittest.TestCase):
+    """ A full queue drops the new records instead of blocking the caller """
+
+    def test_dropped(self):
+        """ The dropped records are counted and exported """
+        handler = DroppingQueueHandler(maxsize=2)
+        for i in range(5):
+            handler.handle(log_record(f'message {i}'))
+        self.assertEqual(handler.queue.qsize(), 2)
+        self.assertEqual(handler.dropped, 3)
+        self.assertEqual(list(handler.collect())[0].samples[0].value, 3)
+
+    def test_prepare(self):
+        """ The queued record has its arguments merged and keeps the exception """
+        handler = DroppingQueueHandler()
+        try:
+            raise ValueError('broken')
+        except ValueError:
+            entry = logging.LogRecord('test', logging.ERROR, __file__, 1, 'failed %s', ('x',), True)
+            entry.exc_info = sys.exc_info()
+        queued = handler.prepare(entry)
+        self.assertEqual(queued.msg, 'failed x')
+        self.assertIsNone(queued.args)
+        self.assertIn('ValueError: broken', queued.exc_text)
+        self.assertIsNotNone(queued.exc_info)
+
+
+class TestBatchingQueueListener(unittest.TestCase):
+    """ The listener drains the waiting records in batches and in order """
+
+    def test_batches(self):
+        """ The waiting records are handled in batches of at most batch_size, the stop sends the rest """
+        handler = DroppingQueueHandler(maxsize=100)
+        target = ListHandler()
+        listener = BatchingQueueListener(handler.queue, target, batch_size=3)
+        for i in range(7):
+            handler.handle(log_record(f'message {i}'))
+        with mock.patch.object(listener, 'handle_batch', wraps=listener.handle_batch) as handle_batch:
+            listener.start()
+            listener.stop()
+        self.assertEqual(target.messages, [f'message {i}' for i in range(7)])
+        self.assertEqual([len(call.args[0]) for call in handle_batch.call_args_list], [3, 3, 1])
+
+    def test_level(self):
+        """ Every handler only gets the records of its level """
+        handler = DroppingQueueHandler()
+        target = ListHandler(level=logging.WARNING)
+        listener = BatchingQueueListener(handler.queue, target)
+        listener.start()
+        handler.handle(log_record('info'))
+        handler.handle(log_record('warning', logging.WARNING))
+        listener.stop()
+        self.assertEqual(target.messages, ['warning'])
+
+    def test_stop_with_full_queue(self):
+        """ The stop waits for a free slot instead of failing on a full queue """
+        handler = DroppingQueueHandler(maxsize=2)
+        gate = threading.Event()
+        target = ListHandler(gate=gate)
+        listener = BatchingQueueListener(handler.queue, target, batch_size=1)
+        listener.start()
+        for i in range(3):
+            handler.handle(log_record(f'message {i}'))
+            # the first record is taken by the listener, which waits for the gate
+            while i == 0 and handler.queue.qsize():
+                time.sleep(0.01)
+        self.assertTrue(handler.queue.full())
+        threading.Timer(0.1, gate.set).start()
+        listener.stop()
+        self.assertEqual(target.messages, ['message 0', 'message 1', 'message 2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The /probe endpoint, with the upstream calls of the connectors answered locally """
+
+import unittest
+from unittest import mock
+from prometheus_client.parser import text_string_to_metric_families
+from stubs import stub_kraken, unavailable
+from exporter.probe import Prober
+
+
+def probe_success(response: tuple) -> float:
+    """ Returns the value of probe_success from the response of the probe """
+    status, _, body = response
+    assert status == 200, body
+    for family in text_string_to_metric_families(body.decode()):
+        if family.name == 'probe_success':
+            return family.samples[0].value
+    raise AssertionError('probe_success is missing')
+
+
+class TestProber(unittest.TestCase):
+    """ probe_success shows if the refresh of the target retrieved data """
+
+    def setUp(self):
+        self.upstream = mock.Mock(return_value={'BTC/EUR': {'last': 50000.0, 'quoteVolume': 1.0}})
+        stub_kraken(self, self.upstream)
+        self.prober = Prober({'exchange': {'exchange': 'ccxt', 'symbols': ['BTC/EUR']}}, ttl=0)
+        self.addCleanup(self.prober.stop)
+
+    def probe(self) -> tuple:
+        """ Probes kraken with the exchange module """
+        return self.prober.probe({'module': ['exchange'], 'target': ['kraken']})
+
+    def test_success(self):
+        """ A refresh with tickers succeeds """
+        self.assertEqual(probe_success(self.probe()), 1)
+
+    def test_failing_upstream(self):
+        """ A failing upstream fails the probe, also if the last tickers are still served """
+        self.upstream.side_effect = unavailable()
+        self.assertEqual(probe_success(self.probe()), 0)
+        self.upstream.side_effect = None
+        self.assertEqual(probe_success(self.probe()), 1)
+        self.upstream.side_effect = unavailable()
+        response = self.probe()
+        self.assertEqual(probe_success(response), 0)
+        self.assertIn(b'exchange_rate{', response[2])
+
+    def test_unknown_module(self):
+        """ An unknown module is a bad request """
+        self.assertEqual(self.prober.probe({'module': ['other'], 'target': ['kraken']})[0], 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The on-demand profile of the refresh cycles, with the requests sent to a local HTTP server """
+
+import threading
+import unittest
+from stubs import HTTPStub
+from exporter.connectors.connector import Connector
+from exporter.lib import utils
+from exporter.lib.profiler import Profiler, wall_time
+
+
+class Collector():
+    """ Refreshes with one request to the server and builds nothing """
+
+    def __init__(self, url: str, entered=None, released=None):
+        self.url = url
+        self.exchange = Connector()
+        self.exchange.exchange = 'kraken'
+        self.entered = entered
+        self.released = released
+
+    def refresh(self):
+        """ Sends the request of the refresh """
+        if self.entered:
+            self.entered.set()
+            self.released.wait(5)
+        utils.get_session().get(self.url, timeout=5)
+
+    @staticmethod
+    def build(_snapshot) -> list:
+        """ Builds the metric families """
+        return []
+
+
+class TestProfiler(unittest.TestCase):
+    """ The report splits every cycle into network, parsing and building time """
+
+    def setUp(self):
+        self.stub = HTTPStub(self, lambda request: (200, {}, b'{}'))
+
+    def test_wall_time(self):
+        """ Overlapping requests are counted once """
+        self.assertEqual(wall_time([(0, 2), (1, 3), (5, 6), (5.5, 5.8)]), 4)
+        self.assertEqual(wall_time([]), 0)
+
+    def test_report(self):
+        """ Every cycle has its line with the number of requests, followed by cProfile and tracemalloc """
+        profiler = Profiler(Collector(self.stub.url))
+        with self.assertLogs('crypto-exporter', level='INFO'):
+            status, content_type, body = profiler.profile({'cycles': ['2'], 'sort': ['tottime'], 'limit': ['5']})
+        self.assertEqual((status, content_type), (200, 'text/plain; charset=utf-8'))
+        report = body.decode()
+        self.assertTrue(report.startswith('Profile of kraken, 2 cycles\n'))
+        lines = report.splitlines()
+        cycles = lines[3:5]
+        self.assertEqual([line.split()[0] for line in cycles], ['1', '2'])
+        self.assertEqual([line.split()[-2:] for line in cycles], [['1', '1'], ['1', '1']])
+        self.assertIn('--- cProfile (sorted by tottime) ---', report)
+        self.assertIn('--- tracemalloc', report)
+        self.assertEqual(len(self.stub.requests), 2)
+
+    def test_invalid(self):
+        """ Invalid parameters are refused """
+        profiler = Profiler(Collector(self.stub.url), max_cycles=3)
+        self.assertEqual(profiler.profile({'cycles': ['x']})[0], 400)
+        self.assertEqual(profiler.profile({'sort': ['name']})[0], 400)
+        self.assertEqual(self.stub.requests, [])
+
+    def test_running(self):
+        """ Only one profile runs at a time """
+        entered = threading.Event()
+        released = threading.Event()
+        self.addCleanup(released.set)
+        profiler = Profiler(Collector(self.stub.url, entered, released))
+        with self.assertLogs('crypto-exporter', level='INFO'):
+            running = threading.Thread(target=profiler.profile, args=({},))
+            running.start()
+            entered.wait(5)
+            self.assertEqual(profiler.profile({})[0], 409)
+            released.set()
+            running.join(5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The push of the metrics to a remote-write endpoint or a Pushgateway, against a local HTTP server """
+
+import struct
+import threading
+import time
+import unittest
+from prometheus_client.core import GaugeMetricFamily
+from stubs import HTTPStub
+from exporter.lib import push
+from exporter.lib.push import Pusher, encode_write_request, snappy_compress
+
+
+def read_varint(data: bytes, offset: int) -> tuple:
+    """ Returns the protobuf varint at the offset and the offset behind it """
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, offset
+
+
+def read_fields(data: bytes) -> list:
+    """ Returns the (number, value) of the protobuf fields with the wire types varint, 64-bit and length-delimited """
+    fields = []
+    offset = 0
+    while offset < len(data):
+        key, offset = read_varint(data, offset)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, offset = read_varint(data, offset)
+        elif wire_type == 1:
+            value, offset = struct.unpack('<d', data[offset:offset + 8])[0], offset + 8
+        elif wire_type == 2:
+            length, offset = read_varint(data, offset)
+            value, offset = data[offset:offset + length], offset + length
+        else:
+            raise ValueError(f'Unexpected wire type {wire_type}')
+        fields.append((number, value))
+    return fields
+
+
+def decode_write_request(data: bytes) -> list:
+    """ Returns the (labels, samples) of the timeseries of a WriteRequest """
+    series = []
+    for _, timeseries in read_fields(data):
+        labels = {}
+        samples = []
+        for number, value in read_fields(timeseries):
+            if number == 1:
+                label = dict(read_fields(value))
+                labels[label[1].decode()] = label[2].decode()
+            else:
+                sample = dict(read_fields(value))
+                samples.append((sample[2], sample[1]))
+        series.append((labels, samples))
+    return series
+
+
+def uncompress(data: bytes) -> bytes:
+    """ Decodes the snappy block format, as far as snappy_compress() writes it without python-snappy """
+    if push.snappy:
+        return push.snappy.uncompress(data)
+    length, offset = read_varint(data, 0)
+    out = bytearray()
+    while offset < len(data):
+        tag = data[offset]
+        offset += 1
+        if tag & 3:
+            raise ValueError('Only literals are expected')
+        size = tag >> 2
+        if size == 60:
+            size, offset = data[offset], offset + 1
+        elif size == 61:
+            size, offset = int.from_bytes(data[offset:offset + 2], 'little'), offset + 2
+        out += data[offset:offset + size + 1]
+        offset += size + 1
+    assert len(out) == length
+    return bytes(out)
+
+
+def families(value=1.0) -> list:
+    """ Returns a snapshot with one exchange rate """
+    m = GaugeMetricFamily('exchange_rate', 'Current exchange rates', labels=['currency'])
+    m.add_metric(['BTC'], value)
+    return [m]
+
+
+class Collector():  # pylint: disable=too-few-public-methods
+    """ Serves the same snapshot on every collect """
+
+    @staticmethod
+    def collect():
+        """ See https://github.com/prometheus/client_python#custom-collectors """
+        return families()
+
+
+class TestEncoding(unittest.TestCase):
+    """ The remote-write payload is a snappy compressed WriteRequest """
+
+    def test_write_request(self):
+        """ The labels and the samples of every series are encoded """
+        series = {
+            (('__name__', 'exchange_rate'), ('currency', 'BTC')): [(1700000000000, 50000.5), (1700000001000, 1.0)],
+            (('__name__', 'up'),): [(-1, 0.0)],
+        }
+        self.assertEqual(decode_write_request(encode_write_request(series)), [
+            ({'__name__': 'exchange_rate', 'currency': 'BTC'}, [(1700000000000, 50000.5), (1700000001000, 1.0)]),
+            ({'__name__': 'up'}, [(2**64 - 1, 0.0)]),
+        ])
+
+    def test_snappy(self):
+        """ The compressed data decodes to the original, also across the 64 KiB blocks """
+        for data in [b'', b'a' * 10, b'b' * 100, bytes(range(256)) * 1000]:
+            self.assertEqual(uncompress(snappy_compress(data)), data)
+
+
+class TestPusher(unittest.TestCase):
+    """ The pusher sends the queued snapshots with retries and drops the oldest ones while the endpoint is slow """
+
+    def setUp(self):
+        self.statuses = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.stub = HTTPStub(self, self.respond)
+
+    def respond(self, _request: dict) -> tuple:
+        """ Answers with the next of the statuses, once the gate is open """
+        self.gate.wait(10)
+        return (self.statuses.pop(0) if self.statuses else 200), {}, b''
+
+    def pusher(self, **kwargs) -> Pusher:
+        """ Returns a started pusher, which samples only once """
+        pusher = Pusher(Collector(), self.stub.url, interval=3600, **kwargs)
+        pusher.start()
+        self.addCleanup(pusher.stop)
+        return pusher
+
+    def wait_for(self, requests: int):
+        """ Waits until the endpoint received the requests """
+        deadline = time.time() + 10
+        while len(self.stub.requests) < requests and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.stub.requests), requests)
+
+    def test_remote_write(self):
+        """ The samples are sent with the job label and the time of the snapshot """
+        pusher = self.pusher()
+        self.wait_for(1)
+        request = self.stub.requests[0]
+        self.assertEqual(request['method'], 'POST')
+        self.assertEqual(request['headers']['Content-Encoding'], 'snappy')
+        self.assertEqual(request['headers']['Content-Type'], 'application/x-protobuf')
+        series = decode_write_request(uncompress(request['body']))
+        self.assertEqual(len(series), 1)
+        labels, samples = series[0]
+        self.assertEqual(labels, {'__name__': 'exchange_rate', 'job': 'crypto-exporter', 'currency': 'BTC'})
+        self.assertEqual(samples[0][1], 1.0)
+        self.assertAlmostEqual(samples[0][0] / 1000, time.time(), delta=10)
+        pusher.stop(flush_timeout=5)
+        self.assertEqual(pusher.stats, {'sent': 1, 'failed': 0, 'dropped': 0})
+
+    def test_pushgateway(self):
+        """ The snapshot is put to the grouping key without timestamps """
+        self.pusher(mode='pushgateway', grouping={'exchange': 'kraken'})
+        self.wait_for(1)
+        request = self.stub.requests[0]
+        self.assertEqual(request['method'], 'PUT')
+        self.assertEqual(request['path'], '/metrics/job/crypto-exporter/exchange/kraken')
+        self.assertIn(b'exchange_rate{currency="BTC"} 1.0\n', request['body'])
+
+    def test_retries(self):
+        """ A server error is retried, a rejected push isn't """
+        self.statuses = [503]
+        pusher = self.pusher(batch_size=1)
+        self.wait_for(2)
+        self.statuses = [400]
+        pusher.offer(families(2.0))
+        self.wait_for(3)
+        pusher.stop(flush_timeout=5)
+        self.assertEqual(pusher.stats, {'sent': 1, 'failed': 1, 'dropped': 0})
+
+    def test_drop_oldest(self):
+        """ While the endpoint is slow, the full queue drops its oldest snapshot and the stop sends the rest """
+        self.gate.clear()
+        pusher = self.pusher(queue_size=2, batch_size=1)
+        self.wait_for(1)
+        for value in [2.0, 3.0, 4.0]:
+            pusher.offer(families(value), timestamp=1700000000 + value)
+        self.gate.set()
+        pusher.stop(flush_timeout=5)
+        values = [
+            decode_write_request(uncompress(request['body']))[0][1][0][1] for request in self.stub.requests
+        ]
+        self.assertEqual(values, [1.0, 3.0, 4.0])
+        self.assertEqual(pusher.stats, {'sent': 3, 'failed': 0, 'dropped': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The planning of the metered API calls: which items are due with the remaining daily quota """
+
+import unittest
+from unittest import mock
+from exporter.connectors.etherscan_connector import EtherscanConnector
+from exporter.lib.quota import DAY, QuotaPlanner
+
+# 12:00 UTC, so half of the day is left
+NOON = 20000 * DAY + DAY / 2
+
+ACCOUNT = '0x0000000000000000000000000000000000000001'
+
+
+class TestQuotaPlanner(unittest.TestCase):
+    """ QuotaPlanner.due() spreads the remaining calls of the day over the items by their weight """
+
+    def setUp(self):
+        self.now = NOON
+        patcher = mock.patch('exporter.lib.quota.time.time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def planner(self, daily, values: dict) -> QuotaPlanner:
+        """ Returns a planner with the items refreshed now and planned """
+        planner = QuotaPlanner(daily=daily)
+        for key, value in values.items():
+            planner.update(key, value=value, changed=False, group='ETH')
+        planner.plan()
+        return planner
+
+    def test_unlimited(self):
+        """ Without a daily quota every item is always due """
+        planner = self.planner(None, {'a': 1})
+        self.assertTrue(planner.due('a'))
+        self.assertEqual(planner.deferred, 0)
+
+    def test_unknown_item(self):
+        """ An item which wasn't refreshed yet is due """
+        planner = self.planner(100, {'a': 1})
+        self.assertTrue(planner.due('b'))
+
+    def test_interval_by_weight(self):
+        """ The high-value item gets a shorter interval than the low-value one """
+        planner = self.planner(100, {'high': 100.0, 'low': 0.0})
+        # 100 calls in the remaining 43200s, shared by the weights 10 and 1: the intervals are about 475s and 4750s
+        self.now += 400
+        self.assertFalse(planner.due('high'))
+        self.now += 200
+        self.assertTrue(planner.due('high'))
+        self.assertFalse(planner.due('low'))
+        self.now += 4400
+        self.assertTrue(planner.due('low'))
+        self.assertEqual(planner.deferred, 2)
+
+    def test_used_up(self):
+        """ Nothing is due when the quota is used up, until the next day """
+        planner = self.planner(2, {'a': 1})
+        self.assertTrue(planner.acquire())
+        self.assertTrue(planner.acquire())
+        self.assertFalse(planner.acquire())
+        self.assertFalse(planner.due('b'))
+        self.assertEqual(planner.stats(), {'limit': 2, 'remaining': 0, 'deferred': 1})
+        self.now += DAY / 2
+        self.assertTrue(planner.due('b'))
+        self.assertEqual(planner.remaining(), 2)
+
+    def test_exhaust(self):
+        """ The upstream reports the quota as used up """
+        planner = self.planner(1000, {'a': 1})
+        planner.exhaust()
+        self.assertEqual(planner.remaining(), 0)
+        self.assertFalse(planner.acquire())
+
+
+class TestUsedUpQuota(unittest.TestCase):
+    """ A connector keeps working, when the quota is used up before all the items were refreshed once """
+
+    def setUp(self):
+        self.responses = []
+        patcher = mock.patch.object(EtherscanConnector, '_get_json', self.get_json)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_json(self, _url, params=None, **_kwargs) -> tuple:
+        """ Answers like etherscan and records the request """
+        self.responses.append(params['action'])
+        if params['action'] == 'balancemulti':
+            return {'message': 'OK', 'result': [{'account': ACCOUNT, 'balance': '2000000000000000000'}]}, True
+        return {'message': 'OK', 'result': '5000000'}, True
+
+    def test_deferred_before_first_refresh(self):
+        """ The token deferred without a refresh has no age, the balance of the one call is served """
+        connector = EtherscanConnector(settings={
+            'api_key': 'key',
+            'addresses': [ACCOUNT],
+            'tokens': [{'short': 'USDT', 'contract': '0xdac17f958d2ee523a2206206994597c13d831ec7', 'decimals': 6}],
+            'quota_daily': 1,
+        })
+        connector.retrieve_accounts()
+        self.assertEqual(self.responses, ['balancemulti'])
+        self.assertEqual(connector.get_accounts(), {'ETH': {ACCOUNT: 2.0}, 'USDT': {}})
+        self.assertIn('accounts', connector.get_timestamps())
+        self.assertEqual(connector.get_quota_stats(), {'limit': 1, 'remaining': 0, 'deferred': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Recording the upstream responses of a local HTTP server and replaying them without it """
+
+import os
+import tempfile
+import unittest
+import requests
+from stubs import HTTPStub
+from exporter.lib import replay
+
+
+class TestRequestKey(unittest.TestCase):
+    """ The requests match without the parameters that change on every request """
+
+    def test_query(self):
+        """ The query parameters are sorted and the volatile ones dropped """
+        self.assertEqual(
+            replay.request_key('GET', 'https://api.example.com/balance?b=2&nonce=1&a=1&apikey=secret#top'),
+            'GET https://api.example.com/balance?a=1&b=2',
+        )
+
+    def test_body(self):
+        """ The JSON and the form bodies are normalized the same way """
+        self.assertEqual(
+            replay.request_key('POST', 'https://api.example.com/', b'{"b": 2, "timestamp": 1, "a": 1}'),
+            'POST https://api.example.com/ {"a": 1, "b": 2}',
+        )
+        self.assertEqual(
+            replay.request_key('POST', 'https://api.example.com/', 'b=2&signature=x&a=1'),
+            'POST https://api.example.com/ a=1&b=2',
+        )
+
+
+class TestRecordReplay(unittest.TestCase):
+    """ The recorded responses are replayed in order and without any network access """
+
+    def setUp(self):
+        self.count = 0
+        self.stub = HTTPStub(self, self.respond)
+        directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(directory.cleanup)
+        self.fixture = os.path.join(directory.name, 'fixture.jsonl.gz')
+
+    def respond(self, _request: dict) -> tuple:
+        """ Answers with the number of the request and the API key """
+        self.count += 1
+        return 200, {'Content-Type': 'application/json', 'ETag': f'"{self.count}"'}, (
+            f'{{"count": {self.count}, "key": "secret"}}'.encode()
+        )
+
+    def session(self, **kwargs) -> requests.Session:
+        """ Returns a session with the recording or the replaying adapter """
+        session = requests.Session()
+        self.addCleanup(session.close)
+        replay.install(session, **kwargs)
+        return session
+
+    def replayed(self) -> requests.Session:
+        """ Records two responses for the same request with different nonces and returns a replaying session """
+        with self.assertLogs('crypto-exporter', level='WARNING'):
+            session = self.session(record=self.fixture, redact=lambda message: message.replace('secret', '***'))
+        for nonce in [1, 2]:
+            session.get(f'{self.stub.url}/balance', params={'nonce': nonce, 'apikey': 'secret'})
+        with self.assertLogs('crypto-exporter', level='INFO'):
+            return self.session(replay=self.fixture, speed=0)
+
+    def test_replay(self):
+        """ The responses come back in the recorded order and start over, the server isn't asked anymore """
+        session = self.replayed()
+        counts = [session.get(f'{self.stub.url}/balance', params={'nonce': 9}).json()['count'] for _ in range(3)]
+        self.assertEqual(counts, [1, 2, 1])
+        self.assertEqual(len(self.stub.requests), 2)
+        response = session.get(f'{self.stub.url}/balance')
+        self.assertEqual(response.headers['ETag'], '"2"')
+        self.assertEqual(response.json()['key'], '***')
+
+    def test_unknown_request(self):
+        """ A request that wasn't recorded fails like a connection error """
+        session = self.replayed()
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            session.get(f'{self.stub.url}/other')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The accounts of the ripple connector read from rippled, with the requests answered locally """
+
+import unittest
+from unittest import mock
+from stubs import WebSocketStub, wait_for
+from exporter.connectors.ripple_connector import RippleConnector, RippledClient, RIPPLE_EPOCH
+
+ACCOUNT = 'rPEPPER7kfTD9w2To4CQk6UCfuHM9c6GDY'
+CLOSE_TIME = 800000000
+
+
+def result(command: str, balance='25000000') -> dict:
+    """ Returns the result of the command like rippled """
+    return {
+        'account_info': {'account_data': {'Balance': balance}},
+        'account_lines': {'lines': [{'currency': 'USD', 'balance': '10.5'}]},
+        'ledger': {'ledger': {'close_time': CLOSE_TIME}},
+        'subscribe': {},
+    }[command]
+
+
+class TestRippled(unittest.TestCase):
+    """ The accounts timestamp only moves, if an account was read """
+
+    def setUp(self):
+        self.failing = set()
+        patcher = mock.patch.object(RippledClient, 'request', self.request)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.connector = RippleConnector(settings={'addresses': [ACCOUNT], 'rippled_url': 'http://localhost:5005'})
+        self.addCleanup(self.connector.stop)
+
+    def request(self, command: str, **_params) -> dict:
+        """ Answers the requests like rippled, unless the command is failing """
+        if command in self.failing:
+            raise ConnectionError(f'{command} failed')
+        return result(command)
+
+    def test_accounts(self):
+        """ The balances are stored with the close time of the validated ledger """
+        self.connector.retrieve_accounts()
+        self.assertEqual(self.connector.get_accounts(), {'XRP': {ACCOUNT: 25.0}, 'USD': {ACCOUNT: 10.5}})
+        self.assertEqual(self.connector.get_timestamps()['accounts'], CLOSE_TIME + RIPPLE_EPOCH)
+
+    def test_failing_ledger(self):
+        """ Without the ledger the accounts get the time of the refresh """
+        self.failing.add('ledger')
+        self.connector.retrieve_accounts()
+        self.assertGreater(self.connector.get_timestamps()['accounts'], CLOSE_TIME + RIPPLE_EPOCH)
+
+    def test_failing_upstream(self):
+        """ Without any account read, the accounts keep the time of their last read """
+        self.connector.retrieve_accounts()
+        self.failing.update(['account_info', 'ledger'])
+        with self.assertLogs('crypto-exporter', level='WARNING'):
+            self.connector.retrieve_accounts()
+        self.assertEqual(self.connector.get_timestamps()['accounts'], CLOSE_TIME + RIPPLE_EPOCH)
+
+    def test_transaction_after_stop(self):
+        """ A transaction still arriving from the stream after stop() is ignored """
+        self.connector.stop()
+        on_transaction = self.connector._RippleConnector__on_transaction  # pylint: disable=protected-access
+        on_transaction({'type': 'transaction', 'transaction': {'Account': ACCOUNT}})
+        self.assertEqual(self.connector.get_accounts(), {})
+
+
+
+class TestRippledWebSocket(unittest.TestCase):
+    """ Over WebSocket the accounts are subscribed and only read again after a transaction or a lost connection """
+
+    def setUp(self):
+        self.balance = '25000000'
+        self.stub = WebSocketStub(self, self.respond)
+        self.connector = RippleConnector(settings={
+            'addresses': [ACCOUNT], 'rippled_url': self.stub.url, 'rippled_subscribe': True,
+        })
+        self.addCleanup(self.connector.stop)
+
+    def respond(self, message: dict) -> list:
+        """ Answers the request like rippled """
+        return [{
+            'id': message.get('id'),
+            'status': 'success',
+            'type': 'response',
+            'result': result(message['command'], self.balance),
+        }]
+
+    def commands(self) -> list:
+        """ Returns the commands received by rippled """
+        return [message['command'] for message in self.stub.messages]
+
+    def xrp(self):
+        """ Returns the XRP balance of the account """
+        return self.connector.get_accounts().get('XRP', {}).get(ACCOUNT)
+
+    def test_subscription(self):
+        """ The accounts are subscribed before they are read and a transaction reads the account again """
+        self.connector.retrieve_accounts()
+        self.assertEqual(self.commands(), ['subscribe', 'account_info', 'account_lines', 'ledger'])
+        self.assertEqual(self.stub.messages[0]['accounts'], [ACCOUNT])
+        self.assertEqual(self.xrp(), 25.0)
+
+        self.balance = '30000000'
+        self.stub.send({'type': 'transaction', 'validated': True, 'transaction': {'Account': ACCOUNT}})
+        wait_for(lambda: self.xrp() == 30.0)
+        self.assertEqual(self.xrp(), 30.0)
+
+        read = len(self.stub.messages)
+        self.connector.retrieve_accounts()
+        self.assertEqual(self.commands()[read:], ['ledger'])
+        self.assertEqual(self.stub.connections, 1)
+
+    def test_reconnect(self):
+        """ After a lost connection the accounts are subscribed and read again """
+        self.connector.retrieve_accounts()
+        with self.assertLogs('crypto-exporter', level='WARNING') as logs:
+            self.stub.drop()
+            wait_for(lambda: logs.records)
+        self.assertIn('Lost the connection', logs.output[0])
+        self.balance = '30000000'
+        self.connector.retrieve_accounts()
+        self.assertEqual(self.stub.connections, 2)
+        self.assertEqual(self.commands()[4:], ['subscribe', 'account_info', 'account_lines', 'ledger'])
+        self.assertEqual(self.stub.messages[4]['accounts'], [ACCOUNT])
+        self.assertEqual(self.xrp(), 30.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The adaptive intervals of the refresh scheduler """
+
+import unittest
+from unittest import mock
+from stubs import wait_for
+from exporter.connectors.connector import Connector
+from exporter.lib.scheduler import RefreshScheduler
+
+TICKERS = {'BTC/EUR': {'currency': 'BTC', 'reference_currency': 'EUR', 'value': 40000.0}}
+
+
+class Upstream(Connector):
+    """ Answers the tickers with `value`, fails while `value` is None and doesn't provide the accounts """
+
+    def __init__(self):
+        super().__init__()
+        self.value = 40000.0
+
+    def retrieve_tickers(self):
+        if self.value is None:
+            return
+        self._tickers = {'BTC/EUR': dict(TICKERS['BTC/EUR'], value=self.value)}
+        self._set_timestamp('tickers')
+
+
+class TestRefreshScheduler(unittest.TestCase):
+    """ The interval grows while the data doesn't change, shrinks when it does and backs off after a failure """
+
+    def setUp(self):
+        self.connector = Upstream()
+        self.scheduler = RefreshScheduler(self.connector, intervals={'tickers': 10, 'accounts': 100}, max_factor=8)
+        self.on_refresh = mock.Mock()
+        self.scheduler.on_refresh = self.on_refresh
+
+    def interval(self) -> float:
+        """ Returns the interval of the tickers """
+        return self.scheduler.get_intervals()['tickers']
+
+    def test_intervals(self):
+        """ Unchanged data grows the interval by 50%, changed data halves it, within the configured limits """
+        self.scheduler.refresh('tickers')
+        self.assertEqual(self.interval(), 10)
+        self.scheduler.refresh('tickers')
+        self.assertEqual(self.interval(), 15)
+        self.connector.value = 41000.0
+        self.scheduler.refresh('tickers')
+        self.assertEqual(self.interval(), 10)
+        for _ in range(10):
+            self.scheduler.refresh('tickers')
+        self.assertEqual(self.interval(), 80)
+        self.assertEqual(self.scheduler.get_max_intervals(), {'tickers': 80, 'accounts': 800})
+
+    def test_throttled(self):
+        """ A throttling exchange doubles the interval """
+        with mock.patch.object(self.connector, 'get_rate_limit_headroom', return_value=0.1):
+            self.scheduler.refresh('tickers')
+        self.assertEqual(self.interval(), 20)
+
+    def test_failed(self):
+        """ A failed refresh backs off, keeps the restored data and doesn't warm the scheduler up """
+        self.scheduler.restore_snapshot({'tickers': TICKERS, 'timestamps': {'tickers': 1700000000.0}})
+        self.connector.restore_snapshot({'tickers': TICKERS, 'timestamps': {'tickers': 1700000000.0}})
+        self.connector.value = None
+        self.scheduler.refresh('tickers')
+        self.scheduler.refresh('accounts')
+        self.assertEqual(self.interval(), 20)
+        self.assertFalse(self.scheduler.warm())
+        self.assertEqual(self.scheduler.get_snapshot()['timestamps'], {'tickers': 1700000000.0})
+        self.on_refresh.assert_called_once_with('accounts')
+
+        self.connector.value = 41000.0
+        self.scheduler.refresh('tickers')
+        self.assertEqual(self.interval(), 10)
+        self.assertTrue(self.scheduler.warm())
+        self.assertEqual(self.scheduler.get_snapshot()['tickers']['BTC/EUR']['value'], 41000.0)
+
+    def test_not_provided(self):
+        """ A data class the connector doesn't provide counts as refreshed """
+        self.scheduler.refresh('accounts')
+        self.scheduler.refresh('accounts')
+        self.assertEqual(self.scheduler.get_intervals()['accounts'], 150)
+        self.assertEqual(self.scheduler.get_snapshot()['accounts'], {})
+        self.assertEqual(self.on_refresh.call_count, 2)
+
+    def test_raised(self):
+        """ A refresh raising an exception backs off """
+        with mock.patch.object(self.connector, 'retrieve_tickers', side_effect=ValueError('broken')):
+            with self.assertLogs('crypto-exporter', level='ERROR'):
+                self.scheduler.start()
+                wait_for(lambda: self.interval() > 10)
+            self.scheduler.stop(timeout=5)
+        self.assertEqual(self.interval(), 20)
+        self.assertFalse(self.scheduler.warm())
+
+
+if __name__ == '__main__':
+    unittest.main()
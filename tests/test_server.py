@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The metrics server: content negotiation, compression, keep-alive and the concurrency limit """
+
+import gzip
+import http.client
+import socket
+import threading
+import unittest
+from prometheus_client import CollectorRegistry
+from prometheus_client.core import GaugeMetricFamily
+from exporter.lib.server import MetricsServer, accepted_encodings
+
+
+class Rates():  # pylint: disable=too-few-public-methods
+    """ Serves enough exchange rates for a compressed response """
+
+    @staticmethod
+    def collect():
+        """ See https://github.com/prometheus/client_python#custom-collectors """
+        m = GaugeMetricFamily('exchange_rate', 'Current exchange rates', labels=['currency'])
+        for i in range(100):
+            m.add_metric([f'COIN{i}'], float(i))
+        yield m
+
+
+def free_port() -> int:
+    """ Returns a port nobody listens on """
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class TestMetricsServer(unittest.TestCase):
+    """ The responses of the server to the requests of a real HTTP client """
+
+    def setUp(self):
+        registry = CollectorRegistry(auto_describe=True)  # like the default REGISTRY
+        registry.register(Rates())
+        self.server = MetricsServer(free_port(), registry=registry, address='127.0.0.1', max_concurrency=1,
+                                    queue_timeout=0.2)
+        self.server.start()
+        self.addCleanup(self.server.stop, 1)
+
+    def connection(self) -> http.client.HTTPConnection:
+        """ Returns a connection to the server """
+        connection = http.client.HTTPConnection('127.0.0.1', self.server.port, timeout=5)
+        self.addCleanup(connection.close)
+        return connection
+
+    def get(self, path='/metrics', method='GET', **headers) -> tuple:
+        """ Returns the response and its body """
+        connection = self.connection()
+        connection.request(method, path, headers={name.replace('_', '-'): value for name, value in headers.items()})
+        response = connection.getresponse()
+        return response, response.read()
+
+    def test_text_format(self):
+        """ Without an Accept header the Prometheus text format is served """
+        response, body = self.get()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader('Content-Type'), 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertIn(b'exchange_rate{currency="COIN1"} 1.0\n', body)
+        self.assertIsNone(response.getheader('Content-Encoding'))
+
+    def test_openmetrics(self):
+        """ A client accepting OpenMetrics gets it """
+        response, body = self.get(Accept='application/openmetrics-text; version=1.0.0')
+        self.assertTrue(response.getheader('Content-Type').startswith('application/openmetrics-text'))
+        self.assertTrue(body.endswith(b'# EOF\n'))
+
+    def test_gzip(self):
+        """ The response is compressed, if the client accepts gzip """
+        plain = self.get()[1]
+        response, body = self.get(Accept_Encoding='deflate, gzip')
+        self.assertEqual(response.getheader('Content-Encoding'), 'gzip')
+        self.assertEqual(response.getheader('Vary'), 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(body), plain)
+        self.assertLess(len(body), len(plain))
+        response, body = self.get(Accept_Encoding='gzip;q=0')
+        self.assertIsNone(response.getheader('Content-Encoding'))
+        self.assertEqual(body, plain)
+
+    def test_small_response(self):
+        """ A response below MIN_COMPRESS_SIZE isn't compressed """
+        self.server.route('/ping', lambda params, headers: (200, 'text/plain; charset=utf-8', b'pong\n'))
+        response, body = self.get('/ping', Accept_Encoding='gzip')
+        self.assertIsNone(response.getheader('Content-Encoding'))
+        self.assertEqual(body, b'pong\n')
+
+    def test_accepted_encodings(self):
+        """ The codings with q=0 are refused """
+        self.assertEqual(accepted_encodings('GZIP;q=0.5, zstd;q=0, br'), ['gzip', 'br'])
+        self.assertEqual(accepted_encodings(None), [])
+
+    def test_keep_alive(self):
+        """ An HTTP/1.1 connection serves several requests """
+        connection = self.connection()
+        for _ in range(3):
+            connection.request('GET', '/metrics')
+            response = connection.getresponse()
+            response.read()
+            self.assertEqual(response.getheader('Connection'), 'keep-alive')
+        response, _ = self.get(Connection='close')
+        self.assertEqual(response.getheader('Connection'), 'close')
+
+    def test_restricted(self):
+        """ name[] restricts the served metric families """
+        self.assertNotIn(b'exchange_rate', self.get('/metrics?name[]=other')[1])
+        self.assertIn(b'exchange_rate', self.get('/metrics?name[]=exchange_rate')[1])
+
+    def test_errors(self):
+        """ Unknown paths, other methods and failing handlers get their status """
+        self.assertEqual(self.get('/missing')[0].status, 404)
+        self.assertEqual(self.get(method='POST')[0].status, 405)
+        self.server.route('/broken', lambda params, headers: 1 / 0)
+        with self.assertLogs('crypto-exporter', level='ERROR'):
+            self.assertEqual(self.get('/broken')[0].status, 500)
+        response, body = self.get(method='HEAD')
+        self.assertEqual(body, b'')
+        self.assertGreater(int(response.getheader('Content-Length')), 0)
+
+    def test_overload(self):
+        """ A request waiting longer than queue_timeout for a free handler gets a 503 """
+        entered = threading.Event()
+        released = threading.Event()
+        self.addCleanup(released.set)
+
+        def slow_handler(_params, _headers):
+            entered.set()
+            released.wait(5)
+            return 200, 'text/plain; charset=utf-8', b''
+
+        self.server.route('/slow', slow_handler)
+        slow = threading.Thread(target=self.get, args=('/slow',))
+        slow.start()
+        entered.wait(5)
+        self.assertEqual(self.get()[0].status, 503)
+        released.set()
+        slow.join(5)
+
+
+if __name__ == '__main__':
+    unittest.main()
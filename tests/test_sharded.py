@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The addresses of a connector sharded across worker processes, against a local HTTP server """
+
+import json
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+from stubs import HTTPStub
+from exporter.connectors.sharded_connector import ShardedConnector
+
+ADDRESSES = [f'0x{i:040x}' for i in range(1, 4)]
+WEI = 1000000000000000000
+
+
+def json_body(data: dict) -> bytes:
+    """ Returns the JSON response body """
+    return json.dumps(data).encode()
+
+
+class TestShardedConnector(unittest.TestCase):
+    """ Every worker reads its shard of the addresses and a hanging worker is replaced """
+
+    def setUp(self):
+        self.hanging = set()
+        self.released = threading.Event()
+        self.addCleanup(self.released.set)
+        self.stub = HTTPStub(self, self.respond)
+        patcher = mock.patch.dict(os.environ, {'ADDRESSES': ','.join(ADDRESSES), 'URL': self.stub.url})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.connector = ShardedConnector('blockscout', workers=2, timeout=30)
+        self.addCleanup(self.connector.stop)
+
+    def respond(self, request: dict) -> tuple:
+        """ Answers the balances like blockscout, every address has its number in ETH """
+        query = {key: values[0] for key, values in parse_qs(urlsplit(request['path']).query).items()}
+        addresses = query['address'].split(',')
+        if self.hanging.intersection(addresses):
+            self.released.wait()
+        if query['action'] == 'balancemulti':
+            result = [{'account': address, 'balance': str(int(address, 16) * WEI)} for address in addresses]
+        else:
+            result = []
+        return 200, {}, json_body({'message': 'OK', 'result': result})
+
+    def balancemulti(self) -> list:
+        """ Returns the addresses of the balancemulti requests """
+        return sorted(
+            parse_qs(urlsplit(request['path']).query)['address'][0]
+            for request in self.stub.requests if 'balancemulti' in request['path']
+        )
+
+    def test_shards(self):
+        """ The addresses are split across the workers and their accounts are merged """
+        self.connector.retrieve_accounts()
+        balances = {address: i + 1.0 for i, address in enumerate(ADDRESSES)}
+        self.assertEqual(self.connector.get_accounts(), {'ETH': balances})
+        self.assertEqual(self.balancemulti(), [f'{ADDRESSES[0]},{ADDRESSES[2]}', ADDRESSES[1]])
+        self.assertIn('accounts', self.connector.get_timestamps())
+
+    def test_hanging_worker(self):
+        """ A worker not answering in time is restarted and the last data of its shard is served meanwhile """
+        self.connector.retrieve_accounts()
+        refreshed = time.time()
+        self.hanging.add(ADDRESSES[1])
+        self.connector.timeout = 1
+        with self.assertLogs('crypto-exporter', level='WARNING') as logs:
+            self.connector.retrieve_accounts()
+        self.assertIn('Worker 1 did not answer within 1s. Restarting it.', logs.output[0])
+        self.assertEqual(self.connector.get_accounts()['ETH'][ADDRESSES[1]], 2.0)
+        # as old as the last answer of the restarted shard
+        self.assertLess(self.connector.get_timestamps()['accounts'], refreshed)
+
+        self.hanging.clear()
+        self.connector.timeout = 30
+        self.connector.retrieve_accounts()
+        self.assertEqual(len(self.connector.get_accounts()['ETH']), 3)
+        self.assertGreater(self.connector.get_timestamps()['accounts'], refreshed)
+
+
+if __name__ == '__main__':
+    unittest.main()
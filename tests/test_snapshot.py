@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The snapshot of the last good data, which is served right after a restart """
+
+import os
+import tempfile
+import unittest
+from exporter.lib.snapshot import Snapshot
+
+DATA = {
+    'tickers': {'BTC/EUR': {'currency': 'BTC', 'reference_currency': 'EUR', 'value': 40000.0}},
+    'accounts': {'BTC': {'main': 1.5}},
+    'transactions': {('BTC', 'deposit', 'in', 'main'): 2.0},
+    'timestamps': {'tickers': 1700000000.0},
+}
+
+
+class TestSnapshot(unittest.TestCase):
+    """ The snapshot keeps the data of one exchange and ignores the unreadable files """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.snapshot = Snapshot(os.path.join(self.directory, 'snapshot'))
+
+    def test_round_trip(self):
+        """ The loaded data equals the saved data, including the tuple keys of the transactions """
+        self.assertIsNone(self.snapshot.modified())
+        self.snapshot.save('kraken', DATA)
+        self.assertIsNotNone(self.snapshot.modified())
+        data = self.snapshot.load('kraken')
+        self.assertIsInstance(data.pop('time'), float)
+        self.assertEqual(data, DATA)
+        self.assertEqual(os.listdir(self.directory), ['snapshot'])
+
+    def test_other_exchange(self):
+        """ The snapshot of another exchange isn't loaded """
+        self.snapshot.save('binance', DATA)
+        with self.assertLogs('crypto-exporter', level='WARNING'):
+            self.assertIsNone(self.snapshot.load('kraken'))
+
+    def test_unreadable(self):
+        """ A missing, foreign or corrupted file is ignored """
+        self.assertIsNone(self.snapshot.load('kraken'))
+        self.snapshot.save('kraken', DATA)
+        with open(self.snapshot.path, 'r+b') as f:
+            f.seek(-4, os.SEEK_END)
+            f.write(b'xxxx')
+        with self.assertLogs('crypto-exporter', level='WARNING'):
+            self.assertIsNone(self.snapshot.load('kraken'))
+        with open(self.snapshot.path, 'wb') as f:
+            f.write(b'{"tickers": {}}')
+        with self.assertLogs('crypto-exporter', level='WARNING') as logs:
+            self.assertIsNone(self.snapshot.load('kraken'))
+        self.assertIn('Unknown file format', logs.output[0])
+
+    def test_failed_save(self):
+        """ A failed save keeps the last snapshot """
+        snapshot = Snapshot(os.path.join(self.directory, 'missing', 'snapshot'))
+        with self.assertLogs('crypto-exporter', level='WARNING'):
+            snapshot.save('kraken', DATA)
+        self.assertIsNone(snapshot.modified())
+
+
+if __name__ == '__main__':
+    unittest.main()
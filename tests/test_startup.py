@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Startup benchmark of the ccxt connector: the time to the first successful scrape and the RSS after it
+
+The exporter is started in a subprocess, once with the lazily loaded exchange and once after a full `import ccxt`,
+which is what the exporter did before. The upstream calls are answered locally, so only the startup is measured.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = '''
+import json, resource, sys, time
+started = time.perf_counter()
+
+
+def peak_rss() -> int:
+    # ru_maxrss is kept across exec on Linux, so it would report the peak of the parent (the test runner)
+    try:
+        with open('/proc/self/status', encoding='utf-8') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('VmHWM:'))
+    except (OSError, StopIteration):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+if sys.argv[1] == 'eager':
+    import ccxt  # pylint: disable=unused-import
+from prometheus_client.core import CollectorRegistry
+from prometheus_client.exposition import generate_latest
+from exporter.lib.lazy_ccxt import get_exchange
+from exporter.connectors.ccxt_connector import CcxtConnector
+from exporter.crypto_collector import CryptoCollector
+
+exchange_class = get_exchange('kraken')
+exchange_class.fetch_markets = lambda self, params=None: [{'symbol': 'BTC/EUR', 'base': 'BTC', 'quote': 'EUR'}]
+exchange_class.fetch_tickers = lambda self, symbols=None, params=None: {
+    'BTC/EUR': {'last': 50000.0, 'quoteVolume': 1.0, 'timestamp': time.time() * 1000},
+}
+registry = CollectorRegistry()
+registry.register(CryptoCollector(CcxtConnector('kraken', settings={'symbols': ['BTC/EUR']})))
+body = generate_latest(registry).decode()
+assert 'exchange_rate{currency="BTC",exchange="kraken",reference_currency="EUR"} 50000.0' in body, body
+exchanges = [
+    name for name in sys.modules
+    if name.startswith('ccxt.') and name.count('.') == 1 and not name.startswith(('ccxt.base', 'ccxt.static'))
+    and name != 'ccxt.abstract'
+]
+print(json.dumps({
+    'seconds': time.perf_counter() - started,
+    'rss_kib': peak_rss(),
+    'exchanges': len(exchanges),
+}))
+'''
+
+
+def measure(mode: str) -> dict:
+    """ Starts the exporter in a subprocess and returns its startup time, RSS and the imported exchanges """
+    output = subprocess.run(
+        [sys.executable, '-c', SCRIPT, mode],
+        cwd=ROOT,
+        env={**os.environ, 'PYTHONPATH': ROOT},
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+class TestStartup(unittest.TestCase):
+    """ The lazily loaded exchange starts faster and uses less memory than the full ccxt package """
+
+    def test_first_scrape(self):
+        """ Only the configured exchange is imported """
+        lazy = measure('lazy')
+        eager = measure('eager')
+        result = (
+            f"first scrape: lazy {lazy['seconds']:.2f}s {lazy['rss_kib'] / 1024:.0f} MiB,"
+            f" import ccxt {eager['seconds']:.2f}s {eager['rss_kib'] / 1024:.0f} MiB"
+        )
+        self.assertEqual(lazy['exchanges'], 1)
+        self.assertGreater(eager['exchanges'], 1)
+        self.assertLess(lazy['rss_kib'], eager['rss_kib'], result)
+        self.assertLess(lazy['seconds'], eager['seconds'], result)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The ticker stream over the WebSocket API of the exchange, against a local WebSocket server """
+
+import json
+import threading
+import unittest
+from unittest import mock
+import aiohttp
+import ccxt
+from stubs import WebSocketStub, patch, stub_kraken, wait_for
+from exporter.connectors import get_connector
+from exporter.connectors.ccxt_connector import TickerStream
+
+
+class StandInExchange():
+    """ A ccxt.pro exchange, which subscribes to the tickers of the local WebSocket server """
+    id = 'standin'
+    has = {'watchTickers': True}
+    url = None
+
+    def __init__(self, options=None):
+        self.options = options
+        self.session = None
+        self.ws = None
+
+    @staticmethod
+    async def load_markets() -> dict:
+        """ Returns the markets like ccxt """
+        return {'BTC/EUR': {'symbol': 'BTC/EUR', 'base': 'BTC', 'quote': 'EUR'}}
+
+    async def watch_tickers(self, symbols=None) -> dict:
+        """ Connects and subscribes with the first call, then returns the next update """
+        if not self.ws:
+            self.session = aiohttp.ClientSession()
+            self.ws = await self.session.ws_connect(self.url)
+            await self.ws.send_json({'method': 'subscribe', 'symbols': symbols})
+        message = await self.ws.receive()
+        if message.type != aiohttp.WSMsgType.TEXT:
+            raise ccxt.NetworkError('Connection closed')
+        return json.loads(message.data)
+
+    async def close(self):
+        """ Closes the connection """
+        if self.session:
+            await self.session.close()
+
+
+def ticker(value: float) -> dict:
+    """ Returns the update of the BTC/EUR ticker """
+    return {'BTC/EUR': {'symbol': 'BTC/EUR', 'last': value, 'quoteVolume': 1.0}}
+
+
+class TestTickerStream(unittest.TestCase):
+    """ The stream subscribes to the tickers and subscribes again after a lost connection """
+
+    def setUp(self):
+        self.stub = WebSocketStub(self, lambda message: [])
+        patch(self, StandInExchange, url=self.stub.url)
+        self.updates = []
+        self.stream = TickerStream(StandInExchange, {}, symbols=list, on_tickers=self.updates.append)
+        self.stream.start()
+        self.addCleanup(self.stream.stop)
+        wait_for(lambda: self.stub.messages)
+
+    def test_subscription(self):
+        """ The selected symbols are subscribed and every update is passed on """
+        self.assertEqual(self.stub.messages, [{'method': 'subscribe', 'symbols': ['BTC/EUR']}])
+        self.assertFalse(self.stream.healthy())
+        self.stub.send(ticker(50000.0))
+        wait_for(lambda: self.updates)
+        self.assertEqual(self.updates, [ticker(50000.0)])
+        self.assertTrue(self.stream.healthy())
+
+    def test_reconnect(self):
+        """ A lost connection is made again and the tickers are subscribed again """
+        with self.assertLogs('crypto-exporter', level='WARNING') as logs:
+            self.stub.drop()
+            wait_for(lambda: len(self.stub.messages) == 2)
+        self.assertIn('The ticker stream failed. Reconnecting in 1s.', logs.output[0])
+        self.assertEqual(self.stream.reconnects, 1)
+        self.assertEqual(self.stub.connections, 2)
+        self.assertEqual(self.stub.messages[1], self.stub.messages[0])
+        self.stub.send(ticker(51000.0))
+        wait_for(lambda: self.updates)
+        self.assertEqual(self.updates, [ticker(51000.0)])
+
+
+class TestStreamedConnector(unittest.TestCase):
+    """ The connector polls the tickers over REST while the stream is unhealthy """
+
+    def setUp(self):
+        self.stub = WebSocketStub(self, lambda message: [])
+        patch(self, StandInExchange, url=self.stub.url)
+        patcher = mock.patch('exporter.connectors.ccxt_connector.get_pro_exchange', return_value=StandInExchange)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.upstream = mock.Mock(return_value=ticker(40000.0))
+        stub_kraken(self, self.upstream)
+        self.connector = get_connector('kraken', settings={
+            'symbols': ['BTC/EUR'], 'stream_tickers': True, 'stream_max_age': 1,
+        })
+        self.addCleanup(self.connector.stop)
+        wait_for(lambda: self.stub.messages)
+
+    def test_fallback(self):
+        """ REST before the first update, the stream while it delivers, REST again after it stopped delivering """
+        self.connector.retrieve_tickers()
+        self.assertEqual(self.connector.get_tickers()['BTC/EUR']['value'], 40000.0)
+        self.assertEqual(self.upstream.call_count, 1)
+
+        self.stub.send(ticker(50000.0))
+        wait_for(lambda: self.connector.get_tickers()['BTC/EUR']['value'] == 50000.0)
+        self.connector.retrieve_tickers()
+        self.assertEqual(self.connector.get_tickers()['BTC/EUR']['value'], 50000.0)
+        self.assertEqual(self.upstream.call_count, 1)
+
+        threading.Event().wait(1)  # time.sleep() is patched by stub_kraken()
+        self.upstream.return_value = ticker(45000.0)
+        self.connector.retrieve_tickers()
+        self.assertEqual(self.connector.get_tickers()['BTC/EUR']['value'], 45000.0)
+        self.assertEqual(self.upstream.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The rate limit shared by the ccxt instances of the API_KEYS """
+
+import threading
+import time
+import unittest
+from exporter.connectors.ccxt_connector import SharedThrottle
+
+
+class TestSharedThrottle(unittest.TestCase):
+    """ The requests of all the instances are spaced by the rate limit of the exchange """
+
+    def test_spacing(self):
+        """ Every request reserves the next slot, scaled by its cost """
+        throttle = SharedThrottle(rate_limit=50)
+        started = time.monotonic()
+        throttle.throttle()
+        self.assertLess(time.monotonic() - started, 0.04)
+        throttle.throttle(cost=2)
+        throttle.throttle()
+        self.assertGreaterEqual(time.monotonic() - started, 0.15 - 0.01)
+
+    def test_threads(self):
+        """ The concurrent requests of several instances get one slot each """
+        throttle = SharedThrottle(rate_limit=20)
+        times = []
+        lock = threading.Lock()
+
+        def request():
+            throttle.throttle()
+            with lock:
+                times.append(time.monotonic())
+
+        threads = [threading.Thread(target=request) for _ in range(10)]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(times), 10)
+        self.assertGreaterEqual(max(times) - started, 9 * 0.02 - 0.01)
+
+    def test_idle(self):
+        """ An idle throttle doesn't build up a burst """
+        throttle = SharedThrottle(rate_limit=50)
+        throttle.throttle()
+        time.sleep(0.1)
+        started = time.monotonic()
+        throttle.throttle()
+        throttle.throttle()
+        self.assertGreaterEqual(time.monotonic() - started, 0.05 - 0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" The token metadata index with the spam filter """
+
+import json
+import os
+import tempfile
+import unittest
+from exporter.lib.tokens import TokenIndex
+
+USDT = '0xdAC17F958D2ee523a2206206994597C13D831ec7'
+SPAM = '0x1111111111111111111111111111111111111111'
+
+
+class TestTokenIndex(unittest.TestCase):
+    """ TokenIndex.lookup() reads the metadata of a token once and skips the spam tokens """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'tokens.json')
+
+    def test_lookup(self):
+        """ The metadata is parsed from the first response only, the address is case insensitive """
+        index = TokenIndex()
+        entry = index.lookup(USDT, {'symbol': 'USDT', 'decimals': '6'})
+        self.assertEqual(entry, {'symbol': 'USDT', 'decimals': 6, 'scale': 1000000, 'spam': False})
+        self.assertIs(index.lookup(USDT.lower(), {'symbol': 'CHANGED', 'decimals': '18'}), entry)
+
+    def test_spam(self):
+        """ A missing or long symbol is spam, unless the contract is allowed; a denied contract is always spam """
+        index = TokenIndex(allow=[SPAM], deny=[USDT.lower()])
+        self.assertIsNone(index.lookup(USDT, {'symbol': 'USDT', 'decimals': 6}))
+        self.assertIsNone(index.lookup('0x2', {'symbol': 'Visit https://claim-now.example', 'decimals': 18}))
+        self.assertIsNone(index.lookup('0x3', {'decimals': 18}))
+        entry = index.lookup(SPAM, {'symbol': 'Visit https://claim-now.example', 'decimals': 18})
+        self.assertEqual(entry['scale'], 10**18)
+
+    def test_invalid_decimals(self):
+        """ A token with broken decimals can't be valued, so it's skipped, unless it's allowed """
+        index = TokenIndex(allow=[SPAM])
+        self.assertIsNone(index.lookup('0x2', {'symbol': 'ABC', 'decimals': 'x'}))
+        self.assertEqual(index.lookup(SPAM, {'symbol': 'ABC', 'decimals': None})['scale'], 1)
+
+    def test_without_address(self):
+        """ Without a contract address the metadata is read from every response """
+        index = TokenIndex()
+        self.assertEqual(index.lookup(None, {'symbol': 'ETH', 'decimals': 18})['decimals'], 18)
+        self.assertEqual(index.lookup(None, {'symbol': 'ETH', 'decimals': 9})['decimals'], 9)
+
+    def test_save_and_load(self):
+        """ Only the metadata is stored, the spam verdict is calculated with the lists on loading """
+        index = TokenIndex(self.path)
+        index.lookup(USDT, {'symbol': 'USDT', 'decimals': '6'})
+        index.lookup(SPAM, {'symbol': None, 'decimals': 0})
+        index.save()
+        with open(self.path, 'r', encoding='utf-8') as f:
+            self.assertEqual(json.load(f), {'tokens': {USDT.lower(): ['USDT', 6], SPAM: [None, 0]}})
+        index = TokenIndex(self.path, allow=[SPAM], deny=[USDT])
+        self.assertIsNone(index.lookup(USDT, {}))
+        self.assertEqual(index.lookup(SPAM, {})['symbol'], None)
+
+    def test_invalid_file(self):
+        """ An invalid index is ignored """
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write('{"tokens": ')
+        with self.assertLogs('crypto-exporter', level='WARNING'):
+            index = TokenIndex(self.path)
+        self.assertEqual(index.lookup(USDT, {'symbol': 'USDT', 'decimals': 6})['decimals'], 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of the TRACE logging and of the caller lookup of the error handlers, with TRACE disabled
+
+The TRACE messages format the whole tickers, markets, ledgers and accounts. trace() only formats them, if TRACE is
+enabled, and utils._caller() reads one frame instead of walking the stack with inspect.
+"""
+
+import inspect
+import logging
+import timeit
+import unittest
+from exporter.lib import utils
+from exporter.lib.log import TRACE, trace
+
+TICKERS = {
+    f'C{i}/EUR': {'currency': f'C{i}', 'reference_currency': 'EUR', 'value': i * 1.5, 'volume': i * 100.0}
+    for i in range(2000)
+}
+
+
+def per_call(function, number=200) -> float:
+    """ Returns the time of one call in milliseconds """
+    return min(timeit.repeat(function, number=number, repeat=3)) / number * 1000
+
+
+def nested(depth: int, function):
+    """ Calls the function `depth` frames deep """
+    return function() if depth == 0 else nested(depth - 1, function)
+
+
+class TestTrace(unittest.TestCase):
+    """ trace() doesn't format the message while TRACE is disabled """
+
+    def setUp(self):
+        self.log = logging.getLogger('crypto-exporter.test-trace')
+        self.log.setLevel(logging.INFO)
+
+    def test_lazy_message(self):
+        """ The message is formatted only with TRACE enabled, and logged with the caller as function """
+        calls = []
+        trace(self.log, lambda: calls.append(1) or 'message')
+        self.assertEqual(calls, [])
+        self.log.setLevel(TRACE)
+        with self.assertLogs(self.log, level=TRACE) as logs:
+            trace(self.log, lambda: calls.append(1) or 'message')
+        self.assertEqual(calls, [1])
+        self.assertEqual(logs.records[0].getMessage(), 'message')
+        self.assertEqual(logs.records[0].funcName, 'test_lazy_message')
+
+    def test_benchmark(self):
+        """ Formatting 2000 tickers eagerly against trace() """
+        eager = per_call(lambda: self.log.log(TRACE, f'Found these tickers: {TICKERS}'), number=20)
+        lazy = per_call(lambda: trace(self.log, lambda: f'Found these tickers: {TICKERS}'), number=20000)
+        self.assertLess(lazy * 100, eager, f'f-string {eager:.3f} ms, trace() {lazy:.5f} ms per call')
+
+    def test_caller_benchmark(self):
+        """ The caller lookup 20 frames deep: inspect.stack() against utils._caller() """
+
+        def handler_inspect():
+            return inspect.stack()[1].function
+
+        def handler_frame():
+            return utils._caller()  # pylint: disable=protected-access
+
+        def caller_inspect():
+            return handler_inspect()
+
+        def caller_frame():
+            return handler_frame()
+
+        self.assertEqual(nested(20, caller_frame), 'caller_frame')
+        slow = per_call(lambda: nested(20, caller_inspect), number=20)
+        fast = per_call(lambda: nested(20, caller_frame), number=2000)
+        self.assertLess(fast * 10, slow, f'inspect.stack() {slow:.3f} ms, sys._getframe() {fast:.4f} ms per call')
+
+
+if __name__ == '__main__':
+    unittest.main()